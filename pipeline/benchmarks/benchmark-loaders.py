@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+#################################################################
+#################################################################
+############### Datasets2Tools Loader Benchmark #################
+#################################################################
+#################################################################
+##### Author: Denis Torre
+##### Affiliation: Ma'ayan Laboratory,
+##### Icahn School of Medicine at Mount Sinai
+
+#############################################
+########## 1. Load libraries
+#############################################
+##### 1. Python modules #####
+import sys, os, json, time, shutil, tempfile, resource, argparse, traceback, multiprocessing
+import pandas as pd
+import sqlalchemy
+from sqlalchemy import event
+
+##### 2. Custom modules #####
+benchmarkDir = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [benchmarkDir, os.path.join(benchmarkDir, '..'), os.path.join(benchmarkDir, '..', 'scripts')]
+import synthetic, stubs, db, geo, lincs, staging, parallel, bulkload, serving, snapshot
+from CannedAnalysisTable import CannedAnalysisTable
+
+#############################################
+########## 2. General Setup
+#############################################
+##### 1. Variables #####
+schemaFile = os.path.join(benchmarkDir, 'schema.sql')
+localHosts = ['localhost', '127.0.0.1', '::1']
+
+##### 2. Statement counter #####
+statementCount = [0]
+
+@event.listens_for(sqlalchemy.engine.Engine, 'before_cursor_execute')
+def countStatement(conn, cursor, statement, parameters, context, executemany):
+	statementCount[0] += 1
+
+#######################################################
+#######################################################
+########## S1. Setup
+#######################################################
+#######################################################
+
+#############################################
+########## 1. Pipeline Module
+#############################################
+
+def loadPipeline():
+
+	# Import the pipeline module, whose command line only runs from main()
+	import pipeline_datasets2tools_database
+	return pipeline_datasets2tools_database
+
+#############################################
+########## 2. Database
+#############################################
+
+def createDatabase(connectionFile, nTerms):
+
+	# Create a fresh database
+	engine = db.connect(connectionFile, 'phpmyadmin')
+	engine.execute('DROP DATABASE IF EXISTS datasets2tools')
+	engine.execute('CREATE DATABASE datasets2tools')
+
+	# Create tables
+	engine = db.connect(connectionFile, 'phpmyadmin', 'datasets2tools')
+	with open(schemaFile) as openfile:
+		for statement in [x for x in openfile.read().split(';') if x.strip() and not x.strip().startswith('--')]:
+			engine.execute(statement)
+
+	# Add the known metadata terms
+	pd.DataFrame({'term_name': synthetic.knownTerms(nTerms), 'term_description': ''}).to_sql('term', engine, if_exists='append', index=False)
+
+#############################################
+########## 3. Input Files
+#############################################
+
+def writeInputs(args):
+
+	# Make directories
+	for directory in ['f1-mysql.dir', 'f2-tools.dir', 'f3-repositories.dir', 'f4-datasets.dir', 'f5-analyses.dir', 'f6-featured.dir']:
+		if not os.path.exists(directory):
+			os.makedirs(directory)
+
+	# Write files
+	shutil.copy(args.connection_file, 'f1-mysql.dir/conn.json')
+	synthetic.writeTools('f2-tools.dir/tools.xlsx', args.tools)
+	synthetic.writeRepositories('f3-repositories.dir/repositories'+staging.extension('repositories'))
+	synthetic.writeCannedAnalyses('creeds-canned_analyses.txt', args.analyses/10, args.keys, nDatasets=args.datasets, newDatasetShare=0, nTools=args.tools, seed=1)
+	synthetic.writeCannedAnalyses('archs4-canned_analyses.txt', args.analyses, args.keys, nDatasets=args.datasets, newDatasetShare=args.new_dataset_share, newTermShare=args.new_term_share, nTools=args.tools, seed=2)
+
+#######################################################
+#######################################################
+########## S2. Stages
+#######################################################
+#######################################################
+
+#############################################
+########## 1. Run Stage
+#############################################
+
+def runStage(stageName, function, rowsIn, servers):
+	'''
+	Runs a stage in a forked process, so its peak memory is measured on its own, and
+	returns its wall time, throughput, SQL statements and requests to the stub servers.
+	'''
+	# Run in child
+	queue = multiprocessing.Queue()
+	def target():
+		try:
+			startStatements = statementCount[0]
+			startTime = time.time()
+			function()
+			queue.put({'seconds': time.time()-startTime, 'statements': statementCount[0]-startStatements, 'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024.})
+		except Exception:
+			queue.put({'error': traceback.format_exc()})
+
+	# Wait for result
+	startRequests = sum([x.requestCount for x in servers])
+	process = multiprocessing.Process(target=target)
+	process.start()
+	resultDict = queue.get()
+	process.join()
+
+	# Add counts
+	resultDict.update({'stage': stageName, 'rows': rowsIn, 'http_requests': sum([x.requestCount for x in servers])-startRequests})
+	if 'seconds' in resultDict:
+		resultDict['rows_per_second'] = round(rowsIn/resultDict['seconds'], 1) if resultDict['seconds'] else None
+	return resultDict
+
+#############################################
+########## 2. Canned Analysis Table
+#############################################
+
+def loadCannedAnalyses(infile, connectionFile, lookupMode, compact, dedup):
+	engine = db.connect(connectionFile, 'phpmyadmin', 'datasets2tools')
+	table = CannedAnalysisTable(pd.read_table(infile), engine, verbose=0, lookup_mode=lookupMode, compact=compact, dedup=dedup)
+	table.load_data()
+	table.write_metadata()
+	table.transaction.commit()
+
+def streamCannedAnalyses(infile, connectionFile, lookupMode, compact, dedup):
+	engine = db.connect(connectionFile, 'phpmyadmin', 'datasets2tools')
+	table = CannedAnalysisTable.stream_file(infile, engine, [], chunksize=5000, verbose=0, lookup_mode=lookupMode, compact=compact, dedup=dedup)
+	table.commit_transaction([], commit=True)
+
+#############################################
+########## 3. Rebuild Indexes
+#############################################
+
+def rebuildIndexes(connectionFile):
+	engine = db.connect(connectionFile, 'phpmyadmin', 'datasets2tools')
+	stateDict = bulkload.rebuildIndexes(engine, 'f1-mysql.dir/deferred-indexes.json')
+	bulkload.analyzeTables(engine)
+	orphanList = bulkload.findOrphans(engine, stateDict['foreign_keys'])
+	if orphanList:
+		raise ValueError('Orphan rows after the bulk load: {}'.format(orphanList))
+
+#############################################
+########## 4. Stage List
+#############################################
+
+def getStages(P, args):
+
+	# Get row counts
+	connectionFile = 'f1-mysql.dir/conn.json'
+	nCreeds = args.analyses/10
+
+	# Get intermediate names
+	datasetFile = 'f4-datasets.dir/creeds-datasets'+P.stageExtension
+	lincsFile = 'f4-datasets.dir/lincs-datasets'+P.stageExtension
+	mergedFile = 'f4-datasets.dir/datasets'+P.stageExtension
+	featuredFile = 'f6-featured.dir/featured-{}'+P.stageExtension
+
+	# Get stages
+	stageList = [('loadTools', lambda: P.loadTools(['f2-tools.dir/tools.xlsx', connectionFile], 'f2-tools.dir/tools.load'), args.tools),
+			('loadRepositories', lambda: P.loadRepositories(['f3-repositories.dir/repositories'+P.repositoryStageExtension, connectionFile], 'f3-repositories.dir/repositories.load'), 30),
+			('annotateGeoDatasets', lambda: P.annotateGeoDatasets('creeds-canned_analyses.txt', datasetFile), nCreeds),
+			('getLincsDatasets', lambda: P.getLincsDatasets(None, lincsFile), args.lincs_datasets),
+			('mergeDatasets', lambda: P.mergeDatasets([datasetFile, lincsFile], mergedFile), nCreeds+args.lincs_datasets),
+			('loadDatasets', lambda: P.loadDatasets(mergedFile, 'f4-datasets.dir/datasets.load'), nCreeds+args.lincs_datasets),
+			('CannedAnalysisTable.load_data', lambda: loadCannedAnalyses('archs4-canned_analyses.txt', connectionFile, args.lookup_mode, args.compact, not args.no_dedup), args.analyses),
+			('CannedAnalysisTable.stream_file', lambda: streamCannedAnalyses('archs4-canned_analyses.txt', connectionFile, args.lookup_mode, args.compact, not args.no_dedup), args.analyses),
+			('parallel.loadFiles', lambda: parallel.loadFiles(['archs4-canned_analyses.txt'], 'f5-analyses.dir/canned_analyses.load', connectionFile, 'phpmyadmin', 'datasets2tools', workers=args.workers, chunkSize=max(args.analyses/args.workers, 1), lookupMode=args.lookup_mode, compact=args.compact, dedup=not args.no_dedup, verbose=0), args.analyses),
+			('loadAnalyses', lambda: P.loadAnalyses('archs4-canned_analyses.txt', 'f5-analyses.dir/archs4-canned_analyses.load'), args.analyses),
+			('getFeaturedAnalyses', lambda: P.getFeaturedAnalyses(None, featuredFile.format('analysis')), args.analyses),
+			('getFeaturedDatasets', lambda: P.getFeaturedDatasets(None, featuredFile.format('dataset')), args.analyses),
+			('getFeaturedTools', lambda: P.getFeaturedTools(None, featuredFile.format('tool')), args.analyses),
+			('loadFeaturedTables', lambda: [P.loadFeaturedTables(featuredFile.format(x), 'f6-featured.dir/featured-{}.load'.format(x)) for x in ['analysis', 'dataset', 'tool']], 1500*2+args.tools*50)]
+
+	# Rebuild deferred indexes at the end
+	if args.bulk_load:
+		stageList.append(('rebuildIndexes', lambda: rebuildIndexes(connectionFile), args.analyses*(args.keys+1)))
+
+	# Build the serving table, then rebuild it with nothing changed
+	stageList += [('serving.buildTable', lambda: serving.buildTable(db.connect(connectionFile, 'phpmyadmin', 'datasets2tools')), args.analyses),
+				  ('serving.buildTable (unchanged)', lambda: serving.buildTable(db.connect(connectionFile, 'phpmyadmin', 'datasets2tools')), args.analyses),
+				  ('snapshot.exportSnapshot', lambda: snapshot.exportSnapshot({'datasets2tools': db.connect(connectionFile, 'phpmyadmin', 'datasets2tools')}, 'datasets2tools.sqlite', tables=snapshot.snapshotTables[:1]), args.analyses*(args.keys+2))]
+	return stageList
+
+#######################################################
+#######################################################
+########## S3. Run
+#######################################################
+#######################################################
+
+if __name__ == '__main__':
+
+	# Parse arguments
+	parser = argparse.ArgumentParser(description='Run the Datasets2Tools loaders on synthetic data against a scratch MySQL database and report per-stage throughput.')
+	parser.add_argument('--connection-file', required=True, help='conn.json whose "phpmyadmin" entry points at a scratch MySQL server.  The datasets2tools database on it is dropped and recreated.')
+	parser.add_argument('--allow-remote', action='store_true', help='Allow a connection file that points at a host other than localhost.')
+	parser.add_argument('--analyses', type=int, default=10000)
+	parser.add_argument('--keys', type=int, default=10, help='Metadata keys per analysis.')
+	parser.add_argument('--datasets', type=int, default=1000, help='Known datasets.')
+	parser.add_argument('--new-dataset-share', type=float, default=0.1)
+	parser.add_argument('--new-term-share', type=float, default=0.1)
+	parser.add_argument('--tools', type=int, default=20)
+	parser.add_argument('--lincs-datasets', type=int, default=2000, help='Datasets served by the stub LINCS Data Portal.')
+	parser.add_argument('--workers', type=int, default=4, help='Worker processes of the parallel analysis loader.')
+	parser.add_argument('--bulk-load', action='store_true', help='Drop foreign keys and secondary indexes before loading and rebuild them in a final stage.')
+	parser.add_argument('--compact', action='store_true', help='Use the compact frame representation of CannedAnalysisTable.')
+	parser.add_argument('--no-dedup', action='store_true', help='Load analyses without the fingerprint index.  With it, CannedAnalysisTable.stream_file and parallel.loadFiles reload the file loaded by the stage before and measure a rerun.')
+	parser.add_argument('--lookup-mode', default='index', choices=['full', 'index', 'server'], help='How CannedAnalysisTable resolves foreign keys.')
+	parser.add_argument('--upload-fail-every', type=int, default=0, help='Make every n-th request to the stand-in upload server fail.')
+	parser.add_argument('--eutils-rate', type=float, default=100, help='Requests per second allowed to the stub E-utilities server.')
+	parser.add_argument('--workdir', help='Directory for the synthetic inputs and outputs; a temporary one by default.')
+	parser.add_argument('--output', help='Append results to this JSON lines file.')
+	args = parser.parse_args()
+
+	# Refuse to drop a remote database by accident
+	host = db.connect(args.connection_file, 'phpmyadmin', returnData=True)[0]
+	if host.split(':')[0] not in localHosts and not args.allow_remote:
+		raise ValueError('Connection file points at {}, not a local server.  Pass --allow-remote if it is a scratch database.'.format(host))
+
+	# Set up
+	args.connection_file = os.path.abspath(args.connection_file)
+	args.output = args.output and os.path.abspath(args.output)
+	workdir = args.workdir or tempfile.mkdtemp(prefix='d2t-benchmark-')
+	if not os.path.exists(workdir):
+		os.makedirs(workdir)
+	os.chdir(workdir)
+	writeInputs(args)
+	createDatabase('f1-mysql.dir/conn.json', args.keys*2)
+	if args.bulk_load:
+		bulkload.deferIndexes(db.connect('f1-mysql.dir/conn.json', 'phpmyadmin', 'datasets2tools'), 'f1-mysql.dir/deferred-indexes.json')
+	db.disposeEngines()
+
+	# Point annotation and the LINCS fetcher at stub servers
+	eutilsServer = stubs.startEutilsServer()
+	geo.eutilsUrl = eutilsServer.url
+	geo.rateLimiter = geo.RateLimiter(args.eutils_rate)
+	lincsServer = stubs.startLincsServer(args.lincs_datasets, missingEvery=10)
+	lincs.lincsUrl = lincsServer.url
+	uploadServer = stubs.startUploadServer(failEvery=args.upload_fail_every)
+
+	# Run stages, uploading analyses to the stand-in server
+	P = loadPipeline()
+	P.uploadMode = 'ndjson'
+	P.uploadUrl = uploadServer.url + '/datasets2tools/api/upload'
+	resultList = []
+	for stageName, function, rowsIn in getStages(P, args):
+		resultDict = runStage(stageName, function, rowsIn, [eutilsServer, lincsServer, uploadServer])
+		resultList.append(resultDict)
+		if 'error' in resultDict:
+			sys.stderr.write('{} failed:\n{}'.format(stageName, resultDict['error']))
+			break
+	eutilsServer.stop()
+	lincsServer.stop()
+	uploadServer.stop()
+
+	# Report
+	resultDataframe = pd.DataFrame([x for x in resultList if 'error' not in x], columns=['stage', 'rows', 'seconds', 'rows_per_second', 'statements', 'http_requests', 'peak_rss_mb'])
+	print(resultDataframe.round(3).to_string(index=False))
+	print('Work directory: ' + workdir)
+
+	# Save
+	if args.output:
+		with open(args.output, 'a') as openfile:
+			for resultDict in resultList:
+				openfile.write(json.dumps(dict(resultDict, timestamp=time.time(), analyses=args.analyses, keys=args.keys)) + '\n')
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+#################################################################
+#################################################################
+############### Datasets2Tools Metadata Benchmark ###############
+#################################################################
+#################################################################
+##### Author: Denis Torre
+##### Affiliation: Ma'ayan Laboratory,
+##### Icahn School of Medicine at Mount Sinai
+
+#############################################
+########## 1. Load libraries
+#############################################
+##### 1. Python modules #####
+import sys, os, json, time, argparse
+import pandas as pd
+import numpy as np
+
+##### 2. Custom modules #####
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+from CannedAnalysisTable import CannedAnalysisTable
+
+#############################################
+########## 2. General Setup
+#############################################
+##### 1. Variables #####
+analysisCounts = [1000, 10000, 100000]
+keyCounts = [5, 20]
+
+#######################################################
+#######################################################
+########## S1. Benchmark Table
+#######################################################
+#######################################################
+
+#############################################
+########## 1. Table
+#############################################
+
+class BenchmarkTable(CannedAnalysisTable):
+	'''
+	Canned analysis table that assigns IDs locally instead of inserting, so only the
+	in-memory work of load_analyses, check_datasets and check_terms is timed.
+	'''
+	def insert_dataframe(self, dataframe, tableName, connection):
+		dataframe['id'] = np.arange(len(dataframe.index)) + 1
+		return dataframe
+
+	def annotate_datasets(self, dataset_accessions, attributes = ['title', 'summary']):
+		return {x: {'title': '', 'summary': '', 'repository_name': '', 'dataset_landing_url': ''} for x in dataset_accessions}
+
+#############################################
+########## 2. Synthetic Data
+#############################################
+
+def makeTable(nAnalyses, nKeys, newShare=0.5):
+
+	# Get input
+	nDatasets = max(nAnalyses/10, 1)
+	inputDataframe = pd.DataFrame({'dataset_accession': ['GSE{}'.format(x) for x in np.random.randint(0, nDatasets, nAnalyses)],
+								   'tool_name': 'tool',
+								   'canned_analysis_url': ['http://example.org/{}'.format(x) for x in range(nAnalyses)],
+								   'canned_analysis_title': 'title',
+								   'canned_analysis_description': 'description',
+								   'canned_analysis_preview_url': '',
+								   'metadata': [json.dumps({'term{}'.format(j): 'value{}'.format(i) for j in range(nKeys)}) for i in range(nAnalyses)]})
+
+	# Get table, with a share of datasets and terms already known
+	table = BenchmarkTable(inputDataframe, None, verbose=0, dedup=False)
+	table.tool_df = pd.DataFrame({'tool_fk': [1], 'tool_name': ['tool']})
+	table.dataset_df = pd.DataFrame({'dataset_fk': np.arange(int(nDatasets*(1-newShare))), 'dataset_accession': ['GSE{}'.format(x) for x in range(int(nDatasets*(1-newShare)))]})
+	table.term_df = pd.DataFrame({'term_fk': np.arange(int(nKeys*(1-newShare))), 'term_name': ['term{}'.format(x) for x in range(int(nKeys*(1-newShare)))]})
+	table.repo_df = pd.DataFrame({'repository_fk': [1], 'repository_name': ['']})
+	table.connection = None
+	table.annotate_input()
+	return table
+
+#######################################################
+#######################################################
+########## S2. Run
+#######################################################
+#######################################################
+
+#############################################
+########## 1. Time Phases
+#############################################
+
+def timePhases(nAnalyses, nKeys):
+
+	# Loop through phases
+	table = makeTable(nAnalyses, nKeys)
+	resultDict = {'analyses': nAnalyses, 'keys': nKeys, 'metadata_rows': nAnalyses*nKeys}
+	for phase, method in [('check_datasets', table.check_datasets), ('load_analyses', table.load_analyses)]:
+		startTime = time.time()
+		method()
+		resultDict[phase] = round(time.time()-startTime, 3)
+	return resultDict
+
+#############################################
+########## 2. Main
+#############################################
+
+if __name__ == '__main__':
+
+	# Parse arguments
+	parser = argparse.ArgumentParser(description='Time metadata explosion and foreign-key resolution in CannedAnalysisTable.')
+	parser.add_argument('--analyses', type=int, nargs='+', default=analysisCounts)
+	parser.add_argument('--keys', type=int, nargs='+', default=keyCounts)
+	args = parser.parse_args()
+
+	# Run
+	np.random.seed(0)
+	resultDataframe = pd.DataFrame([timePhases(nAnalyses, nKeys) for nAnalyses in args.analyses for nKeys in args.keys], columns=['analyses', 'keys', 'metadata_rows', 'check_datasets', 'load_analyses'])
+	print(resultDataframe.to_string(index=False))
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+#################################################################
+#################################################################
+############### Datasets2Tools Startup Benchmark ################
+#################################################################
+#################################################################
+##### Author: Denis Torre
+##### Affiliation: Ma'ayan Laboratory,
+##### Icahn School of Medicine at Mount Sinai
+
+#############################################
+########## 1. Load libraries
+#############################################
+##### 1. Python modules #####
+import sys, os, json, time, shutil, tempfile, argparse, subprocess
+
+#############################################
+########## 2. General Setup
+#############################################
+##### 1. Variables #####
+pipelineDir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+pipelineFile = os.path.join(pipelineDir, 'pipeline-datasets2tools-database.py')
+
+# Modules that must only be imported by the tasks that use them
+heavyModules = ['pandas', 'numpy', 'sqlalchemy', 'requests', 'bs4', 'pyarrow', 'db', 'CannedAnalysisTable']
+
+# Script timing the import in a fresh interpreter
+importScript = '''
+import sys, time, json
+sys.path.insert(0, {pipelineDir!r})
+startTime = time.time()
+import pipeline_datasets2tools_database
+print(json.dumps({{'seconds': time.time()-startTime, 'heavy_modules': sorted([x for x in {heavyModules!r} if x in sys.modules])}}))
+'''
+
+#######################################################
+#######################################################
+########## S1. Measurements
+#######################################################
+#######################################################
+
+#############################################
+########## 1. Import
+#############################################
+
+def timeImport():
+
+	# Import in a fresh interpreter, so nothing is cached
+	output = subprocess.check_output([sys.executable, '-c', importScript.format(pipelineDir=pipelineDir, heavyModules=heavyModules)])
+	return json.loads(output.strip().splitlines()[-1])
+
+#############################################
+########## 2. Command Line
+#############################################
+
+def timeCommand(arguments, workdir):
+
+	# Run the command line in an empty work directory, whose inputs are all missing
+	startTime = time.time()
+	with open(os.devnull, 'w') as devnull:
+		subprocess.check_call([sys.executable, pipelineFile] + arguments, cwd=workdir, stdout=devnull, stderr=devnull)
+	return {'seconds': time.time()-startTime}
+
+#######################################################
+#######################################################
+########## S2. Run
+#######################################################
+#######################################################
+
+if __name__ == '__main__':
+
+	# Parse arguments
+	parser = argparse.ArgumentParser(description='Time importing the Datasets2Tools pipeline and starting its command line, and fail if either is too slow or loads heavy modules at import.')
+	parser.add_argument('--repeat', type=int, default=5, help='Runs of each measurement; the fastest is kept.')
+	parser.add_argument('--max-seconds', type=float, default=1.0, help='Fail if any measurement takes longer.')
+	parser.add_argument('--output', help='Append results to this JSON lines file.')
+	args = parser.parse_args()
+
+	# Measure
+	workdir = tempfile.mkdtemp(prefix='d2t-startup-')
+	measurements = [('import', timeImport),
+					('--list', lambda: timeCommand(['--list'], workdir)),
+					('--just_print loadTools', lambda: timeCommand(['--just_print', 'loadTools'], workdir)),
+					('--help', lambda: timeCommand(['--help'], workdir))]
+	resultList = []
+	try:
+		for name, function in measurements:
+			runs = [function() for i in range(args.repeat)]
+			resultList.append(dict(min(runs, key=lambda x: x['seconds']), measurement=name))
+	finally:
+		shutil.rmtree(workdir)
+
+	# Report
+	for resultDict in resultList:
+		print('{:<28}{:>8.3f} s{}'.format(resultDict['measurement'], resultDict['seconds'], '  imported ' + ', '.join(resultDict['heavy_modules']) if resultDict.get('heavy_modules') else ''))
+
+	# Save
+	if args.output:
+		with open(args.output, 'a') as openfile:
+			for resultDict in resultList:
+				openfile.write(json.dumps(dict(resultDict, timestamp=time.time())) + '\n')
+
+	# Guard
+	failures = ['{} took {:.3f} s'.format(x['measurement'], x['seconds']) for x in resultList if x['seconds'] > args.max_seconds]
+	failures += ['import loaded ' + ', '.join(x['heavy_modules']) for x in resultList if x.get('heavy_modules')]
+	if failures:
+		sys.exit('Startup regressed: ' + '; '.join(failures) + '.')
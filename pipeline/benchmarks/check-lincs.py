@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+#################################################################
+#################################################################
+############### Datasets2Tools LINCS Fetch Check ################
+#################################################################
+#################################################################
+##### Author: Denis Torre
+##### Affiliation: Ma'ayan Laboratory,
+##### Icahn School of Medicine at Mount Sinai
+
+#############################################
+########## 1. Load libraries
+#############################################
+##### 1. Python modules #####
+import sys, os, shutil, tempfile, argparse
+
+##### 2. Custom modules #####
+benchmarkDir = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [benchmarkDir, os.path.join(benchmarkDir, '..', 'scripts')]
+import stubs, lincs, staging
+
+#############################################
+########## 2. General Setup
+#############################################
+##### 1. Variables #####
+# Datasets served, page size and pages in flight of each case
+caseList = [(1050, 100, 4), (1000, 100, 4), (1000, 100, 1), (50, 100, 4), (0, 100, 4)]
+
+#######################################################
+#######################################################
+########## S1. Checks
+#######################################################
+#######################################################
+
+#############################################
+########## 1. Pages
+#############################################
+
+def checkPages(workdir, nDatasets, pageSize, workers):
+	'''
+	Fetches nDatasets from the stub portal and checks every page was requested exactly once,
+	and that the staging file holds every dataset once, in portal order.
+	'''
+	# Fetch
+	outfile = os.path.join(workdir, 'lincs-{}-{}-{}{}'.format(nDatasets, pageSize, workers, staging.extension('datasets')))
+	server = stubs.startLincsServer(nDatasets)
+	try:
+		nRows = lincs.fetchDatasets(outfile, pageSize=pageSize, workers=workers, baseUrl=server.url, retries=1)
+	finally:
+		server.stop()
+
+	# Check requests
+	expectedSkips = range(0, max(nDatasets, 1), pageSize)
+	assert sorted(server.skips) == expectedSkips, 'Pages requested {}, expected each of {} once.'.format(sorted(server.skips), expectedSkips)
+
+	# Check output
+	accessions = list(staging.readStage(outfile, columns=['dataset_accession'])['dataset_accession'])
+	assert nRows == nDatasets, '{} rows reported, expected {}.'.format(nRows, nDatasets)
+	assert accessions == ['LDS-{}'.format(x) for x in range(nDatasets)], 'Datasets missing, repeated or out of order in {}.'.format(outfile)
+	assert os.listdir(workdir) == [os.path.basename(outfile)], 'Files left behind: {}.'.format(os.listdir(workdir))
+	os.remove(outfile)
+
+#############################################
+########## 2. Failed Page
+#############################################
+
+def checkFailedPage(workdir, nDatasets, pageSize, workers, failSkip):
+	'''
+	Fetches from a stub portal that fails the page at failSkip, and checks the fetch raises
+	and leaves neither the output nor its temporary file behind.
+	'''
+	# Fetch
+	outfile = os.path.join(workdir, 'lincs-failed-{}{}'.format(failSkip, staging.extension('datasets')))
+	server = stubs.startLincsServer(nDatasets, failSkip=failSkip)
+	try:
+		lincs.fetchDatasets(outfile, pageSize=pageSize, workers=workers, baseUrl=server.url, retries=1)
+		raise AssertionError('Fetch did not fail on the page at {}.'.format(failSkip))
+	except AssertionError:
+		raise
+	except Exception:
+		pass
+	finally:
+		server.stop()
+
+	# Check nothing was written
+	assert failSkip in server.skips, 'Page at {} was never requested.'.format(failSkip)
+	assert not os.listdir(workdir), 'Failed fetch left {}.'.format(os.listdir(workdir))
+
+#######################################################
+#######################################################
+########## S2. Run
+#######################################################
+#######################################################
+
+if __name__ == '__main__':
+
+	# Parse arguments
+	parser = argparse.ArgumentParser(description='Check lincs.fetchDatasets against the stub LINCS Data Portal.')
+	parser.add_argument('--staging-format', default='tsv', choices=['tsv', 'parquet', 'arrow'], help='Staging format to write.')
+	args = parser.parse_args()
+	staging.stagingFormat = args.staging_format
+
+	# Run in a scratch directory
+	workdir = tempfile.mkdtemp(prefix='d2t-check-lincs-')
+	try:
+		for nDatasets, pageSize, workers in caseList:
+			checkPages(workdir, nDatasets, pageSize, workers)
+			print('Fetched {} datasets in pages of {}, {} in flight: OK'.format(nDatasets, pageSize, workers))
+		for failSkip in [0, 500, 1000]:
+			checkFailedPage(workdir, 1050, 100, 4, failSkip)
+			print('Failed page at {}: OK'.format(failSkip))
+	finally:
+		shutil.rmtree(workdir)
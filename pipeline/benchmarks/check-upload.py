@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+#################################################################
+#################################################################
+############### Datasets2Tools Upload Resume Check ##############
+#################################################################
+#################################################################
+##### Author: Denis Torre
+##### Affiliation: Ma'ayan Laboratory,
+##### Icahn School of Medicine at Mount Sinai
+
+#############################################
+########## 1. Load libraries
+#############################################
+##### 1. Python modules #####
+import sys, os, json, shutil, tempfile, argparse
+
+##### 2. Custom modules #####
+benchmarkDir = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [benchmarkDir, os.path.join(benchmarkDir, '..', 'scripts')]
+import stubs, upload
+
+#############################################
+########## 2. General Setup
+#############################################
+##### 1. Variables #####
+# Filters of each case, by record number: keep everything, or drop every third chunk
+filterDict = {'all records': lambda x, chunkSize: True,
+			  'every third chunk empty': lambda x, chunkSize: (x//chunkSize) % 3 != 1}
+
+#######################################################
+#######################################################
+########## S1. Checks
+#######################################################
+#######################################################
+
+#############################################
+########## 1. Input
+#############################################
+
+def writeInput(infile, nRecords):
+	with open(infile, 'w') as openfile:
+		openfile.write('record_id\tcanned_analysis_url\n')
+		for recordId in range(nRecords):
+			openfile.write('{}\thttp://example.org/{}\n'.format(recordId, recordId))
+
+#############################################
+########## 2. Resume
+#############################################
+
+def checkResume(workdir, nRecords, chunkSize, inFlight, failAt, keep):
+	'''
+	Interrupts an upload by failing request failAt with retries off, then resumes it against
+	the same stand-in server.  Checks that the rerun sends only the chunks left unacknowledged,
+	that chunks emptied by the filter are never sent, and that the server ends up with every
+	kept record exactly once.
+	'''
+	# Expected chunks and records
+	infile, outfile = os.path.join(workdir, 'canned_analyses.txt'), os.path.join(workdir, 'canned_analyses.upload')
+	writeInput(infile, nRecords)
+	nChunks = (nRecords+chunkSize-1)/chunkSize
+	sentChunks = [x for x in range(nChunks) if any([keep(y, chunkSize) for y in range(x*chunkSize, min((x+1)*chunkSize, nRecords))])]
+	expectedRecords = [x for x in range(nRecords) if keep(x, chunkSize)]
+	filterChunk = lambda dataframe: dataframe[dataframe['record_id'].map(lambda x: keep(x, chunkSize))]
+
+	# Interrupt
+	server = stubs.startUploadServer(failEvery=failAt)
+	url = server.url + '/datasets2tools/api/upload'
+	try:
+		try:
+			upload.uploadFile(infile, outfile, url, chunkSize=chunkSize, inFlight=inFlight, filterChunk=filterChunk, retries=1)
+			raise AssertionError('Upload was not interrupted at request {}.'.format(failAt))
+		except AssertionError:
+			raise
+		except Exception:
+			pass
+		ackDict = upload.readAcks(outfile + '.acks', upload.uploadId(infile, url, chunkSize))
+		assert not os.path.exists(outfile), 'Interrupted upload wrote {}.'.format(outfile)
+		assert len(ackDict) < nChunks, 'All {} chunks acknowledged before the interruption.'.format(nChunks)
+
+		# Resume against a healthy server
+		server.RequestHandlerClass.failEvery = 0
+		requestCount = server.requestCount
+		assert upload.uploadFile(infile, outfile, url, chunkSize=chunkSize, inFlight=inFlight, filterChunk=filterChunk, retries=1) == nChunks
+		resentChunks = server.requestCount - requestCount
+	finally:
+		server.stop()
+
+	# Check requests
+	expectedResent = len([x for x in sentChunks if x not in ackDict])
+	assert resentChunks == expectedResent, 'Resumed upload sent {} chunks, expected the {} unacknowledged.'.format(resentChunks, expectedResent)
+
+	# Check records
+	storedRecords = sorted([x['record_id'] for records in server.chunks.values() for x in records])
+	assert storedRecords == expectedRecords, 'Server holds {} records, expected each of {} once.'.format(len(storedRecords), len(expectedRecords))
+	assert len(server.chunks) == len(sentChunks), 'Server holds {} chunks, expected {}.'.format(len(server.chunks), len(sentChunks))
+
+	# Check acknowledgements
+	ackList = [json.loads(x) for x in open(outfile).read().splitlines()]
+	assert [int(x['chunk']) for x in ackList] == range(nChunks), 'Acknowledgements missing or out of order in {}.'.format(outfile)
+	assert [i for i, x in enumerate(ackList) if not x.get('skipped')] == sentChunks, 'Skipped chunks do not match the chunks the filter emptied.'
+	assert not any([x.get('duplicate') for x in ackList]), 'An acknowledged chunk was sent again.'
+	assert not os.path.exists(outfile + '.acks'), 'Journal left behind.'
+	for filename in os.listdir(workdir):
+		os.remove(os.path.join(workdir, filename))
+
+#######################################################
+#######################################################
+########## S2. Run
+#######################################################
+#######################################################
+
+if __name__ == '__main__':
+
+	# Parse arguments
+	parser = argparse.ArgumentParser(description='Check that upload.uploadFile resumes an interrupted upload against the stand-in upload server.')
+	parser.add_argument('--records', type=int, default=10000)
+	parser.add_argument('--chunk-size', type=int, default=500)
+	args = parser.parse_args()
+
+	# Run in a scratch directory, interrupting the first and a later window
+	workdir = tempfile.mkdtemp(prefix='d2t-check-upload-')
+	try:
+		for label, keep in sorted(filterDict.items()):
+			for inFlight, failAt in [(1, 1), (3, 2), (3, 5), (4, 11)]:
+				checkResume(workdir, args.records, args.chunk_size, inFlight, failAt, keep)
+				print('{}, {} in flight, interrupted at request {}: OK'.format(label.capitalize(), inFlight, failAt))
+	finally:
+		shutil.rmtree(workdir)
@@ -0,0 +1,75 @@
+-- Minimal Datasets2Tools schema for loader benchmarks against a scratch database.
+CREATE TABLE tool (
+	id INT AUTO_INCREMENT PRIMARY KEY,
+	tool_name VARCHAR(255),
+	tool_icon_url TEXT,
+	tool_homepage_url TEXT,
+	tool_description TEXT,
+	tool_screenshot_url TEXT,
+	date DATE
+);
+
+CREATE TABLE repository (
+	id INT AUTO_INCREMENT PRIMARY KEY,
+	repository_name VARCHAR(255),
+	repository_icon_url TEXT,
+	repository_description TEXT,
+	repository_homepage_url TEXT,
+	date DATE
+);
+
+CREATE TABLE dataset (
+	id INT AUTO_INCREMENT PRIMARY KEY,
+	dataset_accession VARCHAR(255),
+	dataset_title TEXT,
+	dataset_description TEXT,
+	dataset_landing_url TEXT,
+	repository_fk INT,
+	date DATE,
+	INDEX (dataset_accession),
+	FOREIGN KEY (repository_fk) REFERENCES repository (id)
+);
+
+CREATE TABLE term (
+	id INT AUTO_INCREMENT PRIMARY KEY,
+	term_name VARCHAR(255),
+	term_description TEXT,
+	INDEX (term_name)
+);
+
+CREATE TABLE canned_analysis (
+	id INT AUTO_INCREMENT PRIMARY KEY,
+	dataset_fk INT,
+	tool_fk INT,
+	canned_analysis_url VARCHAR(767),
+	canned_analysis_title TEXT,
+	canned_analysis_description TEXT,
+	canned_analysis_preview_url TEXT,
+	FOREIGN KEY (dataset_fk) REFERENCES dataset (id),
+	FOREIGN KEY (tool_fk) REFERENCES tool (id)
+);
+
+CREATE TABLE canned_analysis_metadata (
+	id INT AUTO_INCREMENT PRIMARY KEY,
+	canned_analysis_fk INT,
+	term_fk INT,
+	value TEXT,
+	FOREIGN KEY (canned_analysis_fk) REFERENCES canned_analysis (id),
+	FOREIGN KEY (term_fk) REFERENCES term (id)
+);
+
+CREATE TABLE featured_analysis (
+	canned_analysis_fk INT,
+	day DATE
+);
+
+CREATE TABLE featured_dataset (
+	dataset_fk INT,
+	day DATE
+);
+
+CREATE TABLE featured_tool (
+	tool_fk INT,
+	start_day DATE,
+	end_day DATE
+);
@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+#################################################################
+#################################################################
+############### Datasets2Tools Stub Servers #####################
+#################################################################
+#################################################################
+##### Author: Denis Torre
+##### Affiliation: Ma'ayan Laboratory,
+##### Icahn School of Medicine at Mount Sinai
+
+#############################################
+########## 1. Load libraries
+#############################################
+##### 1. Python modules #####
+import re, json, gzip, threading, urlparse
+from StringIO import StringIO
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from xml.sax.saxutils import escape
+
+#######################################################
+#######################################################
+########## S1. Server
+#######################################################
+#######################################################
+
+#############################################
+########## 1. Threaded Server
+#############################################
+
+class StubServer(ThreadingMixIn, HTTPServer):
+	'''
+	Threaded HTTP server on a free local port, counting the requests it receives.
+	'''
+	daemon_threads = True
+
+	def __init__(self, handlerClass):
+		HTTPServer.__init__(self, ('127.0.0.1', 0), handlerClass)
+		self.requestCount = 0
+		self.lock = threading.Lock()
+
+	@property
+	def url(self):
+		return 'http://127.0.0.1:{}'.format(self.server_port)
+
+	def start(self):
+		thread = threading.Thread(target=self.serve_forever)
+		thread.daemon = True
+		thread.start()
+		return self
+
+	def stop(self):
+		self.shutdown()
+		self.server_close()
+
+#######################################################
+#######################################################
+########## S2. E-utilities
+#######################################################
+#######################################################
+
+#############################################
+########## 1. Handler
+#############################################
+
+class EutilsHandler(BaseHTTPRequestHandler):
+	'''
+	Answers esearch and esummary for any GSE or GDS accession, deriving the GEO ID from
+	the accession number.  Accessions whose number is a multiple of missingEvery are unknown.
+	'''
+	missingEvery = 0
+
+	def do_GET(self):
+		self.respond(urlparse.parse_qs(urlparse.urlparse(self.path).query))
+
+	def do_POST(self):
+		self.respond(urlparse.parse_qs(self.rfile.read(int(self.headers.getheader('content-length', 0)))))
+
+	def respond(self, params):
+
+		# Count
+		with self.server.lock:
+			self.server.requestCount += 1
+
+		# Get body
+		if 'esearch' in self.path:
+			geoIds = [self.geoId(x, y) for x, y in re.findall(r'(GSE|GDS)(\d+)\[Accession ID\]', params.get('term', [''])[0]) if self.isKnown(y)]
+			body = '<eSearchResult><Count>{}</Count><IdList>{}</IdList></eSearchResult>'.format(len(geoIds), ''.join(['<Id>{}</Id>'.format(x) for x in geoIds]))
+		elif 'esummary' in self.path:
+			docSums = []
+			for geoId in params.get('id', [''])[0].split(','):
+				accession = ('GDS' if geoId[0] == '1' else 'GSE') + str(int(geoId[1:]))
+				docSums.append('<DocSum><Id>{}</Id><Item Name="Accession" Type="String">{}</Item><Item Name="title" Type="String">{}</Item><Item Name="summary" Type="String">{}</Item><Item Name="taxon" Type="String">Homo sapiens</Item><Item Name="gdsType" Type="String">Expression profiling by array</Item></DocSum>'.format(geoId, accession, escape('Title of ' + accession), escape('Summary of ' + accession)))
+			body = '<eSummaryResult>{}</eSummaryResult>'.format(''.join(docSums))
+		else:
+			self.send_error(404)
+			return
+
+		# Send
+		self.send_response(200)
+		self.send_header('Content-Type', 'text/xml')
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def geoId(self, prefix, number):
+		return '{}{:08d}'.format(1 if prefix == 'GDS' else 2, int(number))
+
+	def isKnown(self, number):
+		return not self.missingEvery or int(number) % self.missingEvery != 0
+
+	def log_message(self, *args):
+		pass
+
+#############################################
+########## 2. Start
+#############################################
+
+def startEutilsServer(missingEvery=0):
+
+	# Configure handler
+	class Handler(EutilsHandler):
+		pass
+	Handler.missingEvery = missingEvery
+
+	# Start
+	return StubServer(Handler).start()
+
+#######################################################
+#######################################################
+########## S3. LINCS Data Portal
+#######################################################
+#######################################################
+
+#############################################
+########## 1. Handler
+#############################################
+
+class LincsHandler(BaseHTTPRequestHandler):
+	'''
+	Answers fetchdata with pages of nDatasets synthetic LINCS datasets, LDS-0 onwards, honouring
+	skip and limit, and records the skip of every request.  Every missingEvery-th dataset has
+	no description, as on the portal.  Requests for the page at failSkip fail with a 500.
+	'''
+	nDatasets = 0
+	missingEvery = 0
+	failSkip = None
+
+	def do_GET(self):
+		self.respond(urlparse.parse_qs(urlparse.urlparse(self.path).query))
+
+	def do_POST(self):
+		self.rfile.read(int(self.headers.getheader('content-length', 0)))
+		self.respond(urlparse.parse_qs(urlparse.urlparse(self.path).query))
+
+	def respond(self, params):
+
+		# Count
+		with self.server.lock:
+			self.server.requestCount += 1
+
+		# Get page
+		if 'fetchdata' not in self.path:
+			self.send_error(404)
+			return
+		skip = int(params.get('skip', ['0'])[0])
+		limit = int(params.get('limit', ['10'])[0])
+		with self.server.lock:
+			self.server.skips.append(skip)
+		if skip == self.failSkip:
+			self.send_error(500)
+			return
+		documents = [self.document(x) for x in range(skip, min(skip+limit, self.nDatasets))]
+		body = json.dumps({'results': {'totalDocuments': self.nDatasets, 'documents': documents}})
+
+		# Send
+		self.send_response(200)
+		self.send_header('Content-Type', 'application/json')
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def document(self, number):
+		documentDict = {'datasetid': 'LDS-{}'.format(number), 'datasetname': 'LINCS dataset {}'.format(number), 'description': 'Description of LINCS dataset {}'.format(number), 'ldplink': 'http://example.org/LDS-{}'.format(number)}
+		if self.missingEvery and number % self.missingEvery == 0:
+			del documentDict['description']
+		return documentDict
+
+	def log_message(self, *args):
+		pass
+
+#############################################
+########## 2. Start
+#############################################
+
+def startLincsServer(nDatasets, missingEvery=0, failSkip=None):
+
+	# Configure handler
+	class Handler(LincsHandler):
+		pass
+	Handler.nDatasets = nDatasets
+	Handler.missingEvery = missingEvery
+	Handler.failSkip = failSkip
+
+	# Start
+	server = StubServer(Handler)
+	server.skips = []
+	return server.start()
+
+#######################################################
+#######################################################
+########## S4. Analysis Upload
+#######################################################
+#######################################################
+
+#############################################
+########## 1. Handler
+#############################################
+
+class UploadHandler(BaseHTTPRequestHandler):
+	'''
+	Stands in for the upload API in NDJSON mode.  Stores the records of each chunk under its
+	Idempotency-Key, so resent chunks are not stored twice, and acknowledges it by echoing the
+	key.  Every failEvery-th request fails with a 503 before anything is stored.
+	'''
+	failEvery = 0
+
+	def do_POST(self):
+
+		# Count
+		body = self.rfile.read(int(self.headers.getheader('content-length', 0)))
+		with self.server.lock:
+			self.server.requestCount += 1
+			fail = self.failEvery and self.server.requestCount % self.failEvery == 0
+		if fail:
+			self.send_error(503)
+			return
+
+		# Store records
+		if self.headers.getheader('content-encoding') == 'gzip':
+			body = gzip.GzipFile(fileobj=StringIO(body)).read()
+		key = self.headers.getheader('idempotency-key')
+		records = [json.loads(x) for x in body.splitlines() if x.strip()]
+		with self.server.lock:
+			duplicate = key in self.server.chunks
+			self.server.chunks.setdefault(key, records)
+
+		# Acknowledge
+		ack = json.dumps({'idempotency_key': key, 'chunk': self.headers.getheader('x-chunk-index'), 'records': len(records), 'duplicate': duplicate})
+		self.send_response(200)
+		self.send_header('Content-Type', 'application/json')
+		self.send_header('Content-Length', str(len(ack)))
+		self.end_headers()
+		self.wfile.write(ack)
+
+	def log_message(self, *args):
+		pass
+
+#############################################
+########## 2. Start
+#############################################
+
+def startUploadServer(failEvery=0):
+
+	# Configure handler
+	class Handler(UploadHandler):
+		pass
+	Handler.failEvery = failEvery
+
+	# Start
+	server = StubServer(Handler)
+	server.chunks = {}
+	return server.start()
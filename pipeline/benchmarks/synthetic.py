@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+#################################################################
+#################################################################
+############### Datasets2Tools Synthetic Inputs #################
+#################################################################
+#################################################################
+##### Author: Denis Torre
+##### Affiliation: Ma'ayan Laboratory,
+##### Icahn School of Medicine at Mount Sinai
+
+#############################################
+########## 1. Load libraries
+#############################################
+##### 1. Python modules #####
+import json
+import pandas as pd
+import numpy as np
+
+##### 2. Custom modules #####
+import staging
+
+#############################################
+########## 2. General Setup
+#############################################
+##### 1. Variables #####
+# The pipeline hardcodes these repository IDs for GEO and LINCS
+geoRepositoryId = 20
+lincsRepositoryId = 27
+
+#######################################################
+#######################################################
+########## S1. Spreadsheets
+#######################################################
+#######################################################
+
+#############################################
+########## 1. Tools
+#############################################
+
+def writeTools(outfile, nTools=20):
+
+	# Get dataframe, with the column names of the LINCS tool spreadsheet
+	toolDataframe = pd.DataFrame({'id': np.arange(nTools)+1,
+								  'name < 20 characters including spaces': ['tool{}'.format(x) for x in range(nTools)],
+								  'icon_url': ['http://example.org/tool{}.png'.format(x) for x in range(nTools)],
+								  'url': ['http://example.org/tool{}'.format(x) for x in range(nTools)],
+								  'description < 80 charcaters including spaces': ['Description of tool {}'.format(x) for x in range(nTools)],
+								  'tool_screenshot_url': ['http://example.org/tool{}-screenshot.png'.format(x) for x in range(nTools)]})
+
+	# Save
+	toolDataframe.to_excel(outfile, index=False)
+	return toolDataframe
+
+#############################################
+########## 2. Repositories
+#############################################
+
+def writeRepositories(outfile, nRepositories=30):
+
+	# Get names
+	repositoryNames = ['repository{}'.format(x) for x in range(nRepositories)]
+	repositoryNames[geoRepositoryId-1] = 'gene expression omnibus'
+	repositoryNames[lincsRepositoryId-1] = 'lincs data portal'
+
+	# Get dataframe, laid out like the output of makeRepositoryTable
+	repositoryDataframe = pd.DataFrame({'repository_name': repositoryNames,
+										'repository_icon_url': ['http://example.org/{}.png'.format(x) for x in range(nRepositories)],
+										'repository_description': ['Description of repository {}'.format(x) for x in range(nRepositories)],
+										'repository_homepage_url': ''}, columns=['repository_name', 'repository_icon_url', 'repository_description', 'repository_homepage_url'])
+	repositoryDataframe.insert(0, 'id', [x+1 for x in repositoryDataframe.index])
+
+	# Save
+	staging.writeStage(repositoryDataframe, outfile, 'repositories')
+	return repositoryDataframe
+
+#######################################################
+#######################################################
+########## S2. Canned Analyses
+#######################################################
+#######################################################
+
+#############################################
+########## 1. Canned Analyses
+#############################################
+
+def writeCannedAnalyses(outfile, nAnalyses, nKeys=10, nDatasets=None, newDatasetShare=0.1, nTerms=None, newTermShare=0.1, nTools=20, seed=0):
+	'''
+	Writes a canned-analysis file.  Datasets GSE0 to GSE(n-1) and terms term0 to term(n-1)
+	are the known ones returned by knownDatasets and knownTerms; newDatasetShare and
+	newTermShare of the rows and metadata keys use accessions and terms beyond them.
+	'''
+	# Get sizes
+	random = np.random.RandomState(seed)
+	nDatasets = nDatasets or max(nAnalyses/10, 1)
+	nTerms = nTerms or nKeys*2
+
+	# Pick datasets, new ones numbered after the known ones
+	isNew = random.rand(nAnalyses) < newDatasetShare
+	datasetNumbers = np.where(isNew, nDatasets+random.randint(0, nDatasets, nAnalyses), random.randint(0, nDatasets, nAnalyses))
+
+	# Pick metadata terms, new ones numbered after the known ones
+	termNames = ['term{}'.format(x) for x in range(nTerms)] + ['term{}'.format(x) for x in range(nTerms, nTerms+max(int(nTerms*newTermShare), 1))]
+	termWeights = np.array([1-newTermShare]*nTerms + [newTermShare]*(len(termNames)-nTerms))
+
+	# Get dataframe
+	cannedAnalysisDataframe = pd.DataFrame({'dataset_accession': ['GSE{}'.format(x) for x in datasetNumbers],
+											'tool_name': ['tool{}'.format(x) for x in random.randint(0, nTools, nAnalyses)],
+											'canned_analysis_url': ['http://example.org/analysis/{}/{}'.format(seed, x) for x in range(nAnalyses)],
+											'canned_analysis_title': ['Analysis {}'.format(x) for x in range(nAnalyses)],
+											'canned_analysis_description': ['Description of analysis {}'.format(x) for x in range(nAnalyses)],
+											'canned_analysis_preview_url': ['http://example.org/preview/{}.png'.format(x) for x in range(nAnalyses)],
+											'metadata': [json.dumps({term: 'value{}'.format(random.randint(0, 1000)) for term in random.choice(termNames, min(nKeys, len(termNames)), replace=False, p=termWeights/termWeights.sum())}) for x in range(nAnalyses)]},
+										   columns=['dataset_accession', 'tool_name', 'canned_analysis_url', 'canned_analysis_title', 'canned_analysis_description', 'canned_analysis_preview_url', 'metadata'])
+
+	# Save
+	cannedAnalysisDataframe.to_csv(outfile, sep='\t', index=False)
+	return cannedAnalysisDataframe
+
+#############################################
+########## 2. Known Objects
+#############################################
+
+def knownDatasets(nDatasets):
+	return ['GSE{}'.format(x) for x in range(nDatasets)]
+
+def knownTerms(nTerms):
+	return ['term{}'.format(x) for x in range(nTerms)]
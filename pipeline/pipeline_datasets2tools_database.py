@@ -0,0 +1,1004 @@
+# -*- coding: utf-8 -*-
+#################################################################
+#################################################################
+############### Datasets2Tools Database Pipeline ################
+#################################################################
+#################################################################
+##### Author: Denis Torre
+##### Affiliation: Ma'ayan Laboratory,
+##### Icahn School of Medicine at Mount Sinai
+
+#############################################
+########## 1. Load libraries
+#############################################
+##### 1. Python modules #####
+# pandas, SQLAlchemy and the modules using them are imported by the tasks that need them,
+# so listing tasks, dry runs and small targets start quickly
+from ruffus import *
+import sys, os, json
+
+##### 2. Custom modules #####
+# Pipeline running
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'scripts'))
+import metrics, manifest, staging
+
+#############################################
+########## 2. General setup
+#############################################
+##### 1. Default variables #####
+# DB Files
+schemaFile = 'f1-mysql.dir/schema.sql'
+connectionFile = 'f1-mysql.dir/conn.json'
+
+# Servers every load writes to, as host labels of connectionFile.  Each stage's output is staged
+# once and loaded into all of them at once; the first is the one the pipeline reads back from,
+# for the featured schedules, the fingerprint check of the analysis upload and the snapshot.
+loadTargets = ['phpmyadmin']
+
+# bioCADDIE Repository File
+repositoryHtmlFile = 'f3-repositories.dir/Repository List _ bioCADDIE Data Discovery Index.htm'
+
+# Canned Analyses, as patterns ruffus expands when the pipeline runs
+creedsAnalyses = ['../datasets2tools-canned-analyses/f1-creeds.dir/*/*v1.0-canned_analyses.txt']
+archs4Analyses = ['../datasets2tools-canned-analyses/f2-archs4.dir/archs4-canned_analyses.txt']
+genemaniaAnalyses = ['../datasets2tools-canned-analyses/f5-genemania.dir/*canned_analyses.txt']
+
+# Table loading: 'sync' applies only the rows that changed on each table's natural key, 'reload' truncates and reloads
+loadMode = 'sync'
+syncDeletes = False
+
+# Parameters that decide whether a load must rerun when its inputs are unchanged
+loadParams = lambda: {'loadMode': loadMode, 'syncDeletes': syncDeletes, 'writeStrategy': writeStrategy, 'loadTargets': loadTargets}
+
+# Extensions of intermediate files, which depend on staging.stagingFormat
+stageExtension = staging.extension()
+repositoryStageExtension = staging.extension('repositories')
+
+# LINCS datasets per page, and pages requested at once
+lincsPageSize = 300
+lincsWorkers = 4
+
+# Rows of a canned analysis file read at a time
+analysisChunkSize = 5000
+
+# Analysis loading: 'api' uploads the ARCHS4 analyses through the upload API (loadAnalyses), 'direct' loads
+# the CREEDS, ARCHS4 and GeneMANIA analyses into the database with parallel workers (loadCannedAnalysisFiles).
+# With one worker, it streams each file through CannedAnalysisTable.stream_file in one transaction instead.
+analysisLoader = 'api'
+analysisWorkers = 4
+
+# Hold direct-load frames as categorical strings and integer keys, recording their memory per phase
+compactFrames = True
+
+# Analysis upload: 'json' posts each chunk as one JSON document, 'ndjson' streams gzipped NDJSON chunks that resume after a failure
+uploadUrl = 'http://localhost:5000/datasets2tools/api/upload'
+uploadMode = 'json'
+uploadsInFlight = 3
+
+# Bulk load mode: drop foreign keys and secondary indexes after creating the schema, and rebuild them,
+# analyze the tables and report orphan rows once every table is loaded
+bulkLoad = False
+deferredIndexFile = 'f1-mysql.dir/deferred-indexes-{}.json'
+
+# State left by bulk loads from before there were several targets, which belongs to the first
+oldDeferredIndexFile = 'f1-mysql.dir/deferred-indexes.json'
+
+# Bulk writes: 'multirow', 'infile' or 'executemany', and rows per statement
+writeStrategy = 'multirow'
+writeBatchSize = 1000
+
+# Tasks writing to the database at once, set with --db-jobs
+dbJobs = 1
+
+# Featured schedules: days of featured analyses and datasets, and rounds of every tool.  Raising
+# a length and forcing the getFeatured tasks extends the loaded schedule from its last day.
+featuredLengths = {'featured-analysis': 1500, 'featured-dataset': 1500, 'featured-tool': 50}
+featuredSeed = 2017
+
+# Serving table: rebuilt from every analysis when True, rather than only from those whose sources changed
+rebuildServingTable = False
+
+# Read-only SQLite snapshot of every table, exported this many rows at a time
+snapshotChunkSize = 10000
+
+# Processed datasets
+processedDatasetFile = 'f7-processed_datasets.dir/processed_datasets.txt'
+scriptsFile = 'f8-scripts.dir/scripts.xlsx'
+
+##### 2. Database module #####
+def importDb():
+
+	# Import the database module with the pipeline's write settings
+	import db
+	db.writeStrategy, db.writeBatchSize = writeStrategy, writeBatchSize
+	return db
+
+##### 3. Load targets #####
+def fanOut(load, infiles, outfile, params=None):
+
+	# Call load(target) for every target at once, returning how each went
+	import fanout
+	return fanout.loadTargets(load, loadTargets, outfile, infiles, params)
+
+def deferredIndexState(target):
+
+	# Get a target's deferred-index state file, moving the first target's from its old name
+	stateFile = deferredIndexFile.format(target)
+	if target == loadTargets[0] and not os.path.exists(stateFile) and os.path.exists(oldDeferredIndexFile):
+		os.rename(oldDeferredIndexFile, stateFile)
+	return stateFile
+
+#######################################################
+#######################################################
+########## S1. Create Database
+#######################################################
+#######################################################
+
+#############################################
+########## 1. Create Schema
+#############################################
+
+@merge(['f1-mysql.dir/schema.sql',
+		'f1-mysql.dir/conn.json'],
+		'f1-mysql.dir/schema.load')
+
+@metrics.instrument
+
+def createDatabase(infiles, outfile):
+
+	# Import dependencies
+	db = importDb()
+
+	# Split infiles
+	schemaFile, connectionFile = infiles
+
+	# Create the schema on every target
+	def load(target):
+
+		# Get dict
+		host, username, password = db.connect(connectionFile, target, returnData=True)
+
+		# Get command
+		commandString = ''' mysql --user='%(username)s' --password='%(password)s' --host='%(host)s' < %(schemaFile)s ''' % dict(locals(), schemaFile=schemaFile)
+
+		# Run
+		if os.system(commandString) != 0:
+			raise RuntimeError('Could not create the schema on {}.'.format(host))
+
+	# Create outfile
+	metrics.writeSentinel(outfile, targets=fanOut(load, infiles, outfile))
+
+#############################################
+########## 2. Defer Indexes
+#############################################
+
+@transform(createDatabase,
+		   suffix('.load'),
+		   '.deferred')
+
+@metrics.instrument
+
+def deferIndexes(infile, outfile):
+
+	# Import dependencies
+	db = importDb()
+	import bulkload
+
+	# Drop foreign keys and secondary indexes on every target before loading
+	def load(target):
+		engine = db.connect(connectionFile, target, 'datasets2tools')
+		stateDict = bulkload.deferIndexes(engine, deferredIndexState(target))
+		print('Deferred {} indexes and {} foreign keys on {}.'.format(len(stateDict['indexes']), len(stateDict['foreign_keys']), target))
+
+	# Create outfile
+	metrics.writeSentinel(outfile, targets=fanOut(load, infile, outfile) if bulkLoad else [])
+
+#######################################################
+#######################################################
+########## S2. Load Tools and Repositories
+#######################################################
+#######################################################
+
+#############################################
+########## 1. Load Tools
+#############################################
+
+@follows(createDatabase, deferIndexes)
+
+@jobs_limit(dbJobs, 'database')
+
+@transform('f2-tools.dir/lincs_tools_mar152017.xlsx',
+		   suffix('.xlsx'),
+		   add_inputs(connectionFile),
+		   '.load')
+
+@metrics.instrument
+
+@manifest.checksum(connectionFile, loadTargets, 'datasets2tools', params=loadParams, tables=['tool'])
+
+def loadTools(infiles, outfile):
+
+	# Import dependencies
+	import pandas as pd
+	db = importDb()
+
+	# Split files
+	toolFile, connectionFile = infiles
+
+	# Read table
+	toolDataframe = pd.read_excel(toolFile)
+	metrics.addRows(rowsIn=len(toolDataframe.index))
+
+	# Rename dict
+	renameDict = {'name < 20 characters including spaces': 'tool_name',
+	              'icon_url': 'tool_icon_url',
+	              'url': 'tool_homepage_url',
+	              'description < 80 charcaters including spaces': 'tool_description'}
+
+	# Rename
+	toolDataframe = toolDataframe.rename(columns=renameDict)
+
+	# Add date
+	toolDataframe['date'] = '2017-05-22'
+
+	# Select columns
+	selectedColumns = ['id', 'tool_name', 'tool_icon_url', 'tool_homepage_url', 'tool_description', 'tool_screenshot_url', 'date']
+
+	# Load every target
+	def load(target):
+
+		# Get engine
+		engine = db.connect(connectionFile, target, 'datasets2tools')
+
+		# Sync changed rows
+		if loadMode == 'sync':
+			return db.syncTable(toolDataframe[selectedColumns], 'tool', ['tool_name'], engine, deleteMissing=syncDeletes)
+
+		else:
+
+			# Replace rows
+			with engine.begin() as connection:
+				db.replaceTable(toolDataframe[selectedColumns], 'tool', connection, keyColumns=['tool_name'])
+
+	# Outfile
+	metrics.writeSentinel(outfile, targets=fanOut(load, infiles, outfile, loadParams()))
+
+
+#######################################################
+#######################################################
+########## S3. Load Repositories
+#######################################################
+#######################################################
+
+#############################################
+########## 1. Create Repository Table
+#############################################
+
+@files(repositoryHtmlFile,
+	   'f3-repositories.dir/repositories'+repositoryStageExtension)
+
+@metrics.instrument
+
+def makeRepositoryTable(infiles, outfile):
+
+	# Import dependencies
+	import pandas as pd
+	from bs4 import BeautifulSoup
+
+	# Parse table
+	table = BeautifulSoup(open('f3-repositories.dir/Repository List _ bioCADDIE Data Discovery Index.htm'), "lxml").find('table')
+
+
+	# Define dict
+	resultDict = {}
+
+	# Loop through rows
+	for row in table.find_all('tr'):
+	    
+	    try:
+	        # Add data
+	        resultDict[row.find('a').text] = {'repository_icon_url': row.find('img').attrs['src'].replace('./', 'https://datamed.org/'),
+	                                          'repository_description': row.find_all('td')[-1].text,
+	                                          'repository_homepage_url': ''}
+	    except:
+	        pass
+
+	# Convert to dataframe
+	repositoryDataframe = pd.DataFrame(resultDict).T.reset_index().rename(columns={'index':'repository_name'})
+	repositoryDataframe.insert(0, 'id', [x+1 for x in repositoryDataframe.index])
+
+	# Save
+	staging.writeStage(repositoryDataframe, outfile, 'repositories')
+
+#############################################
+########## 2. Load Repositories
+#############################################
+
+@follows(loadTools, makeRepositoryTable)
+
+@jobs_limit(dbJobs, 'database')
+
+@transform(makeRepositoryTable,
+		   suffix(repositoryStageExtension),
+		   add_inputs(connectionFile),
+		   '.load')
+
+@metrics.instrument
+
+@manifest.checksum(connectionFile, loadTargets, 'datasets2tools', params=loadParams, tables=['repository'])
+
+def loadRepositories(infiles, outfile):
+
+	# Import dependencies
+	db = importDb()
+
+	# Split files
+	toolFile, connectionFile = infiles
+
+	# Read table
+	repositoryDataframe = staging.readStage(toolFile, staging.columns('repositories'))
+	metrics.addRows(rowsIn=len(repositoryDataframe.index))
+
+	# Add date
+	repositoryDataframe['date'] = '2017-05-22'
+
+	# Load every target
+	def load(target):
+
+		# Get engine
+		engine = db.connect(connectionFile, target, 'datasets2tools')
+
+		# Sync changed rows
+		if loadMode == 'sync':
+			return db.syncTable(repositoryDataframe, 'repository', ['repository_name'], engine, deleteMissing=syncDeletes)
+
+		else:
+
+			# Replace rows
+			with engine.begin() as connection:
+				db.replaceTable(repositoryDataframe, 'repository', connection, keyColumns=['repository_name'])
+
+	# Outfile
+	metrics.writeSentinel(outfile, targets=fanOut(load, infiles, outfile, loadParams()))
+
+#######################################################
+#######################################################
+########## S4. Datasets
+#######################################################
+#######################################################
+
+#############################################
+########## 1. Annotate Datasets
+#############################################
+
+@follows(mkdir('f4-datasets.dir'))
+
+@transform(creedsAnalyses,
+		   regex(r'.*/(.*).txt'),
+		   r'f4-datasets.dir/\1-datasets'+stageExtension)
+
+@metrics.instrument
+
+def annotateGeoDatasets(infile, outfile):
+
+	# Import dependencies
+	import pandas as pd
+	import PipelineDatasets2toolsDatabase as P
+
+	# Read infile
+	cannedAnalysisDataframe = pd.read_table(infile)
+	metrics.addRows(rowsIn=len(cannedAnalysisDataframe.index))
+
+	# Dataset accessions
+	datasetAccessions = cannedAnalysisDataframe['dataset_accession'].unique()
+
+	# Annotate
+	annotationDict = P.annotateDatasets(datasetAccessions)
+	datasetAnnotationDict = {(i+1): annotationDict[e] for i, e in enumerate(datasetAccessions)}
+
+	# Convert to dataframe
+	datasetAnnotationDataframe = pd.DataFrame(datasetAnnotationDict).T
+
+	# Rename columns
+	datasetAnnotationDataframe.rename(columns={'title': 'dataset_title', 'summary': 'dataset_description'}, inplace=True)
+
+	# Drop repository name
+	datasetAnnotationDataframe.drop('repository_name', axis=1, inplace=True)
+
+	# Add repository FK
+	datasetAnnotationDataframe['repository_fk'] = 20
+
+	# Save
+	staging.writeStage(datasetAnnotationDataframe, outfile, 'datasets')
+	
+#############################################
+########## 2. Get LINCS Datasets
+#############################################
+
+@files(None,
+	   'f4-datasets.dir/lincs-datasets'+stageExtension)
+
+@metrics.instrument
+
+def getLincsDatasets(infile, outfile):
+
+	# Import dependencies
+	import lincs
+
+	# Page through all datasets, writing them as they arrive
+	nDatasets = lincs.fetchDatasets(outfile, pageSize=lincsPageSize, workers=lincsWorkers)
+	metrics.addRows(rowsOut=nDatasets)
+	
+#############################################
+########## 3. Merge Datasets
+#############################################
+
+@merge([annotateGeoDatasets, getLincsDatasets],
+	   'f4-datasets.dir/datasets'+stageExtension)
+
+@metrics.instrument
+
+def mergeDatasets(infiles, outfile):
+
+	# Import dependencies
+	import pandas as pd
+
+	# Read infile
+	datasetDataframe = pd.concat([staging.readStage(x, staging.columns('datasets')) for x in infiles]).drop_duplicates('dataset_accession')
+	metrics.addRows(rowsIn=len(datasetDataframe.index))
+
+	# Save
+	staging.writeStage(datasetDataframe, outfile, 'datasets')
+	
+#############################################
+########## 4. Upload Datasets
+#############################################
+
+@follows(loadRepositories)
+
+@jobs_limit(dbJobs, 'database')
+
+@transform(mergeDatasets,
+		   suffix(stageExtension),
+		   '.load')
+
+@metrics.instrument
+
+@manifest.checksum(connectionFile, loadTargets, 'datasets2tools', params=loadParams, tables=['dataset'])
+
+def loadDatasets(infile, outfile):
+
+	# Import dependencies
+	db = importDb()
+
+	# Read infile
+	datasetDataframe = staging.readStage(infile, staging.columns('datasets'))
+	metrics.addRows(rowsIn=len(datasetDataframe.index))
+
+	# Add date
+	datasetDataframe['date'] = '2017-05-22'
+
+	# Load every target
+	def load(target):
+
+		# Get engine
+		engine = db.connect(connectionFile, target, 'datasets2tools')
+
+		# Sync changed rows
+		if loadMode == 'sync':
+			return db.syncTable(datasetDataframe, 'dataset', ['dataset_accession'], engine, deleteMissing=syncDeletes)
+
+		else:
+
+			# Replace rows
+			with engine.begin() as connection:
+				db.replaceTable(datasetDataframe, 'dataset', connection, keyColumns=['dataset_accession'])
+
+	# Outfile
+	metrics.writeSentinel(outfile, targets=fanOut(load, infile, outfile, loadParams()))
+
+#######################################################
+#######################################################
+########## S5. Load Analyses
+#######################################################
+#######################################################
+
+#############################################
+########## 1. Load Analyses
+#############################################
+
+@follows(mkdir('f5-analyses.dir'), loadTools, loadDatasets)
+
+@jobs_limit(dbJobs, 'database')
+
+@transform(archs4Analyses if analysisLoader == 'api' else [],
+		   regex(r'.*/(.*).txt'),
+		   r'f5-analyses.dir/\1.load')
+
+@metrics.instrument
+
+@manifest.checksum(connectionFile, loadTargets, 'datasets2tools', params=lambda: {'analysisChunkSize': analysisChunkSize, 'uploadMode': uploadMode, 'uploadUrl': uploadUrl}, tables=['canned_analysis'])
+
+def loadAnalyses(infile, outfile):
+
+	# Import dependencies
+	import pandas as pd
+	import requests, upload, dedup
+	db = importDb()
+
+	# Leave out analyses already in the fingerprint index of the first target, which the upload API writes to,
+	# creating the index and adding the analyses the API inserted since the last run
+	engine = db.connect(connectionFile, loadTargets[0], 'datasets2tools')
+	dedup.ensureIndex(engine)
+	skipped = [0]
+	def dropLoaded(cannedAnalysisDataframe):
+		newDataframe = dedup.dropLoaded(cannedAnalysisDataframe, engine)
+		skipped[0] += len(cannedAnalysisDataframe.index)-len(newDataframe.index)
+		return newDataframe
+
+	# Stream compressed, resumable chunks
+	if uploadMode == 'ndjson':
+		upload.uploadFile(infile, outfile, uploadUrl, chunkSize=analysisChunkSize, inFlight=uploadsInFlight, filterChunk=dropLoaded)
+		print('Skipped {} canned analyses already loaded.'.format(skipped[0]))
+		return
+
+	# Prepare POST request
+	url = uploadUrl
+	headers = {'content-type':'application/json'}
+
+	# Read and upload one chunk at a time
+	with open(outfile, 'w') as openfile:
+		for cannedAnalysisDataframe in pd.read_table(infile, chunksize=analysisChunkSize):
+
+			# Make request
+			metrics.addRows(rowsIn=len(cannedAnalysisDataframe.index))
+			cannedAnalysisDataframe = dropLoaded(cannedAnalysisDataframe)
+			if not len(cannedAnalysisDataframe.index):
+				continue
+			response = requests.post(url, data=cannedAnalysisDataframe.to_json(), headers=headers)
+			metrics.countHttpCall()
+
+			# Write outfile
+			openfile.write(response.text)
+	print('Skipped {} canned analyses already loaded.'.format(skipped[0]))
+
+#############################################
+########## 2. Load Analysis Files
+#############################################
+
+@follows(mkdir('f5-analyses.dir'), loadTools, loadDatasets)
+
+@jobs_limit(dbJobs, 'database')
+
+@merge(creedsAnalyses+archs4Analyses+genemaniaAnalyses if analysisLoader == 'direct' else [],
+	   'f5-analyses.dir/canned_analyses.load')
+
+@metrics.instrument
+
+@manifest.checksum(connectionFile, loadTargets, 'datasets2tools', params=lambda: {'analysisChunkSize': analysisChunkSize, 'analysisWorkers': analysisWorkers}, tables=['canned_analysis', 'canned_analysis_metadata'])
+
+def loadCannedAnalysisFiles(infiles, outfile):
+
+	# Import dependencies
+	import parallel
+	from CannedAnalysisTable import CannedAnalysisTable
+	db = importDb()
+
+	# Load chunks into every target in parallel, committed a wave at a time, with a report and journal per target
+	def load(target):
+		if analysisWorkers > 1:
+			return parallel.loadFiles(infiles, '{}-{}.load'.format(os.path.splitext(outfile)[0], target), connectionFile, target, 'datasets2tools', workers=analysisWorkers, chunkSize=analysisChunkSize, compact=compactFrames)
+
+		# Or stream one file at a time
+		engine = db.connect(connectionFile, target, 'datasets2tools')
+		reportDict = {'files': 0, 'analyses_skipped': 0}
+		for infile in infiles:
+			with metrics.phase('stream_file'):
+				table = CannedAnalysisTable.stream_file(infile, engine, [], chunksize=analysisChunkSize, verbose=0, compact=compactFrames, report_memory=compactFrames)
+				if table:
+					table.commit_transaction([], commit=True)
+					reportDict['analyses_skipped'] += table.skipped_analyses
+			reportDict['files'] += 1
+		return reportDict
+
+	# Write report
+	reportList = fanOut(load, infiles, outfile, {'analysisChunkSize': analysisChunkSize, 'analysisWorkers': analysisWorkers})
+	with open(outfile, 'w') as openfile:
+		json.dump({'targets': reportList}, openfile, indent=4)
+
+#######################################################
+#######################################################
+########## S6. Featured Objects
+#######################################################
+#######################################################
+
+#############################################
+########## 1. Featured Analyses
+#############################################
+
+@follows(mkdir('f6-featured.dir'), loadAnalyses, loadCannedAnalysisFiles)
+
+@files(None,
+	   'f6-featured.dir/featured-analysis'+stageExtension)
+
+@metrics.instrument
+
+def getFeaturedAnalyses(infile, outfile):
+
+	# Import dependencies
+	import featured
+	db = importDb()
+
+	# Get engine of the first target, whose schedule every target loads
+	engine = db.connect(connectionFile, loadTargets[0], 'datasets2tools')
+
+	# Extend schedule, keeping the rows already scheduled for targets that lack them
+	featuredAnalysisDataframe = featured.makeSchedule('featured-analysis', engine, featuredLengths['featured-analysis'], featuredSeed, existing=True)
+	metrics.addRows(rowsOut=len(featuredAnalysisDataframe.index))
+
+	# Save
+	staging.writeStage(featuredAnalysisDataframe, outfile, 'featured-analysis')
+
+#############################################
+########## 2. Featured Datasets
+#############################################
+
+@follows(mkdir('f6-featured.dir'), loadAnalyses, loadCannedAnalysisFiles)
+
+@files(None,
+	   'f6-featured.dir/featured-dataset'+stageExtension)
+
+@metrics.instrument
+
+def getFeaturedDatasets(infile, outfile):
+
+	# Import dependencies
+	import featured
+	db = importDb()
+
+	# Get engine of the first target, whose schedule every target loads
+	engine = db.connect(connectionFile, loadTargets[0], 'datasets2tools')
+
+	# Extend schedule, keeping the rows already scheduled for targets that lack them
+	featuredDatasetDataframe = featured.makeSchedule('featured-dataset', engine, featuredLengths['featured-dataset'], featuredSeed, existing=True)
+	metrics.addRows(rowsOut=len(featuredDatasetDataframe.index))
+
+	# Save
+	staging.writeStage(featuredDatasetDataframe, outfile, 'featured-dataset')
+
+#############################################
+########## 3. Featured Tools
+#############################################
+
+@follows(mkdir('f6-featured.dir'), loadAnalyses, loadCannedAnalysisFiles)
+
+@files(None,
+	   'f6-featured.dir/featured-tool'+stageExtension)
+
+@metrics.instrument
+
+def getFeaturedTools(infile, outfile):
+
+	# Import dependencies
+	import featured
+	db = importDb()
+
+	# Get engine of the first target, whose schedule every target loads
+	engine = db.connect(connectionFile, loadTargets[0], 'datasets2tools')
+
+	# Extend schedule, keeping the rows already scheduled for targets that lack them
+	featuredToolDataframe = featured.makeSchedule('featured-tool', engine, featuredLengths['featured-tool'], featuredSeed, existing=True)
+	metrics.addRows(rowsOut=len(featuredToolDataframe.index))
+
+	# Save
+	staging.writeStage(featuredToolDataframe, outfile, 'featured-tool')
+
+#############################################
+########## 4. Upload Tables
+#############################################
+
+@jobs_limit(dbJobs, 'database')
+
+@transform((getFeaturedAnalyses, getFeaturedDatasets, getFeaturedTools),
+		   suffix(stageExtension),
+	       '.load')
+
+@metrics.instrument
+
+@manifest.checksum(connectionFile, loadTargets, 'datasets2tools', params=loadParams, tables=lambda outfile: [os.path.basename(outfile).split('.')[0].replace('-', '_')])
+
+def loadFeaturedTables(infile, outfile):
+
+	# Import dependencies
+	import featured
+	db = importDb()
+
+	# Read infile
+	schemaName = os.path.basename(outfile).split('.')[0]
+	featuredDataframe = staging.readStage(infile, staging.columns(schemaName))
+	metrics.addRows(rowsIn=len(featuredDataframe.index))
+
+	# Get table name
+	tableName = schemaName.replace('-', '_')
+
+	# Get dtype
+	dtype = staging.sqlTypes(schemaName)
+
+	# Upload to every target the days after the last it has, so reruns add nothing
+	def load(target):
+		engine = db.connect(connectionFile, target, 'datasets2tools')
+		pendingDataframe = featured.pendingRows(schemaName, engine, featuredDataframe)
+		if len(pendingDataframe.index):
+			with engine.begin() as connection:
+				db.writeDataframe(pendingDataframe, tableName, connection, dtype=dtype)
+		metrics.addRows(rowsOut=len(pendingDataframe.index))
+		return {'rows': len(pendingDataframe.index)}
+
+	# Create outfile
+	metrics.writeSentinel(outfile, targets=fanOut(load, infile, outfile, loadParams()))
+
+#######################################################
+#######################################################
+########## S7. Processed Datasets
+#######################################################
+#######################################################
+
+#############################################
+########## 1. Upload
+#############################################
+
+@jobs_limit(dbJobs, 'database')
+
+@transform(processedDatasetFile,
+		   suffix('.txt'),
+		   '.load')
+
+@metrics.instrument
+
+@manifest.checksum(connectionFile, loadTargets, 'datasets2tools_dev', params=loadParams, tables=['processed_dataset'])
+
+def loadProcessedDatasets(infile, outfile):
+
+	# Import dependencies
+	import pandas as pd
+	db = importDb()
+
+	# Read table
+	processed_dataset_dataframe = pd.read_table(infile)
+	metrics.addRows(rowsIn=len(processed_dataset_dataframe.index))
+
+	# Load every target
+	def load(target):
+		engine = db.connect(connectionFile, target, 'datasets2tools_dev')
+		with engine.begin() as connection:
+			db.writeDataframe(processed_dataset_dataframe, 'processed_dataset', connection)
+
+	# Create outfile
+	metrics.writeSentinel(outfile, targets=fanOut(load, infile, outfile, loadParams()))
+
+#######################################################
+#######################################################
+########## S8. Scripts
+#######################################################
+#######################################################
+
+#############################################
+########## 1. Upload
+#############################################
+
+@jobs_limit(dbJobs, 'database')
+
+@transform(scriptsFile,
+		   suffix('.xlsx'),
+		   '.load')
+
+@metrics.instrument
+
+@manifest.checksum(connectionFile, loadTargets, 'datasets2tools_dev', params=loadParams, tables=['script'])
+
+def loadScripts(infile, outfile):
+
+	# Import dependencies
+	import pandas as pd
+	db = importDb()
+
+	# Read table
+	scripts_dataframe = pd.read_excel(infile)
+	metrics.addRows(rowsIn=len(scripts_dataframe.index))
+
+	# Load every target
+	scripts_dataframe['id'] = [x+1 for x in scripts_dataframe.index]
+	def load(target):
+		engine = db.connect(connectionFile, target, 'datasets2tools_dev')
+		if loadMode == 'sync':
+			return db.syncTable(scripts_dataframe, 'script', ['id'], engine, deleteMissing=True)
+		else:
+			with engine.begin() as connection:
+				db.replaceTable(scripts_dataframe, 'script', connection)
+
+	# Create outfile
+	metrics.writeSentinel(outfile, targets=fanOut(load, infile, outfile, loadParams()))
+
+
+#######################################################
+#######################################################
+########## S9. Rebuild Indexes
+#######################################################
+#######################################################
+
+#############################################
+########## 1. Rebuild
+#############################################
+
+@follows(loadTools, loadRepositories, loadDatasets, loadAnalyses, loadCannedAnalysisFiles, loadFeaturedTables)
+
+@transform(deferIndexes,
+		   suffix('.deferred'),
+		   '.rebuilt')
+
+@metrics.instrument
+
+def rebuildIndexes(infile, outfile):
+
+	# Import dependencies
+	db = importDb()
+	import bulkload
+
+	# Rebuild on every target
+	def load(target):
+
+		# Nothing to do unless indexes were deferred
+		reportDict = {'indexes': 0, 'foreign_keys': 0, 'orphans': []}
+		stateFile = deferredIndexState(target)
+		if os.path.exists(stateFile):
+
+			# Rebuild and analyze
+			engine = db.connect(connectionFile, target, 'datasets2tools')
+			with metrics.phase('rebuild'):
+				stateDict = bulkload.rebuildIndexes(engine, stateFile)
+			with metrics.phase('analyze'):
+				bulkload.analyzeTables(engine)
+
+			# Check consistency
+			with metrics.phase('orphans'):
+				reportDict = {'indexes': len(stateDict['indexes']), 'foreign_keys': len(stateDict['foreign_keys']), 'orphans': bulkload.findOrphans(engine, stateDict['foreign_keys'])}
+			for orphanDict in reportDict['orphans']:
+				print('{orphans} rows of {table} on {target} reference missing {referenced_table} rows through {constraint}, e.g. {examples}.'.format(target=target, **orphanDict))
+		return reportDict
+
+	# Write report
+	reportList = fanOut(load, infile, outfile)
+	with open(outfile, 'w') as openfile:
+		json.dump({'targets': reportList}, openfile, indent=4)
+
+#######################################################
+#######################################################
+########## S10. Serving Table
+#######################################################
+#######################################################
+
+#############################################
+########## 1. Build
+#############################################
+
+@follows(mkdir('f9-serving.dir'))
+
+@jobs_limit(dbJobs, 'database')
+
+@merge([loadTools, loadRepositories, loadDatasets, loadAnalyses, loadCannedAnalysisFiles, rebuildIndexes],
+	   'f9-serving.dir/canned_analysis_search.json')
+
+@metrics.instrument
+
+def buildServingTable(infiles, outfile):
+
+	# Import dependencies
+	import serving
+	db = importDb()
+
+	# Update changed rows in place, or rebuild and swap in the table, on every target
+	def load(target):
+		reportDict = serving.buildTable(db.connect(connectionFile, target, 'datasets2tools'), force=rebuildServingTable)
+		metrics.addRows(rowsOut=reportDict['changed'])
+		return reportDict
+
+	# Write report
+	reportList = fanOut(load, infiles, outfile, {'rebuildServingTable': rebuildServingTable})
+	with open(outfile, 'w') as openfile:
+		json.dump({'targets': reportList}, openfile, indent=4)
+
+#######################################################
+#######################################################
+########## S11. SQLite Snapshot
+#######################################################
+#######################################################
+
+#############################################
+########## 1. Export
+#############################################
+
+@follows(mkdir('f10-snapshot.dir'))
+
+@jobs_limit(dbJobs, 'database')
+
+@merge([loadTools, loadRepositories, loadDatasets, loadAnalyses, loadCannedAnalysisFiles, loadFeaturedTables, loadProcessedDatasets, loadScripts, rebuildIndexes, buildServingTable],
+	   'f10-snapshot.dir/datasets2tools.sqlite')
+
+@metrics.instrument
+
+def exportSnapshot(infiles, outfile):
+
+	# Import dependencies
+	import snapshot
+	db = importDb()
+
+	# Get engines of the first target
+	engines = {x: db.connect(connectionFile, loadTargets[0], x) for x in ['datasets2tools', 'datasets2tools_dev']}
+
+	# Export
+	reportDict = snapshot.exportSnapshot(engines, outfile, chunkSize=snapshotChunkSize)
+	metrics.addRows(rowsOut=sum([x['rows'] for x in reportDict['tables'].values()]))
+
+#######################################################
+#######################################################
+########## S. 
+#######################################################
+#######################################################
+
+#############################################
+########## . 
+#############################################
+
+##################################################
+##################################################
+########## Run pipeline
+##################################################
+##################################################
+
+#############################################
+########## 1. Command-line options
+#############################################
+
+def getParser():
+
+	# Ruffus options, with --jobs for the number of parallel tasks
+	parser = cmdline.get_argparse(description='Datasets2Tools database pipeline.')
+	parser.add_argument('--db-jobs', type=int, default=dbJobs, help='Maximum number of tasks writing to the database at once.')
+	parser.add_argument('--list', action='store_true', help='List the tasks and exit.')
+	parser.add_argument('targets', nargs='*', help='Tasks to run.')
+	return parser
+
+#############################################
+########## 2. Main
+#############################################
+
+def main(argv=None):
+
+	# Parse options
+	options = getParser().parse_args(argv)
+	options.target_tasks += options.targets
+
+	# List tasks, leaving out the directories ruffus makes before them
+	if options.list:
+		for taskName in pipeline_get_task_names():
+			if not taskName.startswith('mkdir('):
+				print(taskName.split('.')[-1])
+		return
+
+	# Jobs run in a daemonic process pool unless --use_threads is given, and daemonic processes cannot
+	# start the target processes of fanout or the workers of parallel.loadFiles
+	if options.jobs > 1 and not options.use_threads and (len(loadTargets) > 1 or (analysisLoader == 'direct' and analysisWorkers > 1)):
+		getParser().error('--jobs {} needs --use_threads with {}, whose tasks start processes of their own.'.format(options.jobs, 'several loadTargets' if len(loadTargets) > 1 else "analysisLoader = 'direct'"))
+
+	# The database job limit is registered when the tasks are decorated, so replace it
+	if options.db_jobs != dbJobs:
+		from ruffus.task import Task
+		Task._job_limit_semaphores['database'] = options.db_jobs
+
+	# Run
+	cmdline.run(options)
+	print('Done!')
+
+#######################################################
+if __name__ == '__main__':
+	main()
@@ -1,53 +1,150 @@
 # -*- coding: utf-8 -*-
 import pandas as pd
 import numpy as np
-import xml.etree.ElementTree as ET
 import urllib, json, os, warnings, time
+import db, geo, metrics, lookup, dedup
 
 warnings.filterwarnings("ignore")
 
 class CannedAnalysisTable:
     
-    def __init__(self, inputAnalysisDataframe, engine, verbose=1):
+    def __init__(self, inputAnalysisDataframe, engine, verbose=1, batch_size=1000, lookup_mode='index', id_blocks=None, compact=False, report_memory=False, dedup=True, ensure_index=True):
         cols = ['dataset_accession', 'tool_name', 'canned_analysis_url', 'metadata']
         if not all([x in inputAnalysisDataframe.columns for x in cols]):
             raise ValueError('Dataframe columns must contain all of the following: ' + ', '.join(cols) + '.  Instead, they are: ' + ', '.join(inputAnalysisDataframe.columns) + '.')
         self.input_df = inputAnalysisDataframe.dropna()
         self.engine = engine
         self.verbose = verbose
+        self.batch_size = batch_size
+        if lookup_mode not in ['full', 'index', 'server']:
+            raise ValueError('lookup_mode must be full, index or server.')
+        self.lookup_mode = lookup_mode
+        self.id_blocks = id_blocks or {}
+        self.compact = compact
+        self.report_memory = report_memory
+        self.dedup = dedup
+        self.ensure_index = ensure_index
+        self.skipped_analyses = 0
         
+    @classmethod
+    def stream_file(cls, infile, engine, outfiles, chunksize=10000, **kwargs):
+        table = None
+        for outfile in outfiles[:4]:
+            open(outfile, 'w').close()
+        for chunk_df in pd.read_table(infile, chunksize=chunksize):
+            if table is None:
+                table = cls(chunk_df, engine, **kwargs)
+                table.fetch_lookups()
+            else:
+                table.input_df = chunk_df.dropna()
+            table.annotate_input()
+            table.load_data(fetch=False)
+            table.write_metadata()
+            table.write_files(outfiles, append=True)
+            table.update_lookups()
+        return table
+
     def fetch_tables(self):
-        self.tool_df = pd.read_sql_query('SELECT id AS tool_fk, LCASE(tool_name) AS tool_name FROM tool', self.engine)
-        self.dataset_df = pd.read_sql_query('SELECT id AS dataset_fk, dataset_accession AS dataset_accession FROM dataset', self.engine)
-        self.repo_df = pd.read_sql_query('SELECT id AS repository_fk, LCASE(repository_name) AS repository_name FROM repository', self.engine)
-        self.term_df = pd.read_sql_query('SELECT id AS term_fk, LCASE(term_name) AS term_name FROM term', self.engine)
-        self.input_df['tool_name'] = [x.lower() for x in self.input_df['tool_name']]
-        self.annotated_df = self.input_df.merge(self.tool_df, on='tool_name', how='left').merge(self.dataset_df, on='dataset_accession', how='left')
+        self.fetch_lookups()
+        self.annotate_input()
+
+    def fetch_lookups(self):
+        if self.lookup_mode == 'full':
+            self.tool_df = pd.read_sql_query('SELECT id AS tool_fk, LCASE(tool_name) AS tool_name FROM tool', self.engine)
+            self.dataset_df = pd.read_sql_query('SELECT id AS dataset_fk, dataset_accession AS dataset_accession FROM dataset', self.engine)
+            self.repo_df = pd.read_sql_query('SELECT id AS repository_fk, LCASE(repository_name) AS repository_name FROM repository', self.engine)
+            self.term_df = pd.read_sql_query('SELECT id AS term_fk, LCASE(term_name) AS term_name FROM term', self.engine)
+        else:
+            self.lookup_index = lookup.LookupIndex(self.engine)
+            for kind in ['tool', 'repository', 'term'] + (['dataset'] if self.lookup_mode == 'index' else []):
+                self.lookup_index.refresh(kind)
+            if self.verbose == 1: print 'Refreshed lookup index: ' + ', '.join([x + ' ' + str(y) for x, y in self.lookup_index.stats.iteritems()]) + '.'
+            self.tool_df = self.lookup_index.frame('tool', 'tool_fk', 'tool_name')
+            self.repo_df = self.lookup_index.frame('repository', 'repository_fk', 'repository_name')
+            self.term_df = self.lookup_index.frame('term', 'term_fk', 'term_name')
+            self.dataset_df = pd.DataFrame(columns=['dataset_fk', 'dataset_accession'])
+        if self.dedup and self.ensure_index:
+            dedup.ensureIndex(self.engine)
         self.connection = self.engine.connect()
         self.transaction = self.connection.begin()
         self.repo_df['repository_name'] = [x.replace('\xc2\xa0', ' ') for x in self.repo_df['repository_name']]
+        self.metadata_written = False
+
+    def annotate_input(self):
+        self.input_df['tool_name'] = [x.lower() for x in self.input_df['tool_name']]
+        if self.lookup_mode != 'full':
+            self.resolve_datasets()
+        self.annotated_df = self.input_df.merge(self.tool_df, on='tool_name', how='left').merge(self.dataset_df, on='dataset_accession', how='left')
+        self.compact_strings(self.input_df, ['tool_name', 'dataset_accession'])
+        self.compact_strings(self.annotated_df, ['tool_name', 'dataset_accession'])
+
+    def compact_strings(self, dataframe, columns):
+        if self.compact:
+            for column in columns:
+                dataframe[column] = dataframe[column].astype('category')
+
+    def compact_keys(self, dataframe, columns):
+        if self.compact:
+            for column in columns:
+                if hasattr(pd, 'Int64Dtype'):
+                    dataframe[column] = dataframe[column].astype('Int64')
+                elif dataframe[column].notnull().all():
+                    dataframe[column] = dataframe[column].astype(np.int64)
+
+    def map_values(self, series, mapping, key=None):
+        if not pd.api.types.is_categorical_dtype(series):
+            return (series.map(key) if key else series).map(mapping)
+        categories = pd.Series(series.cat.categories)
+        mapped = (categories.map(key) if key else categories).map(mapping).values.astype(float)
+        codes = series.cat.codes.values
+        return pd.Series(np.where(codes >= 0, mapped.take(codes.clip(0)) if len(mapped) else np.nan, np.nan), index=series.index)
+
+    def memory_report(self):
+        return {name: round(getattr(self, name).memory_usage(deep=True).sum() / 1048576., 1) for name in ['input_df', 'annotated_df', 'analysis_df', 'metadata_df'] if hasattr(self, name)}
+
+    def resolve_datasets(self):
+        accessions = set(self.input_df['dataset_accession']) - set(self.dataset_df['dataset_accession'])
+        if self.lookup_mode == 'server':
+            resolved_dict = lookup.resolveOnServer(self.connection, 'dataset', accessions)
+        else:
+            resolved_dict = self.lookup_index.resolve('dataset', accessions)
+        if resolved_dict:
+            self.dataset_df = pd.concat([self.dataset_df, pd.DataFrame({'dataset_fk': resolved_dict.values(), 'dataset_accession': resolved_dict.keys()})], ignore_index=True)
+
+    def term_key(self, term_name):
+        return term_name.lower()
+
+    def update_lookups(self):
+        if len(self.new_dataset_df.index):
+            self.dataset_df = pd.concat([self.dataset_df, self.new_dataset_df[['id', 'dataset_accession']].rename(columns={'id': 'dataset_fk'})], ignore_index=True)
+        if len(self.new_term_df.index):
+            new_term_df = self.new_term_df[['id', 'term_name']].rename(columns={'id': 'term_fk'})
+            new_term_df['term_name'] = [self.term_key(x) for x in new_term_df['term_name']]
+            self.term_df = pd.concat([self.term_df, new_term_df], ignore_index=True)
 
     def insert_dataframe(self, dataframe, tableName, connection):
-        for index, rowData in dataframe.iterrows():
-            insertCommand = 'INSERT INTO ' + tableName + '(`' + '`, `'.join(rowData.index).encode('ascii', 'ignore') + '`) VALUES ("' + '", "'.join([str(x).encode('ascii', 'ignore').replace('%', '%%') if type(x) != int else str(x) for x in rowData.values]) + '");'
-            connection.execute(insertCommand)
-            dataframe.loc[index, 'id'] = connection.execute('SELECT LAST_INSERT_ID();').fetchall()[0][0]
-        dataframe['id'] = dataframe['id'].astype(int)
-        return dataframe
+        for column in dataframe.columns[dataframe.dtypes == object]:
+            dataframe[column] = [x.encode('ascii', 'ignore') if isinstance(x, unicode) else x for x in dataframe[column]]
+        return db.insertData(dataframe, tableName, connection, batchSize=self.batch_size)
+
+    def annotate_datasets(self, dataset_accessions, attributes = ['title', 'summary']):
+        summary_dict = geo.fetchSummaries(dataset_accessions, attributes)
+        annotation_dict = {}
+        for dataset_accession in set(dataset_accessions):
+            if dataset_accession[:3] in ['GDS', 'GSE']:
+                if summary_dict.get(dataset_accession):
+                    annotDict = {x: y.encode('ascii', 'ignore') for x, y in summary_dict[dataset_accession].iteritems()}
+                    annotDict['dataset_landing_url'] = geo.landingUrl(dataset_accession)
+                    annotDict['repository_name'] = 'gene expression omnibus'
+                else:
+                    annotDict = {'title': '', 'summary': '', 'repository_name': 'gene expression omnibus', 'dataset_landing_url': ''}
+            else:
+                annotDict = {'title': '', 'summary': '', 'repository_name': '', 'dataset_landing_url': ''}
+            annotation_dict[dataset_accession] = annotDict
+        return annotation_dict
 
     def annotate_dataset(self, dataset_accession, attributes = ['title', 'summary']):
-        if dataset_accession[:3] in ['GDS', 'GSE']:
-            try:
-                geoId = ET.fromstring(urllib.urlopen('https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esearch.fcgi?db=gds&term={dataset_accession}%5BAccession%20ID%5D'.format(**locals())).read()).findall('IdList')[0][0].text
-                root = ET.fromstring(urllib.urlopen('https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esummary.fcgi?db=gds&id={geoId}'.format(**locals())).read())
-                annotDict = {x.attrib['Name']: x.text.encode('ascii', 'ignore').replace('%', '%%').replace('"', "'") for x in root.find('DocSum') if 'Name' in x.attrib.keys() and x.attrib['Name'] in attributes}
-                annotDict['dataset_landing_url'] = 'https://www.ncbi.nlm.nih.gov/geo/query/acc.cgi?acc='+dataset_accession if dataset_accession[:3] == 'GDS' else 'https://www.ncbi.nlm.nih.gov/geo/query/acc.cgi?acc='+dataset_accession
-                annotDict['repository_name'] = 'gene expression omnibus'
-            except:
-                annotDict = {'title': '', 'summary': '', 'repository_name': 'gene expression omnibus', 'dataset_landing_url': ''}
-        else:
-            annotDict = {'title': '', 'summary': '', 'repository_name': '', 'dataset_landing_url': ''}
-        return annotDict
+        return self.annotate_datasets([dataset_accession], attributes)[dataset_accession]
     
     def check_tools(self):
         null_tools = self.annotated_df['tool_fk'].isnull()
@@ -57,60 +154,106 @@ class CannedAnalysisTable:
             if self.verbose == 1: print 'All ' + str(len(self.annotated_df['tool_fk'].unique())) + ' tools in database.'
             
     def check_datasets(self):
-        self.missing_datasets = self.annotated_df.loc[self.annotated_df['dataset_fk'].isnull(), 'dataset_accession'].unique()
+        self.missing_datasets = np.asarray(self.annotated_df.loc[self.annotated_df['dataset_fk'].isnull(), 'dataset_accession'].unique())
         if len(self.missing_datasets) == 0:
             if self.verbose == 1: print 'All ' + str(len(self.annotated_df['dataset_fk'].unique())) + ' datasets in database.'
             self.new_dataset_df = pd.DataFrame()
         else:
             if self.verbose == 1: print 'Adding missing datasets (' + str(len(self.missing_datasets)) + '/' + str(len(self.annotated_df['dataset_accession'].unique())) + '): ' + ', '.join(self.missing_datasets) + '.'
-            self.new_dataset_df = pd.DataFrame({x: self.annotate_dataset(x) for x in self.missing_datasets}).T.reset_index().rename(columns={'title': 'dataset_title', 'summary': 'dataset_description', 'index': 'dataset_accession'})
+            self.new_dataset_df = pd.DataFrame(self.annotate_datasets(self.missing_datasets)).T.reset_index().rename(columns={'title': 'dataset_title', 'summary': 'dataset_description', 'index': 'dataset_accession'})
             self.new_dataset_df = self.insert_dataframe(self.new_dataset_df.merge(self.repo_df, on='repository_name', how='left').drop('repository_name', axis=1), 'dataset', self.connection)
-            datasetIdDict = {rowData['dataset_accession']:rowData['id'] for index, rowData in self.new_dataset_df.iterrows()}
-            for dataset in self.missing_datasets:
-                self.annotated_df.loc[self.annotated_df['dataset_accession'] == dataset, 'dataset_fk'] = datasetIdDict[dataset]
+            self.annotated_df['dataset_fk'] = self.annotated_df['dataset_fk'].fillna(self.map_values(self.annotated_df['dataset_accession'], self.new_dataset_df.set_index('dataset_accession')['id']))
+        self.compact_keys(self.annotated_df, ['tool_fk', 'dataset_fk'])
                 
     def check_terms(self):
-        self.missing_terms = self.metadata_df.loc[self.metadata_df['term_fk'].isnull(), 'term_name'].unique()
+        missing_terms = pd.Series(self.metadata_df.loc[self.metadata_df['term_fk'].isnull(), 'term_name'].astype(object).unique())
+        self.missing_terms = np.asarray(missing_terms[~missing_terms.map(self.term_key).duplicated()])
         if len(self.missing_terms) == 0:
             if self.verbose == 1: print 'All ' + str(len(self.metadata_df['term_fk'].unique())) + ' metadata terms in database.'
             self.new_term_df = pd.DataFrame()
         else:
             if self.verbose == 1: print 'Adding missing metadata terms (' + str(len(self.missing_terms)) + '/' + str(len(self.metadata_df['term_name'].unique())) + '): ' + ', '.join(self.missing_terms) + '.'
-            self.new_term_df = self.insert_dataframe(pd.DataFrame([[term, ''] for term in self.missing_terms], columns=['term_name', 'term_description']), 'term', self.connection)
-            termIdDict = {rowData['term_name']:rowData['id'] for index, rowData in self.new_term_df.iterrows()}
-            for term in self.missing_terms:
-                self.metadata_df.loc[self.metadata_df['term_name'] == term, 'term_fk'] = termIdDict[term]
-        self.metadata_df = self.metadata_df[['canned_analysis_fk', 'term_fk', 'value']]
+            self.new_term_df = self.insert_dataframe(pd.DataFrame({'term_name': self.missing_terms, 'term_description': ''}, columns=['term_name', 'term_description']), 'term', self.connection)
+            self.metadata_df['term_fk'] = self.metadata_df['term_fk'].fillna(self.map_values(self.metadata_df['term_name'], self.new_term_df.set_index(self.new_term_df['term_name'].map(self.term_key))['id'], key=self.term_key))
+        del self.metadata_df['term_name']
+        self.compact_keys(self.metadata_df, ['term_fk'])
     
+    def skip_loaded(self):
+        new_mask, fingerprints = dedup.newRows(self.annotated_df, self.connection)
+        self.skipped_count = int((~new_mask).sum())
+        self.skipped_analyses += self.skipped_count
+        if self.skipped_count:
+            if self.verbose == 1: print 'Skipping ' + str(self.skipped_count) + '/' + str(len(self.annotated_df.index)) + ' canned analyses already loaded.'
+            self.annotated_df = self.annotated_df[new_mask]
+        self.fingerprints = fingerprints[new_mask]
+
     def load_analyses(self):
+        self.skipped_count = 0
+        if self.dedup:
+            self.skip_loaded()
         if self.verbose == 1: print 'Adding ' + str(len(self.annotated_df.index)) + ' canned analyses.'
-        self.analysis_df = self.insert_dataframe(self.annotated_df[['dataset_fk', 'tool_fk', 'canned_analysis_url', 'canned_analysis_title', 'canned_analysis_description', 'canned_analysis_preview_url']], 'canned_analysis', self.connection)
-        analysisIdDict = {index:rowData['id'] for index, rowData in self.analysis_df.iterrows()}
-        self.annotated_df['metadata'] = [json.loads(x) for x in self.annotated_df['metadata']]
-        self.metadata_df = pd.DataFrame([{'canned_analysis_fk': analysisIdDict[index], 'term_name': variable.encode('ascii', 'ignore'), 'value': str(value).encode('ascii', 'ignore')} for index, metadataDict in self.annotated_df['metadata'].iteritems() for variable, value in metadataDict.iteritems()])
-        self.metadata_df = self.metadata_df.merge(self.term_df, on='term_name', how='left')
-        self.check_terms()
-
-    def commit_transaction(self, outfiles):
-        confirm = raw_input('\nCommit? (y/n) ')
-        if confirm == 'y':
-            self.transaction.commit()
-            for metadata_df_split in np.array_split(self.metadata_df, max(len(self.metadata_df.index)/5000, 1)):
-                metadata_df_split.to_sql('canned_analysis_metadata', self.engine, index=False, if_exists='append')
-            os.system('touch '+outfiles[-1])
+        self.analysis_df = self.annotated_df[['dataset_fk', 'tool_fk', 'canned_analysis_url', 'canned_analysis_title', 'canned_analysis_description', 'canned_analysis_preview_url']]
+        if 'canned_analysis' in self.id_blocks:
+            self.analysis_df.insert(0, 'id', np.arange(len(self.analysis_df.index)) + self.id_blocks['canned_analysis'])
+        self.analysis_df = self.insert_dataframe(self.analysis_df, 'canned_analysis', self.connection)
+        if self.dedup:
+            dedup.addFingerprints(self.connection, self.fingerprints, self.analysis_df['id'])
+        self.explode_metadata()
+        if 'canned_analysis_metadata' in self.id_blocks:
+            self.metadata_df.insert(0, 'id', np.arange(len(self.metadata_df.index)) + self.id_blocks['canned_analysis_metadata'])
+        self.metadata_df.insert(list(self.metadata_df.columns).index('term_name'), 'term_fk', self.map_values(self.metadata_df['term_name'], self.term_df.drop_duplicates('term_name').set_index('term_name')['term_fk'], key=self.term_key))
+        with metrics.phase('check_terms'):
+            self.check_terms()
+
+    def explode_metadata(self):
+        metadata = json.loads('[' + ','.join(self.annotated_df['metadata']) + ']')
+        self.metadata_df = pd.DataFrame({'canned_analysis_fk': np.repeat(self.analysis_df['id'].values, [len(x) for x in metadata]),
+                                         'term_name': pd.Series([variable for metadataDict in metadata for variable in metadataDict], dtype=object).str.encode('ascii', 'ignore'),
+                                         'value': pd.Series([value for metadataDict in metadata for value in metadataDict.itervalues()], dtype=object).astype(unicode).str.encode('ascii', 'ignore')},
+                                        columns=['canned_analysis_fk', 'term_name', 'value'])
+        self.compact_strings(self.metadata_df, ['term_name', 'value'])
+
+    def write_metadata(self):
+        db.writeDataframe(self.metadata_df, 'canned_analysis_metadata', self.connection)
+        self.metadata_written = True
+
+    def commit_transaction(self, outfiles, commit=None):
+        if commit is None:
+            commit = raw_input('\nCommit? (y/n) ') == 'y'
+        if commit:
+            with metrics.phase('commit'):
+                if not self.metadata_written:
+                    self.write_metadata()
+                self.transaction.commit()
+            if outfiles:
+                os.system('touch '+outfiles[-1])
         else:
             self.transaction.rollback()
             for outfile in outfiles[:4]:
                 os.unlink(outfile)
             
-    def write_files(self, outfiles):
-        self.new_dataset_df.to_csv(outfiles[0], sep='\t', index=False)
-        self.analysis_df.to_csv(outfiles[1], sep='\t', index=False)
-        self.metadata_df.to_csv(outfiles[2], sep='\t', index=False)
-        self.new_term_df.to_csv(outfiles[3], sep='\t', index=False)
+    def write_files(self, outfiles, append=False):
+        for outfile, dataframe in zip(outfiles, [self.new_dataset_df, self.analysis_df, self.metadata_df, self.new_term_df]):
+            if not append:
+                dataframe.to_csv(outfile, sep='\t', index=False)
+            elif len(dataframe.index):
+                dataframe.to_csv(outfile, sep='\t', index=False, mode='a', header=os.path.getsize(outfile) == 0)
             
-    def load_data(self):
-        self.fetch_tables()
+    def record_memory(self, record_dict):
+        if self.report_memory:
+            record_dict['frames_mb'] = self.memory_report()
+            if self.verbose == 1: print record_dict['phase'] + ' memory (MB): ' + ', '.join([x + ' ' + str(y) for x, y in sorted(record_dict['frames_mb'].items())]) + '.'
+
+    def load_data(self, fetch=True):
+        if fetch:
+            with metrics.phase('fetch_tables') as record_dict:
+                self.fetch_tables()
+                metrics.addRows(rowsIn=len(self.input_df.index))
+                self.record_memory(record_dict)
         self.check_tools()
-        self.check_datasets()
-        self.load_analyses()
\ No newline at end of file
+        with metrics.phase('check_datasets') as record_dict:
+            self.check_datasets()
+            self.record_memory(record_dict)
+        with metrics.phase('load_analyses') as record_dict:
+            self.load_analyses()
+            self.record_memory(record_dict)
\ No newline at end of file
@@ -10,14 +10,8 @@
 #############################################
 ########## 1. Load libraries
 #############################################
-##### 1. Python modules #####
-import sys, urllib
-import xml.etree.ElementTree as ET
-
-##### 2. Custom modules #####
-# Pipeline running
-sys.path.append('/Users/denis/Documents/Projects/scripts')
-import Support as S 
+##### 1. Custom modules #####
+import geo
 
 #############################################
 ########## 2. General Setup
@@ -34,20 +28,26 @@ import Support as S
 ########## 1. Annotate Dataset 
 #############################################
 
+def annotateDatasets(datasetAccessions, attributes = ['title', 'summary'], **kwargs):
+	# Raises geo.GeoLookupError if a request failed, so only accessions GEO does not know get empty fields
+	summaryDict = geo.fetchSummaries(datasetAccessions, attributes, **kwargs)
+	annotationDict = {}
+	for dataset_accession in set(datasetAccessions):
+		if dataset_accession[:3] in ['GDS', 'GSE']:
+			if summaryDict.get(dataset_accession):
+				annotDict = {x: y.encode('ascii', 'ignore').replace('%', '%%').replace('"', "'") for x, y in summaryDict[dataset_accession].iteritems()}
+				annotDict['dataset_landing_url'] = geo.landingUrl(dataset_accession)
+				annotDict['repository_name'] = 'gene expression omnibus'
+				annotDict['dataset_accession'] = dataset_accession
+			else:
+				annotDict = {'title': '', 'summary': '', 'repository_name': 'gene expression omnibus', 'dataset_landing_url': '', 'dataset_accession': dataset_accession}
+		else:
+			annotDict = {'title': '', 'summary': '', 'repository_name': '', 'dataset_landing_url': '', 'dataset_accession': dataset_accession}
+		annotationDict[dataset_accession] = annotDict
+	return annotationDict
+
 def annotateDataset(dataset_accession, attributes = ['title', 'summary']):
-    if dataset_accession[:3] in ['GDS', 'GSE']:
-        try:
-            geoId = ET.fromstring(urllib.urlopen('https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esearch.fcgi?db=gds&term={dataset_accession}%5BAccession%20ID%5D'.format(**locals())).read()).findall('IdList')[0][0].text
-            root = ET.fromstring(urllib.urlopen('https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esummary.fcgi?db=gds&id={geoId}'.format(**locals())).read())
-            annotDict = {x.attrib['Name']: x.text.encode('ascii', 'ignore').replace('%', '%%').replace('"', "'") for x in root.find('DocSum') if 'Name' in x.attrib.keys() and x.attrib['Name'] in attributes}
-            annotDict['dataset_landing_url'] = 'https://www.ncbi.nlm.nih.gov/geo/query/acc.cgi?acc='+dataset_accession if dataset_accession[:3] == 'GDS' else 'https://www.ncbi.nlm.nih.gov/geo/query/acc.cgi?acc='+dataset_accession
-            annotDict['repository_name'] = 'gene expression omnibus'
-            annotDict['dataset_accession'] = dataset_accession
-        except:
-            annotDict = {'title': '', 'summary': '', 'repository_name': 'gene expression omnibus', 'dataset_landing_url': '', 'dataset_accession': dataset_accession}
-    else:
-        annotDict = {'title': '', 'summary': '', 'repository_name': '', 'dataset_landing_url': '', 'dataset_accession': dataset_accession}
-    return annotDict
+	return annotateDatasets([dataset_accession], attributes)[dataset_accession]
 
 #######################################################
 #######################################################
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+#################################################################
+#################################################################
+############### Datasets2Tools Bulk Load ########################
+#################################################################
+#################################################################
+##### Author: Denis Torre
+##### Affiliation: Ma'ayan Laboratory,
+##### Icahn School of Medicine at Mount Sinai
+
+#############################################
+########## 1. Load libraries
+#############################################
+##### 1. Python modules #####
+import os, json
+from collections import OrderedDict
+
+#######################################################
+#######################################################
+########## S1. Definitions
+#######################################################
+#######################################################
+
+#############################################
+########## 1. Indexes
+#############################################
+
+def secondaryIndexes(engine):
+	'''
+	Returns the non-unique secondary indexes of every table in the database, as dicts with
+	their table, name, type and columns in order.  Primary and unique keys are left alone,
+	since rows loaded without them could not be checked afterwards.
+	'''
+	# Get index columns
+	rows = engine.execute('''SELECT TABLE_NAME, INDEX_NAME, INDEX_TYPE, COLUMN_NAME, SUB_PART FROM information_schema.STATISTICS
+							 WHERE TABLE_SCHEMA = DATABASE() AND INDEX_NAME != 'PRIMARY' AND NON_UNIQUE = 1 ORDER BY TABLE_NAME, INDEX_NAME, SEQ_IN_INDEX''').fetchall()
+
+	# Group by index
+	indexDict = OrderedDict()
+	for tableName, indexName, indexType, columnName, subPart in rows:
+		indexDict.setdefault((tableName, indexName), {'table': tableName, 'name': indexName, 'type': indexType, 'columns': []})['columns'].append('`{}`{}'.format(columnName, '({})'.format(subPart) if subPart else ''))
+	return indexDict.values()
+
+#############################################
+########## 2. Foreign Keys
+#############################################
+
+def foreignKeys(engine):
+
+	# Get constraint columns with their rules
+	rows = engine.execute('''SELECT k.TABLE_NAME, k.CONSTRAINT_NAME, k.COLUMN_NAME, k.REFERENCED_TABLE_NAME, k.REFERENCED_COLUMN_NAME, r.UPDATE_RULE, r.DELETE_RULE
+							 FROM information_schema.KEY_COLUMN_USAGE k JOIN information_schema.REFERENTIAL_CONSTRAINTS r ON r.CONSTRAINT_SCHEMA = k.CONSTRAINT_SCHEMA AND r.CONSTRAINT_NAME = k.CONSTRAINT_NAME AND r.TABLE_NAME = k.TABLE_NAME
+							 WHERE k.TABLE_SCHEMA = DATABASE() AND k.REFERENCED_TABLE_NAME IS NOT NULL ORDER BY k.TABLE_NAME, k.CONSTRAINT_NAME, k.ORDINAL_POSITION''').fetchall()
+
+	# Group by constraint
+	keyDict = OrderedDict()
+	for tableName, constraintName, columnName, referencedTable, referencedColumn, updateRule, deleteRule in rows:
+		keyDict.setdefault((tableName, constraintName), {'table': tableName, 'name': constraintName, 'columns': [], 'referenced_table': referencedTable, 'referenced_columns': [], 'on_update': updateRule, 'on_delete': deleteRule})
+		keyDict[(tableName, constraintName)]['columns'].append(columnName)
+		keyDict[(tableName, constraintName)]['referenced_columns'].append(referencedColumn)
+	return keyDict.values()
+
+#######################################################
+#######################################################
+########## S2. Defer and Rebuild
+#######################################################
+#######################################################
+
+#############################################
+########## 1. Defer
+#############################################
+
+def deferIndexes(engine, stateFile):
+	'''
+	Drops the foreign keys and non-unique secondary indexes of the database before a bulk
+	load, adding their definitions to stateFile first.  Definitions left in stateFile by an
+	interrupted load are kept, so they are rebuilt too.  Returns all saved definitions.
+	'''
+	# Get live definitions, and those saved by an interrupted load
+	currentDict = {'indexes': secondaryIndexes(engine), 'foreign_keys': foreignKeys(engine)}
+	stateDict = json.load(open(stateFile)) if os.path.exists(stateFile) else {'indexes': [], 'foreign_keys': []}
+
+	# Save both before dropping anything
+	for kind in ['indexes', 'foreign_keys']:
+		saved = set([(x['table'], x['name']) for x in stateDict[kind]])
+		stateDict[kind] += [x for x in currentDict[kind] if (x['table'], x['name']) not in saved]
+	with open(stateFile, 'w') as openfile:
+		json.dump(stateDict, openfile, indent=4)
+
+	# Drop foreign keys first, since InnoDB needs an index behind each of them
+	for tableName in sorted(set([x['table'] for x in currentDict['foreign_keys']])):
+		engine.execute('ALTER TABLE `{}` {}'.format(tableName, ', '.join(['DROP FOREIGN KEY `{}`'.format(x['name']) for x in currentDict['foreign_keys'] if x['table'] == tableName])))
+	for tableName in sorted(set([x['table'] for x in currentDict['indexes']])):
+		engine.execute('ALTER TABLE `{}` {}'.format(tableName, ', '.join(['DROP INDEX `{}`'.format(x['name']) for x in currentDict['indexes'] if x['table'] == tableName])))
+	return stateDict
+
+#############################################
+########## 2. Rebuild
+#############################################
+
+def rebuildIndexes(engine, stateFile):
+	'''
+	Recreates the indexes and foreign keys saved by deferIndexes, with one ALTER TABLE per
+	table so each table is rebuilt in a single pass, then removes stateFile.  Foreign keys
+	are added without checking existing rows; findOrphans reports those instead.
+	'''
+	# Read definitions
+	with open(stateFile) as openfile:
+		stateDict = json.load(openfile)
+
+	# Add indexes, with InnoDB's limit of one full-text index per statement
+	for tableName in sorted(set([x['table'] for x in stateDict['indexes']])):
+		indexList = [x for x in stateDict['indexes'] if x['table'] == tableName]
+		clauses = ['ADD INDEX `{}` ({})'.format(x['name'], ', '.join(x['columns'])) for x in indexList if x['type'] != 'FULLTEXT']
+		if clauses:
+			engine.execute('ALTER TABLE `{}` {}'.format(tableName, ', '.join(clauses)))
+		for x in [x for x in indexList if x['type'] == 'FULLTEXT']:
+			engine.execute('ALTER TABLE `{}` ADD FULLTEXT INDEX `{}` ({})'.format(tableName, x['name'], ', '.join(x['columns'])))
+
+	# Add foreign keys on one connection, so the session setting applies
+	with engine.connect() as connection:
+		connection.execute('SET FOREIGN_KEY_CHECKS = 0;')
+		try:
+			for tableName in sorted(set([x['table'] for x in stateDict['foreign_keys']])):
+				connection.execute('ALTER TABLE `{}` {}'.format(tableName, ', '.join(['ADD CONSTRAINT `{}` FOREIGN KEY (`{}`) REFERENCES `{}` (`{}`) ON UPDATE {} ON DELETE {}'.format(x['name'], '`, `'.join(x['columns']), x['referenced_table'], '`, `'.join(x['referenced_columns']), x['on_update'], x['on_delete']) for x in stateDict['foreign_keys'] if x['table'] == tableName])))
+		finally:
+			connection.execute('SET FOREIGN_KEY_CHECKS = 1;')
+
+	# Done
+	os.remove(stateFile)
+	return stateDict
+
+#######################################################
+#######################################################
+########## S3. Checks
+#######################################################
+#######################################################
+
+#############################################
+########## 1. Analyze
+#############################################
+
+def analyzeTables(engine, tableNames=None):
+
+	# Refresh index statistics after the load
+	tableNames = tableNames or [x for x, in engine.execute("SELECT TABLE_NAME FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE() AND TABLE_TYPE = 'BASE TABLE'").fetchall()]
+	if tableNames:
+		engine.execute('ANALYZE TABLE ' + ', '.join(['`{}`'.format(x) for x in tableNames])).fetchall()
+	return tableNames
+
+#############################################
+########## 2. Orphans
+#############################################
+
+def findOrphans(engine, foreignKeyList=None):
+	'''
+	Counts the rows of every foreign key whose value is set but missing from the referenced
+	table, with a few example values.  Returns only the keys that have orphans.
+	'''
+	# Loop through keys
+	orphanList = []
+	for foreignKey in foreignKeyList or foreignKeys(engine):
+		join = ' AND '.join(['c.`{}` = p.`{}`'.format(x, y) for x, y in zip(foreignKey['columns'], foreignKey['referenced_columns'])])
+		notNull = ' AND '.join(['c.`{}` IS NOT NULL'.format(x) for x in foreignKey['columns']])
+		query = 'FROM `{}` c LEFT JOIN `{}` p ON {} WHERE {} AND p.`{}` IS NULL'.format(foreignKey['table'], foreignKey['referenced_table'], join, notNull, foreignKey['referenced_columns'][0])
+		nOrphans = engine.execute('SELECT COUNT(*) ' + query).scalar()
+		if nOrphans:
+			examples = [list(x) for x in engine.execute('SELECT DISTINCT {} {} LIMIT 10'.format(', '.join(['c.`{}`'.format(x) for x in foreignKey['columns']]), query)).fetchall()]
+			orphanList.append({'table': foreignKey['table'], 'constraint': foreignKey['name'], 'columns': foreignKey['columns'], 'referenced_table': foreignKey['referenced_table'], 'orphans': nOrphans, 'examples': examples})
+	return orphanList
@@ -1,55 +1,332 @@
 # -*- coding: utf-8 -*-
-import json
+import json, os, tempfile
+import pandas as pd
 from sqlalchemy import *
-import xml.etree.ElementTree as ET
-import urllib
+from sqlalchemy import event, exc
+from sqlalchemy.engine import Engine
+import geo, metrics
 
-def connect(connectionFile, hostLabel, database=False, returnData=False):
+# Engines by (connection file, host label, database), shared by every call in the process
+engines = {}
+
+# Most connections each engine has had checked out at once
+peakCheckouts = {}
+
+# Count every statement in the task metrics
+event.listen(Engine, 'before_cursor_execute', metrics.countStatement)
+
+# Default pool settings, which can be overridden per host with a "pool" entry in the connection file
+poolOptions = {'pool_size': 5, 'max_overflow': 5, 'pool_recycle': 3600, 'pool_pre_ping': True}
+
+# Driver options, with local infile enabled for the 'infile' write strategy
+connectArgs = {'local_infile': 1}
+
+def readConnectionFile(connectionFile, hostLabel):
 
 	# Read info
 	with open(connectionFile, 'r') as openfile:
 
 		connectionDict = json.load(openfile)
 
-	# Extract info
-	host = connectionDict[hostLabel]['host']
-	username = connectionDict[hostLabel]['username']
-	password = connectionDict[hostLabel]['password']
+	# Return host info
+	return connectionDict[hostLabel]
+
+def makeForkSafe(engine):
+
+	# Remember which process opened each connection
+	@event.listens_for(engine, 'connect')
+	def connect(dbapiConnection, connectionRecord):
+		connectionRecord.info['pid'] = os.getpid()
+
+	# Discard connections inherited from a parent process, without closing the parent's socket
+	@event.listens_for(engine, 'checkout')
+	def checkout(dbapiConnection, connectionRecord, connectionProxy):
+		if connectionRecord.info['pid'] != os.getpid():
+			connectionRecord.connection = connectionProxy.connection = None
+			raise exc.DisconnectionError('Connection record belongs to pid %s, attempting to check out in pid %s' % (connectionRecord.info['pid'], os.getpid()))
+
+def connect(connectionFile, hostLabel, database=False, returnData=False, **kwargs):
 
 	# Return data
 	if returnData:
 
-		return (host, username, password)
+		# Extract info
+		hostDict = readConnectionFile(connectionFile, hostLabel)
+		return (hostDict['host'], hostDict['username'], hostDict['password'])
 
 	else:
 
-		# Get string
-		if database:
-			connectionString = 'mysql://%(username)s:%(password)s@%(host)s/%(database)s' % locals()
-		else:
-			connectionString = 'mysql://%(username)s:%(password)s@%(host)s' % locals()
-			
-		# Get engine
-		engine = create_engine(connectionString)
+		# Get registry key
+		key = (os.path.abspath(connectionFile), hostLabel, database)
+
+		# Create engine on first use
+		if key not in engines:
+
+			# Extract info
+			hostDict = readConnectionFile(connectionFile, hostLabel)
+			host = hostDict['host']
+			username = hostDict['username']
+			password = hostDict['password']
+
+			# Get string
+			if database:
+				connectionString = 'mysql://%(username)s:%(password)s@%(host)s/%(database)s' % locals()
+			else:
+				connectionString = 'mysql://%(username)s:%(password)s@%(host)s' % locals()
+
+			# Get engine
+			engines[key] = create_engine(connectionString, connect_args=connectArgs, **dict(poolOptions, **dict(hostDict.get('pool', {}), **kwargs)))
+			makeForkSafe(engines[key])
+			trackPeak(key, engines[key])
 
 		# Return
-		return engine
+		return engines[key]
+
+def trackPeak(key, engine):
+
+	# Record the most connections an engine has had checked out at once, to size pools against max_connections
+	peakCheckouts[key] = 0
+	@event.listens_for(engine, 'checkout')
+	def checkout(dbapiConnection, connectionRecord, connectionProxy):
+		peakCheckouts[key] = max(peakCheckouts.get(key, 0), engine.pool.checkedout())
 
+def poolStatistics():
 
+	# Get pool status of every engine
+	statistics = []
+	for (connectionFile, hostLabel, database), engine in engines.items():
+		statistics.append({'connection_file': connectionFile, 'host_label': hostLabel, 'database': database or '', 'pid': os.getpid(),
+						   'size': engine.pool.size(), 'checked_in': engine.pool.checkedin(), 'checked_out': engine.pool.checkedout(), 'overflow': engine.pool.overflow(),
+						   'peak_checked_out': peakCheckouts.get((connectionFile, hostLabel, database), 0)})
+	return statistics
+
+def disposeEngines():
+
+	# Close all pooled connections
+	for engine in engines.values():
+		engine.dispose()
+	engines.clear()
+	peakCheckouts.clear()
+
+
+
+def annotateDatasets(geoAccessions, attributes = ['title', 'summary', 'taxon', 'gdsType'], **kwargs):
+	annotationDict = {}
+	for geoAccession, summaryDict in geo.fetchSummaries(geoAccessions, attributes, **kwargs).iteritems():
+		if summaryDict:
+			annotDict = dict(summaryDict)
+			annotDict['dataset_landing_url'] = geo.landingUrl(geoAccession)
+			annotDict['repository_name'] = 'gene expression omnibus'
+			annotationDict[geoAccession] = annotDict
+	return annotationDict
 
 def annotate(geoAccession, attributes = ['title', 'summary', 'taxon', 'gdsType']):
-	geoId = ET.fromstring(urllib.urlopen('https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esearch.fcgi?db=gds&term={geoAccession}%5BAccession%20ID%5D'.format(**locals())).read()).findall('IdList')[0][0].text
-	root = ET.fromstring(urllib.urlopen('https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esummary.fcgi?db=gds&id={geoId}'.format(**locals())).read())
-	annotDict = {x.attrib['Name']: x.text for x in root.find('DocSum') if 'Name' in x.attrib.keys() and x.attrib['Name'] in attributes}
-	annotDict['dataset_landing_url'] = 'https://www.ncbi.nlm.nih.gov/geo/query/acc.cgi?acc='+geoAccession if geoAccession[:3] == 'GDS' else 'https://www.ncbi.nlm.nih.gov/geo/query/acc.cgi?acc='+geoAccession
-	annotDict['repository_name'] = 'gene expression omnibus'
-	return annotDict
+	return annotateDatasets([geoAccession], attributes)[geoAccession]
+
+
+
+# Default bulk-write strategy ('multirow', 'infile' or 'executemany') and rows per statement
+writeStrategy = 'multirow'
+writeBatchSize = 1000
+
+def sqlRows(dataframe, columns):
+
+	# Get rows, with missing values as NULL
+	return dataframe[columns].astype(object).where(pd.notnull(dataframe[columns]), None).values.tolist()
+
+def insertCommand(tableName, columns, nRows=1):
+	return 'INSERT INTO `' + tableName + '` (`' + '`, `'.join(columns) + '`) VALUES ' + ', '.join(['(' + ', '.join(['%s']*len(columns)) + ')']*nRows)
+
+def insertData(dataframe, tableName, connection, batchSize=1000):
+
+	# Keep explicit IDs, otherwise let the database assign them
+	explicitIds = 'id' in dataframe.columns and dataframe['id'].notnull().all()
+
+	# Get columns
+	columns = [x for x in dataframe.columns if x != 'id' or explicitIds]
+
+	# Get rows
+	rows = sqlRows(dataframe, columns)
+
+	# Get auto-increment settings
+	lockMode, increment = connection.execute('SELECT @@innodb_autoinc_lock_mode, @@auto_increment_increment;').fetchall()[0]
+
+	# Multi-row inserts only receive consecutive IDs in traditional or consecutive lock mode
+	if int(lockMode) not in (0, 1) and not explicitIds:
+		batchSize = 1
+
+	# Loop through batches
+	ids = []
+	for i in range(0, len(rows), batchSize):
+
+		# Get batch
+		batch = rows[i:i+batchSize]
+
+		# Insert, then recover the IDs from the first one
+		firstId = connection.execute(insertCommand(tableName, columns, len(batch)), tuple(x for row in batch for x in row)).lastrowid
+		ids += [firstId+j*int(increment) for j in range(len(batch))]
+
+	# Add IDs
+	metrics.addRows(rowsOut=len(rows))
+	if not explicitIds:
+		dataframe['id'] = ids
+	dataframe['id'] = dataframe['id'].astype(int)
+	return dataframe
+
+def reserveIds(engine, tableName, n):
+	'''
+	Reserves n consecutive IDs of a table by moving its auto-increment counter past them, and
+	returns the first.  Rows inserted with explicit IDs from the block never take the
+	auto-increment lock, so several processes can insert into the table at once.
+	'''
+	# Hold the table while reading and moving the counter
+	with engine.connect() as connection:
+
+		# Read the live counter rather than the copy MySQL 8 caches in information_schema, which
+		# misses the move made by a reservation just before.  Earlier versions have no cache.
+		try:
+			connection.execute('SET SESSION information_schema_stats_expiry = 0;')
+		except exc.DatabaseError:
+			pass
+		connection.execute('LOCK TABLES `' + tableName + '` WRITE;')
+		try:
+			maxId = connection.execute('SELECT COALESCE(MAX(id), 0) FROM `' + tableName + '`;').scalar()
+			autoIncrement = connection.execute('SELECT AUTO_INCREMENT FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s;', tableName).scalar()
+			firstId = max(int(maxId)+1, int(autoIncrement or 1))
+			connection.execute('ALTER TABLE `' + tableName + '` AUTO_INCREMENT = ' + str(firstId+n) + ';')
+		finally:
+			connection.execute('UNLOCK TABLES;')
+	return firstId
+
+def infileValue(value):
+
+	# Escape for LOAD DATA's default field format
+	if value is None:
+		return '\\N'
+	if isinstance(value, unicode):
+		value = value.encode('utf-8')
+	return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+def writeDataframe(dataframe, tableName, connection, strategy=None, batchSize=None, dtype=None):
+	'''
+	Appends a dataframe to a table through connection, so that it joins the caller's transaction.
+	Strategies are 'multirow' (multi-row INSERT statements), 'infile' (LOAD DATA LOCAL INFILE from
+	a temporary file written in batches) and 'executemany' (one parameterized statement per batch).
+	The table is created from the dataframe, with dtype, if it does not exist.
+	'''
+	# Get settings
+	strategy = strategy or writeStrategy
+	batchSize = batchSize or writeBatchSize
+	columns = list(dataframe.columns)
+
+	# Create table
+	if not connection.dialect.has_table(connection, tableName):
+		dataframe.head(0).to_sql(tableName, connection, index=False, dtype=dtype)
+
+	# Multi-row statements
+	if strategy == 'multirow':
+		for i in range(0, len(dataframe.index), batchSize):
+			batch = sqlRows(dataframe.iloc[i:i+batchSize], columns)
+			connection.execute(insertCommand(tableName, columns, len(batch)), tuple(x for row in batch for x in row))
+
+	# Load from file
+	elif strategy == 'infile':
+		with tempfile.NamedTemporaryFile(suffix='.txt') as openfile:
+			for i in range(0, len(dataframe.index), batchSize):
+				openfile.write(''.join(['\t'.join([infileValue(x) for x in row]) + '\n' for row in sqlRows(dataframe.iloc[i:i+batchSize], columns)]))
+			openfile.flush()
+			connection.execute("LOAD DATA LOCAL INFILE '" + openfile.name + "' INTO TABLE `" + tableName + "` CHARACTER SET utf8 (`" + '`, `'.join(columns) + '`)')
+
+	# Executemany
+	elif strategy == 'executemany':
+		for i in range(0, len(dataframe.index), batchSize):
+			connection.execute(insertCommand(tableName, columns), [tuple(x) for x in sqlRows(dataframe.iloc[i:i+batchSize], columns)])
+
+	else:
+		raise ValueError('Unknown write strategy ' + strategy + '.  Use multirow, infile or executemany.')
+
+	# Return count
+	metrics.addRows(rowsOut=len(dataframe.index))
+	return len(dataframe.index)
+
+def stableIds(dataframe, tableName, keyColumns, connection):
+
+	# Give rows the IDs their keys already have, and new keys IDs past the largest, so references to the table stay valid
+	existingDataframe = pd.read_sql_query('SELECT `id`, `' + '`, `'.join(keyColumns) + '` FROM `' + tableName + '`', connection)
+	dataframe = dataframe.merge(existingDataframe.drop_duplicates(keyColumns), on=keyColumns, how='left')
+	newRows = dataframe['id'].isnull()
+	firstId = int(existingDataframe['id'].max())+1 if len(existingDataframe.index) else 1
+	dataframe.loc[newRows, 'id'] = range(firstId, firstId+int(newRows.sum()))
+	dataframe['id'] = dataframe['id'].astype(int)
+	return dataframe[['id'] + [x for x in dataframe.columns if x != 'id']]
+
+def replaceTable(dataframe, tableName, connection, keyColumns=None, **kwargs):
+	'''
+	Deletes the rows of a table and writes dataframe in their place, in the caller's
+	transaction, so readers never see an empty table.  If the table does not exist it is
+	created, which commits in MySQL.  Rows without an id keep the one their keyColumns had,
+	and new keys get IDs past the largest, so rows referencing the table are not orphaned.
+	Foreign key checks are restored on the connection even if the write fails.
+	'''
+	# Swap the rows
+	connection.execute('SET FOREIGN_KEY_CHECKS = 0;')
+	try:
+		if connection.dialect.has_table(connection, tableName):
+			if keyColumns and 'id' not in dataframe.columns:
+				dataframe = stableIds(dataframe, tableName, keyColumns, connection)
+			connection.execute('DELETE FROM `' + tableName + '`;')
+		writeDataframe(dataframe, tableName, connection, **kwargs)
+	finally:
+		connection.execute('SET FOREIGN_KEY_CHECKS = 1;')
+
+def normalizeValues(series):
+
+	# Compare values as text, with missing values empty and integral floats as integers
+	return [('' if pd.isnull(x) else unicode(int(x)) if isinstance(x, float) and x.is_integer() else x.decode('utf-8', 'replace') if isinstance(x, str) else unicode(x)) for x in series]
+
+def syncTable(dataframe, tableName, keyColumns, engine, deleteMissing=False, batchSize=1000):
+
+	# Create the table on first load
+	if not engine.has_table(tableName):
+		with engine.begin() as connection:
+			writeDataframe(dataframe, tableName, connection, batchSize=batchSize)
+		return {'inserted': len(dataframe.index), 'updated': 0, 'deleted': 0, 'unchanged': 0}
+
+	# Get current rows
+	existingDataframe = pd.read_sql_query('SELECT `' + '`, `'.join(dataframe.columns) + '` FROM `' + tableName + '`', engine)
+
+	# Diff on the key
+	mergedDataframe = dataframe.merge(existingDataframe, on=keyColumns, how='outer', suffixes=('', '_existing'), indicator=True)
+	valueColumns = [x for x in dataframe.columns if x not in keyColumns and x != 'id']
+	changed = pd.Series(False, index=mergedDataframe.index)
+	for column in valueColumns:
+		changed |= pd.Series(normalizeValues(mergedDataframe[column]), index=mergedDataframe.index) != pd.Series(normalizeValues(mergedDataframe[column+'_existing']), index=mergedDataframe.index)
+
+	# Get changes
+	insertDataframe = dataframe.merge(mergedDataframe.loc[mergedDataframe['_merge'] == 'left_only', keyColumns], on=keyColumns)
+	updateDataframe = mergedDataframe.loc[(mergedDataframe['_merge'] == 'both') & changed, valueColumns+keyColumns]
+	deleteDataframe = mergedDataframe.loc[mergedDataframe['_merge'] == 'right_only', keyColumns]
+
+	# Apply in one transaction
+	with engine.begin() as connection:
+
+		# Insert
+		if len(insertDataframe.index):
+			writeDataframe(insertDataframe, tableName, connection, batchSize=batchSize)
 
+		# Update
+		updateCommand = 'UPDATE `' + tableName + '` SET ' + ', '.join(['`' + x + '` = %s' for x in valueColumns]) + ' WHERE ' + ' AND '.join(['`' + x + '` = %s' for x in keyColumns])
+		updateRows = updateDataframe.astype(object).where(pd.notnull(updateDataframe), None).values.tolist()
+		for i in range(0, len(updateRows), batchSize):
+			connection.execute(updateCommand, [tuple(x) for x in updateRows[i:i+batchSize]])
 
+		# Delete
+		if deleteMissing:
+			deleteCommand = 'DELETE FROM `' + tableName + '` WHERE ' + ' AND '.join(['`' + x + '` = %s' for x in keyColumns])
+			deleteRows = deleteDataframe.values.tolist()
+			for i in range(0, len(deleteRows), batchSize):
+				connection.execute(deleteCommand, [tuple(x) for x in deleteRows[i:i+batchSize]])
 
-def insertData(dataframe, tableName, connection):
-    for index, rowData in dataframe.iterrows():
-        insertCommand = 'INSERT INTO ' + tableName + '(`' + '`, `'.join(rowData.index) + '`) VALUES ("' + '", "'.join([str(x).replace('%', '%%') for x in rowData.values]) + '");'
-        connection.execute(insertCommand)
-        dataframe.loc[index, 'id'] = int(connection.execute('SELECT LAST_INSERT_ID();').fetchall()[0][0])
-    return dataframe
\ No newline at end of file
+	# Return counts
+	metrics.addRows(rowsOut=len(updateDataframe.index)+(len(deleteDataframe.index) if deleteMissing else 0))
+	return {'inserted': len(insertDataframe.index), 'updated': len(updateDataframe.index), 'deleted': len(deleteDataframe.index) if deleteMissing else 0, 'unchanged': int(((mergedDataframe['_merge'] == 'both') & ~changed).sum())}
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+#################################################################
+#################################################################
+############### Datasets2Tools Deduplication Index ##############
+#################################################################
+#################################################################
+##### Author: Denis Torre
+##### Affiliation: Ma'ayan Laboratory,
+##### Icahn School of Medicine at Mount Sinai
+
+#############################################
+########## 1. Load libraries
+#############################################
+##### 1. Python modules #####
+import hashlib
+import pandas as pd
+
+##### 2. Custom modules #####
+import db
+
+#############################################
+########## 2. General Setup
+#############################################
+##### 1. Variables #####
+# Index of every loaded analysis by fingerprint
+fingerprintTable = 'canned_analysis_fingerprint'
+
+# Fingerprint computed by the database, matching fingerprint() below
+fingerprintSql = "SHA1(CONCAT_WS('|', ca.canned_analysis_url, d.dataset_accession, LCASE(t.tool_name)))"
+
+# Fingerprints per lookup query
+querySize = 1000
+
+#######################################################
+#######################################################
+########## S1. Fingerprints
+#######################################################
+#######################################################
+
+#############################################
+########## 1. Fingerprint
+#############################################
+
+def asciiText(value):
+	return value.encode('ascii', 'ignore') if isinstance(value, unicode) else str(value)
+
+def fingerprint(cannedAnalysisUrl, datasetAccession, toolName):
+
+	# Hash the values as CannedAnalysisTable stores them
+	return hashlib.sha1('|'.join([asciiText(cannedAnalysisUrl), asciiText(datasetAccession), asciiText(toolName).lower()])).hexdigest()
+
+def fingerprints(dataframe):
+	return [fingerprint(x, y, z) for x, y, z in zip(dataframe['canned_analysis_url'], dataframe['dataset_accession'], dataframe['tool_name'])]
+
+#######################################################
+#######################################################
+########## S2. Index
+#######################################################
+#######################################################
+
+#############################################
+########## 1. Create
+#############################################
+
+def ensureIndex(engine):
+	'''
+	Creates the fingerprint index if it does not exist, and brings it in line with
+	canned_analysis: fingerprints of deleted analyses are removed, and analyses loaded
+	without one, before the index existed or by another loader, are added.  Duplicates of
+	an indexed analysis stay out, since their fingerprint is taken, so once in line the
+	checks find nothing.  Runs in its own transaction, since the DDL would commit a load's.
+	'''
+	# Analyses without a fingerprint row whose fingerprint is not indexed either
+	unindexedSql = '''FROM canned_analysis ca
+					  LEFT JOIN dataset d ON d.id = ca.dataset_fk
+					  LEFT JOIN tool t ON t.id = ca.tool_fk
+					  LEFT JOIN {table} f ON f.canned_analysis_fk = ca.id
+					  WHERE f.canned_analysis_fk IS NULL AND NOT EXISTS (SELECT 1 FROM {table} x WHERE x.fingerprint = {fingerprint})'''.format(table=fingerprintTable, fingerprint=fingerprintSql)
+
+	with engine.begin() as connection:
+		connection.execute('CREATE TABLE IF NOT EXISTS {} (fingerprint CHAR(40) NOT NULL PRIMARY KEY, canned_analysis_fk INT NOT NULL, INDEX (canned_analysis_fk)) ENGINE=InnoDB'.format(fingerprintTable))
+
+		# Remove fingerprints of deleted analyses, if there are any
+		if connection.execute('SELECT 1 FROM {} f LEFT JOIN canned_analysis ca ON ca.id = f.canned_analysis_fk WHERE ca.id IS NULL LIMIT 1'.format(fingerprintTable)).fetchone():
+			connection.execute('DELETE f FROM {} f LEFT JOIN canned_analysis ca ON ca.id = f.canned_analysis_fk WHERE ca.id IS NULL'.format(fingerprintTable))
+
+		# Add analyses loaded without one, if there are any
+		if connection.execute('SELECT 1 {} LIMIT 1'.format(unindexedSql)).fetchone():
+			connection.execute('INSERT IGNORE INTO {} (fingerprint, canned_analysis_fk) SELECT {}, ca.id {}'.format(fingerprintTable, fingerprintSql, unindexedSql))
+
+#############################################
+########## 2. Look Up
+#############################################
+
+def existingFingerprints(connection, fingerprintList):
+
+	# Get the fingerprints already in the index, in batches
+	existing = set()
+	fingerprintList = list(fingerprintList)
+	for i in range(0, len(fingerprintList), querySize):
+		batch = fingerprintList[i:i+querySize]
+		existing.update([x for x, in connection.execute('SELECT fingerprint FROM {} WHERE fingerprint IN ({})'.format(fingerprintTable, ', '.join(['%s']*len(batch))), *batch).fetchall()])
+	return existing
+
+def newRows(dataframe, connection):
+	'''
+	Returns a boolean mask of the rows of dataframe whose analyses are not in the index yet,
+	keeping only the first of rows that share a fingerprint, and their fingerprints.
+	'''
+	fingerprintSeries = pd.Series(fingerprints(dataframe), index=dataframe.index)
+	existing = existingFingerprints(connection, fingerprintSeries.unique())
+	return ~fingerprintSeries.isin(existing) & ~fingerprintSeries.duplicated(), fingerprintSeries
+
+#############################################
+########## 3. Add
+#############################################
+
+def addFingerprints(connection, fingerprintList, analysisIds):
+
+	# Index newly inserted analyses, in the transaction that inserted them
+	fingerprintDataframe = pd.DataFrame({'fingerprint': list(fingerprintList), 'canned_analysis_fk': list(analysisIds)}, columns=['fingerprint', 'canned_analysis_fk'])
+	return db.writeDataframe(fingerprintDataframe, fingerprintTable, connection)
+
+#############################################
+########## 4. Drop Loaded Rows
+#############################################
+
+def dropLoaded(dataframe, engine):
+
+	# Leave out the rows of a canned-analysis file that are loaded already, for loaders that do not use the index themselves
+	if not engine.has_table(fingerprintTable):
+		return dataframe
+	with engine.connect() as connection:
+		newMask, fingerprintSeries = newRows(dataframe, connection)
+	return dataframe[newMask]
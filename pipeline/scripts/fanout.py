@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+#################################################################
+#################################################################
+############### Datasets2Tools Load Fan-Out #####################
+#################################################################
+#################################################################
+##### Author: Denis Torre
+##### Affiliation: Ma'ayan Laboratory,
+##### Icahn School of Medicine at Mount Sinai
+
+#############################################
+########## 1. Load libraries
+#############################################
+##### 1. Python modules #####
+import os, json, time, hashlib, traceback, multiprocessing
+
+##### 2. Custom modules #####
+import metrics, manifest
+
+#############################################
+########## 2. General Setup
+#############################################
+##### 1. Variables #####
+# Seconds between checks on the target processes
+pollInterval = 0.05
+
+#######################################################
+#######################################################
+########## S1. Targets
+#######################################################
+#######################################################
+
+#############################################
+########## 1. Load Target
+#############################################
+
+def loadTarget(load, target):
+
+	# Load one target in a phase of its own, returning its status, result or error, and record
+	recordDict = {}
+	try:
+		with metrics.phase('load_target') as recordDict:
+			recordDict['target'] = target
+			result = load(target)
+		return 'loaded', result, recordDict
+	except Exception:
+		return 'failed', traceback.format_exc(), recordDict
+
+def runTarget(load, target, pipe):
+
+	# Load one target in a worker process and send the outcome back
+	try:
+		pipe.send(loadTarget(load, target))
+	finally:
+		pipe.close()
+
+#############################################
+########## 2. Journal
+#############################################
+
+def journalKey(infiles, params=None):
+
+	# Hash what a target was loaded from, so the journal does not outlive a change of inputs
+	return hashlib.sha1(json.dumps({'inputs': manifest.inputHashes(infiles), 'params': params or {}}, sort_keys=True)).hexdigest()
+
+#######################################################
+#######################################################
+########## S2. Fan-Out
+#######################################################
+#######################################################
+
+#############################################
+########## 1. Load Targets
+#############################################
+
+def loadTargets(load, targets, outfile, infiles=None, params=None):
+	'''
+	Calls load(target) for every target at once, each in its own process, so each loads
+	through its own connection pool and transactions and a slow or failing target holds up
+	none of the others.  A single target is loaded in this process.  Loaded targets are
+	journaled next to outfile under a hash of infiles and params, so a rerun after a failure
+	only loads the rest.  Once every target has finished, returns their status, seconds,
+	rows and result, or raises if any failed.
+	'''
+	# Skip targets loaded from the same inputs by an earlier run
+	journalFile = outfile + '.targets'
+	key = journalKey(infiles, params)
+	journaled = [x.split('\t') for x in open(journalFile).read().splitlines()] if os.path.exists(journalFile) else []
+	skipped = set([y for x, y in journaled if x == key])
+	outcomeDict = {x: ('skipped', None, {}) for x in targets if x in skipped}
+	pending = [x for x in targets if x not in skipped]
+
+	# Load a single target here
+	if len(pending) == 1:
+		outcomeDict[pending[0]] = loadTarget(load, pending[0])
+
+	# Start one process per target otherwise, which a daemonic process, like a ruffus job run without --use_threads, cannot do
+	else:
+		if multiprocessing.current_process().daemon:
+			raise RuntimeError('Cannot load {} targets at once from a daemonic process; run ruffus jobs with --use_threads.'.format(len(pending)))
+		workerDict = {}
+		for target in pending:
+			parentPipe, childPipe = multiprocessing.Pipe()
+			process = multiprocessing.Process(target=runTarget, args=(load, target, childPipe))
+			process.start()
+			childPipe.close()
+			workerDict[target] = (process, parentPipe)
+
+		# Collect outcomes as targets finish, journaling each as soon as it has loaded
+		while workerDict:
+			for target, (process, pipe) in workerDict.items():
+				if pipe.poll() or not process.is_alive():
+					try:
+						outcomeDict[target] = pipe.recv()
+					except EOFError:
+						outcomeDict[target] = ('failed', 'Worker exited with code {}.'.format(process.exitcode), {})
+					if outcomeDict[target][0] == 'loaded':
+						with open(journalFile, 'a') as openfile:
+							openfile.write('{}\t{}\n'.format(key, target))
+					print('{} {} in {:.1f} s.'.format('Loaded' if outcomeDict[target][0] == 'loaded' else 'Failed to load', target, outcomeDict[target][2].get('seconds', 0)))
+					process.join()
+					pipe.close()
+					del workerDict[target]
+			time.sleep(pollInterval)
+
+	# Report in target order
+	reportList = []
+	for target in targets:
+		status, result, recordDict = outcomeDict[target]
+		reportList.append({'target': target, 'status': status, 'seconds': recordDict.get('seconds'), 'rows_out': recordDict.get('rows_out', 0), 'error' if status == 'failed' else 'result': result})
+
+	# Add the targets' rows to the task, each reading the same input, and the counts of their processes
+	metrics.addRows(rowsIn=max([x[2].get('rows_in', 0) for x in outcomeDict.values()] or [0]), rowsOut=sum([x['rows_out'] for x in reportList]))
+	if len(pending) > 1:
+		for counter in metrics.counters:
+			metrics.counters[counter] += sum([x[2].get(counter, 0) for x in outcomeDict.values()])
+
+	# Raise once all have finished, keeping the journal for the rerun
+	failedList = [x for x in reportList if x['status'] == 'failed']
+	if failedList:
+		raise RuntimeError('Loading failed on {} of {} targets:\n'.format(len(failedList), len(targets)) + '\n'.join(['{target}: {error}'.format(**x) for x in failedList]))
+	if os.path.exists(journalFile):
+		os.remove(journalFile)
+	return reportList
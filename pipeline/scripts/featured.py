@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+#################################################################
+#################################################################
+############### Datasets2Tools Featured Schedules ###############
+#################################################################
+#################################################################
+##### Author: Denis Torre
+##### Affiliation: Ma'ayan Laboratory,
+##### Icahn School of Medicine at Mount Sinai
+
+#############################################
+########## 1. Load libraries
+#############################################
+##### 1. Python modules #####
+import pandas as pd
+import numpy as np
+from datetime import date, timedelta
+
+#############################################
+########## 2. General Setup
+#############################################
+##### 1. Variables #####
+# Schedules: the table they fill, the query of IDs to feature, the first day and the days
+# between slots.  Tool schedules repeat every tool once per round instead of sampling once.
+schedules = {'featured-analysis': {'table': 'featured_analysis', 'column': 'canned_analysis_fk', 'dayColumn': 'day', 'start': date(2017, 5, 2), 'step': 1, 'rounds': False,
+								   'query': 'SELECT DISTINCT id FROM canned_analysis'},
+			 'featured-dataset': {'table': 'featured_dataset', 'column': 'dataset_fk', 'dayColumn': 'day', 'start': date(2017, 5, 1), 'step': 1, 'rounds': False,
+								  'query': 'SELECT DISTINCT dataset_fk AS id FROM canned_analysis ca LEFT JOIN dataset d ON d.id=ca.dataset_fk WHERE dataset_title IS NOT NULL'},
+			 'featured-tool': {'table': 'featured_tool', 'column': 'tool_fk', 'dayColumn': 'start_day', 'start': date(2017, 5, 1), 'step': 7, 'rounds': True,
+							   'query': 'SELECT DISTINCT tool_fk AS id FROM canned_analysis'}}
+
+#######################################################
+#######################################################
+########## S1. Sampling
+#######################################################
+#######################################################
+
+#############################################
+########## 1. Sample IDs
+#############################################
+
+def sampleIds(engine, query, seed, limit=None, excludeTable=None, excludeColumn=None):
+	'''
+	Returns the IDs of query in an order fixed by seed, computed by the database.  Ordering
+	by a hash of the seed and the ID, rather than by RAND(seed), does not depend on the
+	order rows are read in, so the same seed always gives the same sample.
+	'''
+	# Build query
+	sql = 'SELECT id FROM ({}) ids'.format(query)
+	if excludeTable:
+		sql += ' WHERE id NOT IN (SELECT {} FROM {} WHERE {} IS NOT NULL)'.format(excludeColumn, excludeTable, excludeColumn)
+	sql += " ORDER BY MD5(CONCAT(%s, ':', id))"
+	if limit is not None:
+		sql += ' LIMIT {}'.format(int(limit))
+
+	# Run
+	return pd.read_sql_query(sql, engine, params=[str(seed)])['id'].tolist()
+
+#######################################################
+#######################################################
+########## S2. Schedules
+#######################################################
+#######################################################
+
+#############################################
+########## 1. Existing Schedule
+#############################################
+
+def existingSchedule(engine, schedule):
+
+	# Get the number of slots and the last day already scheduled
+	if not engine.has_table(schedule['table']):
+		return 0, None
+	nSlots, lastDay = engine.execute('SELECT COUNT(*), MAX({}) FROM {}'.format(schedule['dayColumn'], schedule['table'])).fetchone()
+	return nSlots, lastDay
+
+def readSchedule(engine, schedule):
+
+	# Get the rows already scheduled, in order
+	columns = [schedule['column'], schedule['dayColumn']] + (['end_day'] if schedule['rounds'] else [])
+	if not engine.has_table(schedule['table']):
+		return pd.DataFrame(columns=columns)
+	return pd.read_sql_query('SELECT {} FROM {} ORDER BY {}'.format(', '.join(columns), schedule['table'], schedule['dayColumn']), engine)
+
+#############################################
+########## 2. Days
+#############################################
+
+def scheduleDays(firstDay, nSlots, step):
+	return (pd.Timestamp(firstDay) + pd.to_timedelta(np.arange(nSlots)*step, unit='D')).date
+
+#############################################
+########## 3. Make Schedule
+#############################################
+
+def makeSchedule(schemaName, engine, length, seed, existing=False):
+	'''
+	Returns the rows that extend the schedule of schemaName in the database to length slots,
+	or length rounds of every tool for tool schedules, starting the day after its last slot.
+	Analyses and datasets already featured are not sampled again.  Rerunning with the same
+	length and seed once the rows are loaded returns nothing.  With existing, the rows
+	already scheduled come first, so the whole schedule is returned.
+	'''
+	# Get existing schedule
+	schedule = schedules[schemaName]
+	nExisting, lastDay = existingSchedule(engine, schedule)
+
+	# Sample IDs once, leaving out those already scheduled if the table exists yet
+	if not schedule['rounds']:
+		excludeTable = schedule['table'] if engine.has_table(schedule['table']) else None
+		ids = sampleIds(engine, schedule['query'], seed, max(length-nExisting, 0), excludeTable, schedule['column']) if length > nExisting else []
+
+	# Or as successive rounds of every ID, each in its own order, resuming inside the current round
+	else:
+		ids = []
+		nIds = engine.execute('SELECT COUNT(*) FROM ({}) ids'.format(schedule['query'])).scalar()
+		nSlots = max(length*nIds-nExisting, 0)
+		roundIndex, skip = divmod(nExisting, nIds) if nIds else (0, 0)
+		while len(ids) < nSlots:
+			roundIds = sampleIds(engine, schedule['query'], '{}:{}'.format(seed, roundIndex))
+			if not roundIds:
+				break
+			ids += roundIds[skip:]
+			roundIndex, skip = roundIndex+1, 0
+		ids = ids[:nSlots]
+
+	# Get days
+	firstDay = lastDay+timedelta(days=schedule['step']) if lastDay else schedule['start']
+	days = scheduleDays(firstDay, len(ids), schedule['step'])
+
+	# Get dataframe
+	scheduleDataframe = pd.DataFrame({schedule['column']: np.array(ids, dtype=np.int64), schedule['dayColumn']: days}, columns=[schedule['column'], schedule['dayColumn']])
+	if schedule['rounds']:
+		scheduleDataframe['end_day'] = scheduleDays(firstDay+timedelta(days=schedule['step']), len(ids), schedule['step'])
+
+	# Add existing rows
+	if existing:
+		scheduleDataframe = pd.concat([readSchedule(engine, schedule), scheduleDataframe], ignore_index=True)
+	return scheduleDataframe
+
+#############################################
+########## 4. Pending Rows
+#############################################
+
+def pendingRows(schemaName, engine, scheduleDataframe):
+	'''
+	Returns the rows of a whole schedule that fall after the last day the database already
+	has, so loading a schedule again adds nothing and a new database gets all of it.
+	'''
+	# Get last day
+	schedule = schedules[schemaName]
+	nExisting, lastDay = existingSchedule(engine, schedule)
+	if lastDay is None:
+		return scheduleDataframe
+
+	# Keep later rows
+	return scheduleDataframe[pd.to_datetime(scheduleDataframe[schedule['dayColumn']]).dt.date > pd.Timestamp(lastDay).date()]
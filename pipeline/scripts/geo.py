@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+#################################################################
+#################################################################
+############### Datasets2Tools GEO Annotation ###################
+#################################################################
+#################################################################
+##### Author: Denis Torre
+##### Affiliation: Ma'ayan Laboratory,
+##### Icahn School of Medicine at Mount Sinai
+
+#############################################
+########## 1. Load libraries
+#############################################
+##### 1. Python modules #####
+import urllib, urllib2, multiprocessing, time, sqlite3, json, os
+import xml.etree.ElementTree as ET
+from multiprocessing.pool import ThreadPool
+
+##### 2. Custom modules #####
+import metrics
+
+#############################################
+########## 2. General Setup
+#############################################
+##### 1. Variables #####
+# E-utilities
+eutilsUrl = 'https://eutils.ncbi.nlm.nih.gov/entrez/eutils'
+
+# NCBI allows 3 requests per second without an API key, 10 with one
+requestsPerSecond = 3
+
+# Annotation cache, with lifetimes in seconds for found and missing accessions
+cacheFile = os.environ.get('D2T_ANNOTATION_CACHE', 'f4-datasets.dir/geo-annotations.sqlite')
+cacheTtl = 30*24*3600
+negativeCacheTtl = 7*24*3600
+
+##### 2. Errors #####
+class GeoLookupError(RuntimeError):
+
+	# Raised once every batch has run if any failed, with the failed accessions and the summaries that were fetched
+	def __init__(self, failedAccessions, summaryDict):
+		RuntimeError.__init__(self, 'GEO lookup failed for {} accessions: {}'.format(len(failedAccessions), ', '.join(failedAccessions[:10]) + (', ...' if len(failedAccessions) > 10 else '')))
+		self.failedAccessions = failedAccessions
+		self.summaryDict = summaryDict
+
+#######################################################
+#######################################################
+########## S1. Rate Limiting
+#######################################################
+#######################################################
+
+#############################################
+########## 1. Rate Limiter
+#############################################
+
+class RateLimiter:
+
+	def __init__(self, requestsPerSecond):
+		self.interval = 1.0/requestsPerSecond
+		self.nextTime = multiprocessing.Value('d', 0)
+
+	def wait(self):
+
+		# Reserve the next free slot
+		with self.nextTime.get_lock():
+			now = time.time()
+			waitTime = self.nextTime.value - now
+			self.nextTime.value = max(now, self.nextTime.value) + self.interval
+
+		# Sleep until it comes
+		if waitTime > 0:
+			time.sleep(waitTime)
+
+# Shared by every thread, and by every process forked after import
+rateLimiter = RateLimiter(requestsPerSecond)
+
+#######################################################
+#######################################################
+########## S2. Annotation Cache
+#######################################################
+#######################################################
+
+#############################################
+########## 1. Cache
+#############################################
+
+class AnnotationCache:
+	'''
+	SQLite cache of GEO summaries keyed by accession.  Accessions GEO does not know are
+	stored with status 'missing' under their own TTL, so they are never confused with
+	found accessions whose attributes are empty.  Failed lookups are not stored.
+	'''
+	def __init__(self, cacheFile=cacheFile, ttl=cacheTtl, negativeTtl=negativeCacheTtl):
+		self.cacheFile = cacheFile
+		self.ttl = ttl
+		self.negativeTtl = negativeTtl
+		self.stats = {'hits': 0, 'negative_hits': 0, 'misses': 0}
+		self.pid = None
+
+	def connect(self):
+
+		# Open once per process
+		if self.pid != os.getpid():
+			if os.path.dirname(self.cacheFile) and not os.path.exists(os.path.dirname(self.cacheFile)):
+				os.makedirs(os.path.dirname(self.cacheFile))
+			self.connection = sqlite3.connect(self.cacheFile, timeout=60)
+			self.connection.execute('CREATE TABLE IF NOT EXISTS annotation (accession TEXT PRIMARY KEY, status TEXT NOT NULL, attributes TEXT, updated REAL NOT NULL)')
+			self.pid = os.getpid()
+		return self.connection
+
+	def get(self, datasetAccessions):
+
+		# Loop through accessions
+		cachedDict = {}
+		now = time.time()
+		connection = self.connect()
+		for datasetAccession in datasetAccessions:
+			row = connection.execute('SELECT status, attributes, updated FROM annotation WHERE accession = ?', (datasetAccession,)).fetchone()
+			if row and row[0] == 'missing' and now-row[2] < self.negativeTtl:
+				cachedDict[datasetAccession] = None
+				self.stats['negative_hits'] += 1
+			elif row and row[0] == 'found' and now-row[2] < self.ttl:
+				cachedDict[datasetAccession] = json.loads(row[1])
+				self.stats['hits'] += 1
+			else:
+				self.stats['misses'] += 1
+		return cachedDict
+
+	def put(self, summaryDict):
+
+		# Store found and missing accessions
+		connection = self.connect()
+		with connection:
+			connection.executemany('INSERT OR REPLACE INTO annotation VALUES (?, ?, ?, ?)', [(x, 'found' if y is not None else 'missing', json.dumps(y) if y is not None else None, time.time()) for x, y in summaryDict.iteritems()])
+
+#############################################
+########## 2. Default Cache
+#############################################
+
+defaultCache = AnnotationCache()
+
+#######################################################
+#######################################################
+########## S3. E-utilities
+#######################################################
+#######################################################
+
+#############################################
+########## 1. Request
+#############################################
+
+def eutilsRequest(utility, params, baseUrl=None, limiter=None, apiKey=None, retries=3, timeout=60):
+
+	# Add API key
+	if apiKey:
+		params = dict(params, api_key=apiKey)
+
+	# Get URL
+	url = '{}/{}.fcgi'.format(baseUrl or eutilsUrl, utility)
+
+	# Try, backing off on failure
+	for attempt in range(retries):
+		(limiter or rateLimiter).wait()
+		metrics.countHttpCall()
+		try:
+			return ET.fromstring(urllib2.urlopen(url, urllib.urlencode(params), timeout=timeout).read())
+		except Exception:
+			if attempt == retries-1:
+				raise
+			time.sleep(2**attempt)
+
+#############################################
+########## 2. Fetch Summaries
+#############################################
+
+def fetchSummaryBatch(datasetAccessions, **kwargs):
+
+	# Search all accessions at once
+	term = ' OR '.join(['{}[Accession ID]'.format(x) for x in datasetAccessions])
+	geoIds = [x.text for x in eutilsRequest('esearch', {'db': 'gds', 'term': term, 'retmax': 10000}, **kwargs).iter('Id')]
+
+	# Get summaries
+	summaryDict = {x: None for x in datasetAccessions}
+	if geoIds:
+		root = eutilsRequest('esummary', {'db': 'gds', 'id': ','.join(geoIds)}, **kwargs)
+		for docSum in root.findall('DocSum'):
+			items = {x.attrib['Name']: x.text or '' for x in docSum if 'Name' in x.attrib.keys()}
+			if items.get('Accession') in summaryDict:
+				summaryDict[items['Accession']] = items
+	return summaryDict
+
+def fetchSummaries(datasetAccessions, attributes=['title', 'summary'], batchSize=100, workers=3, cache=defaultCache, **kwargs):
+	'''
+	Fetches GEO summaries for many accessions, batching them into multi-term esearch and
+	multi-ID esummary requests run by a pool of workers under the shared rate limiter.
+	Returns a dict mapping accessions to attribute dicts, or to None if GEO does not know them.
+	If any batch fails, the others are still fetched and cached, and GeoLookupError is then
+	raised with the failed accessions, so a failed request is never taken for a missing
+	accession.  Reads through cache unless it is None.
+	'''
+	# Get unique GEO accessions
+	datasetAccessions = sorted(set(x for x in datasetAccessions if x[:3] in ['GDS', 'GSE']))
+
+	# Read cache
+	cachedDict = cache.get(datasetAccessions) if cache else {}
+	datasetAccessions = [x for x in datasetAccessions if x not in cachedDict]
+	batches = [datasetAccessions[i:i+batchSize] for i in range(0, len(datasetAccessions), batchSize)]
+
+	# Fetch batch, keeping failures apart
+	def fetch(batch):
+		try:
+			return fetchSummaryBatch(batch, **kwargs), []
+		except Exception as e:
+			print('GEO lookup of {} accessions ({}...) failed: {!r}'.format(len(batch), batch[0], e))
+			return {}, batch
+
+	# Run
+	summaryDict, failedAccessions = {}, []
+	if batches:
+		pool = ThreadPool(min(workers, len(batches)))
+		try:
+			for result, failed in pool.map(fetch, batches):
+				summaryDict.update(result)
+				failedAccessions += failed
+		finally:
+			pool.close()
+
+	# Write cache
+	if cache and summaryDict:
+		cache.put(summaryDict)
+	summaryDict.update(cachedDict)
+
+	# Select attributes
+	summaryDict = {x: {attribute: y.get(attribute, '') for attribute in attributes} if y is not None else None for x, y in summaryDict.iteritems()}
+	if failedAccessions:
+		raise GeoLookupError(failedAccessions, summaryDict)
+	return summaryDict
+
+#############################################
+########## 3. Landing URL
+#############################################
+
+def landingUrl(datasetAccession):
+	return 'https://www.ncbi.nlm.nih.gov/geo/query/acc.cgi?acc='+datasetAccession
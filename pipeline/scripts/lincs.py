@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+#################################################################
+#################################################################
+############### Datasets2Tools LINCS Datasets ###################
+#################################################################
+#################################################################
+##### Author: Denis Torre
+##### Affiliation: Ma'ayan Laboratory,
+##### Icahn School of Medicine at Mount Sinai
+
+#############################################
+########## 1. Load libraries
+#############################################
+##### 1. Python modules #####
+import os, time, requests
+import pandas as pd
+from multiprocessing.pool import ThreadPool
+
+##### 2. Custom modules #####
+import metrics, staging
+
+#############################################
+########## 2. General Setup
+#############################################
+##### 1. Variables #####
+# LINCS Data Portal API
+lincsUrl = 'http://dev3.ccs.miami.edu:8080/dcic/api'
+
+# Document fields and the dataset columns they fill
+fieldDict = {'datasetid': 'dataset_accession', 'datasetname': 'dataset_title', 'description': 'dataset_description', 'ldplink': 'dataset_landing_url'}
+
+# Repository ID of the LINCS Data Portal
+lincsRepositoryId = 27
+
+#######################################################
+#######################################################
+########## S1. Requests
+#######################################################
+#######################################################
+
+#############################################
+########## 1. Session
+#############################################
+
+def makeSession(workers):
+
+	# Keep one connection open per worker
+	session = requests.Session()
+	adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+	session.mount('http://', adapter)
+	session.mount('https://', adapter)
+	return session
+
+#############################################
+########## 2. Page
+#############################################
+
+def fetchPage(session, skip, limit, searchTerm='*', baseUrl=None, retries=3, timeout=60):
+
+	# Try, backing off on failure
+	for attempt in range(retries):
+		metrics.countHttpCall()
+		try:
+			response = session.post('{}/fetchdata'.format(baseUrl or lincsUrl), params={'searchTerm': searchTerm, 'skip': skip, 'limit': limit}, timeout=timeout)
+			response.raise_for_status()
+			return response.json()['results']
+		except Exception:
+			if attempt == retries-1:
+				raise
+			time.sleep(2**attempt)
+
+#######################################################
+#######################################################
+########## S2. Datasets
+#######################################################
+#######################################################
+
+#############################################
+########## 1. Parse
+#############################################
+
+def parseDocuments(documents):
+
+	# Missing fields are filled with '-', as the portal leaves them out
+	datasetDataframe = pd.DataFrame([[document.get(x, '-') for x in fieldDict.keys()] for document in documents], columns=fieldDict.values())
+	datasetDataframe['repository_fk'] = lincsRepositoryId
+	return datasetDataframe
+
+#############################################
+########## 2. Fetch
+#############################################
+
+def fetchDatasets(outfile, pageSize=300, workers=4, **kwargs):
+	'''
+	Pages through every LINCS dataset, keeping up to workers page requests in flight on one
+	pooled session.  Pages are parsed and appended to the staging file in order as they
+	arrive, so only a window of pages is held in memory.  Stops at the document count the
+	API reports, or at the first short page if it reports none.  Pages go to a temporary
+	file that replaces outfile only once every page is in, so a failed fetch leaves no
+	outfile for ruffus to take as up to date.  Returns the rows written.
+	'''
+	# Set up, keeping the extension the staging format is read from
+	session = makeSession(workers)
+	pool = ThreadPool(workers)
+	tmpFile = '{}.tmp{}'.format(*os.path.splitext(outfile))
+	writer = staging.StageWriter(tmpFile, 'datasets')
+	nDocuments, total, skip, done = 0, None, 0, False
+
+	# Fetch the first page alone to learn the total, then windows of pages
+	try:
+		while not done:
+			skips = [x for x in range(skip, skip+(workers if skip else 1)*pageSize, pageSize) if total is None or x < total]
+			for results in pool.imap(lambda x: fetchPage(session, x, pageSize, **kwargs), skips):
+				documents = results.get('documents', [])
+				total = results.get('totalDocuments', total)
+				if documents:
+					writer.write(parseDocuments(documents))
+					nDocuments += len(documents)
+				if len(documents) < pageSize:
+					done = True
+					break
+			skip = skips[-1]+pageSize if skips else skip
+			done = done or not skips or (total is not None and skip >= total)
+		writer.close()
+
+	# Leave nothing behind on failure
+	except Exception:
+		writer.close()
+		if os.path.exists(tmpFile):
+			os.remove(tmpFile)
+		raise
+	finally:
+		pool.close()
+		session.close()
+
+	# Swap in
+	os.rename(tmpFile, outfile)
+	return nDocuments
@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+#################################################################
+#################################################################
+############### Datasets2Tools Lookup Index #####################
+#################################################################
+#################################################################
+##### Author: Denis Torre
+##### Affiliation: Ma'ayan Laboratory,
+##### Icahn School of Medicine at Mount Sinai
+
+#############################################
+########## 1. Load libraries
+#############################################
+##### 1. Python modules #####
+import os, sqlite3, zlib
+import pandas as pd
+
+#############################################
+########## 2. General Setup
+#############################################
+##### 1. Variables #####
+# Local index file
+indexFile = os.environ.get('D2T_LOOKUP_INDEX', 'f5-analyses.dir/lookup-index.sqlite')
+
+# Lookups: the table, the column each ID is looked up by, and whether it is matched lowercased
+lookups = {'tool': ('tool', 'tool_name', True),
+		   'dataset': ('dataset', 'dataset_accession', False),
+		   'repository': ('repository', 'repository_name', True),
+		   'term': ('term', 'term_name', True)}
+
+# Rows fetched from the server at a time, and names per SQLite query
+fetchSize = 50000
+querySize = 500
+
+#######################################################
+#######################################################
+########## S1. Local Index
+#######################################################
+#######################################################
+
+#############################################
+########## 1. Helpers
+#############################################
+
+def nameExpression(kind, alias=''):
+	tableName, nameColumn, lowercase = lookups[kind]
+	return 'LCASE({}{})'.format(alias, nameColumn) if lowercase else alias+nameColumn
+
+def asText(name):
+	return name.decode('utf-8', 'replace') if isinstance(name, str) else name
+
+def rowChecksum(fk, name):
+	return zlib.crc32('{}:{}'.format(fk, asText(name).encode('utf-8'))) & 0xffffffff
+
+#############################################
+########## 2. Index
+#############################################
+
+class LookupIndex:
+	'''
+	Local SQLite copy of the name to ID lookups of one database, kept per target.  refresh
+	only fetches rows with IDs above the last one seen, then checks the copy against the
+	server's row count, or with validate='checksum' against a CRC32 of every row computed
+	by the server, and rebuilds it if they disagree.
+	'''
+	def __init__(self, engine, indexFile=indexFile, validate='count'):
+		self.engine = engine
+		self.indexFile = indexFile
+		self.validate = validate
+		self.target = '{}/{}'.format(engine.url.host, engine.url.database)
+		self.stats = {'fetched': 0, 'rebuilt': 0}
+		self.pid = None
+
+	def connect(self):
+
+		# Open once per process
+		if self.pid != os.getpid():
+			if os.path.dirname(self.indexFile) and not os.path.exists(os.path.dirname(self.indexFile)):
+				os.makedirs(os.path.dirname(self.indexFile))
+			self.connection = sqlite3.connect(self.indexFile, timeout=60)
+			self.connection.execute('CREATE TABLE IF NOT EXISTS lookup (target TEXT NOT NULL, kind TEXT NOT NULL, fk INTEGER NOT NULL, name TEXT, checksum INTEGER NOT NULL, PRIMARY KEY (target, kind, fk))')
+			self.connection.execute('CREATE INDEX IF NOT EXISTS lookup_name ON lookup (target, kind, name)')
+			self.connection.execute('CREATE TABLE IF NOT EXISTS state (target TEXT NOT NULL, kind TEXT NOT NULL, last_id INTEGER NOT NULL, PRIMARY KEY (target, kind))')
+			self.pid = os.getpid()
+		return self.connection
+
+	#############################################
+	########## 3. Refresh
+	#############################################
+
+	def serverState(self, kind):
+
+		# Get count, last ID and, if validating by checksum, the XOR of row checksums
+		checksum = "BIT_XOR(CRC32(CONCAT(id, ':', COALESCE({}, ''))))".format(nameExpression(kind)) if self.validate == 'checksum' else 'NULL'
+		nRows, lastId, checksum = self.engine.execute('SELECT COUNT(*), MAX(id), {} FROM {}'.format(checksum, lookups[kind][0])).fetchone()
+		return nRows, lastId or 0, checksum
+
+	def localState(self, kind):
+
+		# Get count, last ID and, if validating by checksum, the XOR of row checksums
+		connection = self.connect()
+		nRows, checksum = connection.execute('SELECT COUNT(*), 0 FROM lookup WHERE target = ? AND kind = ?', (self.target, kind)).fetchone()
+		if self.validate == 'checksum':
+			checksum = reduce(lambda x, y: x ^ y[0], connection.execute('SELECT checksum FROM lookup WHERE target = ? AND kind = ?', (self.target, kind)), 0)
+		row = connection.execute('SELECT last_id FROM state WHERE target = ? AND kind = ?', (self.target, kind)).fetchone()
+		return nRows, row[0] if row else None, checksum
+
+	def fetch(self, kind, afterId):
+
+		# Stream rows above afterId into the index
+		connection = self.connect()
+		lastId = afterId
+		with connection:
+			while True:
+				rows = self.engine.execute('SELECT id, {} FROM {} WHERE id > %s ORDER BY id LIMIT {}'.format(nameExpression(kind), lookups[kind][0], fetchSize), lastId).fetchall()
+				connection.executemany('INSERT OR REPLACE INTO lookup VALUES (?, ?, ?, ?, ?)', [(self.target, kind, fk, asText(name), rowChecksum(fk, name or '')) for fk, name in rows])
+				self.stats['fetched'] += len(rows)
+				if rows:
+					lastId = rows[-1][0]
+				if len(rows) < fetchSize:
+					break
+			connection.execute('INSERT OR REPLACE INTO state VALUES (?, ?, ?)', (self.target, kind, lastId))
+
+	def rebuild(self, kind):
+		connection = self.connect()
+		with connection:
+			connection.execute('DELETE FROM lookup WHERE target = ? AND kind = ?', (self.target, kind))
+			connection.execute('DELETE FROM state WHERE target = ? AND kind = ?', (self.target, kind))
+		self.stats['rebuilt'] += 1
+		self.fetch(kind, 0)
+
+	def refresh(self, kind):
+
+		# Fetch new rows, unless the index has never been built or the server has fewer rows than it
+		nServer, lastServerId, serverChecksum = self.serverState(kind)
+		nLocal, lastLocalId, localChecksum = self.localState(kind)
+		if lastLocalId is None or lastServerId < lastLocalId or nServer < nLocal:
+			return self.rebuild(kind)
+		if lastServerId > lastLocalId:
+			self.fetch(kind, lastLocalId)
+			nLocal, lastLocalId, localChecksum = self.localState(kind)
+
+		# Rebuild if rows were deleted, inserted below the last ID or renamed
+		if nLocal != nServer or (self.validate == 'checksum' and localChecksum != (serverChecksum or 0)):
+			self.rebuild(kind)
+
+	#############################################
+	########## 4. Look Up
+	#############################################
+
+	def frame(self, kind, fkColumn, nameColumn):
+
+		# Get the whole lookup, for small tables
+		rows = self.connect().execute('SELECT fk, name FROM lookup WHERE target = ? AND kind = ? ORDER BY fk', (self.target, kind)).fetchall()
+		return pd.DataFrame(rows, columns=[fkColumn, nameColumn])
+
+	def resolve(self, kind, names):
+
+		# Get the lowest ID of each name
+		resolvedDict = {}
+		names = list(names)
+		connection = self.connect()
+		for i in range(0, len(names), querySize):
+			batch = [asText(x) for x in names[i:i+querySize]]
+			query = 'SELECT name, MIN(fk) FROM lookup WHERE target = ? AND kind = ? AND name IN ({}) GROUP BY name'.format(', '.join(['?']*len(batch)))
+			resolvedDict.update(connection.execute(query, [self.target, kind]+batch).fetchall())
+		return resolvedDict
+
+#######################################################
+#######################################################
+########## S2. Server-side Lookup
+#######################################################
+#######################################################
+
+#############################################
+########## 1. Temporary Table Join
+#############################################
+
+def resolveOnServer(connection, kind, names, batchSize=1000):
+	'''
+	Resolves names by loading them into a temporary table and joining it to the lookup table
+	on the server, so only the matches are transferred.  Run on the loading connection, it
+	also sees rows inserted by its open transaction.
+	'''
+	# Load names
+	names = list(names)
+	connection.execute('CREATE TEMPORARY TABLE lookup_names (name VARCHAR(255) NOT NULL PRIMARY KEY)')
+	try:
+		for i in range(0, len(names), batchSize):
+			connection.execute('INSERT IGNORE INTO lookup_names VALUES ' + ', '.join(['(%s)']*len(names[i:i+batchSize])), *names[i:i+batchSize])
+
+		# Join
+		return dict(connection.execute('SELECT n.name, MIN(t.id) FROM lookup_names n JOIN {} t ON {} = n.name GROUP BY n.name'.format(lookups[kind][0], nameExpression(kind, 't.'))).fetchall())
+	finally:
+		connection.execute('DROP TEMPORARY TABLE lookup_names')
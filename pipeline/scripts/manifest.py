@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+#################################################################
+#################################################################
+############### Datasets2Tools Checksum Manifest ################
+#################################################################
+#################################################################
+##### Author: Denis Torre
+##### Affiliation: Ma'ayan Laboratory,
+##### Icahn School of Medicine at Mount Sinai
+
+#############################################
+########## 1. Load libraries
+#############################################
+##### 1. Python modules #####
+import os, json, time, types, hashlib, fcntl, functools
+from contextlib import contextmanager
+
+##### 2. Custom modules #####
+import metrics
+
+#############################################
+########## 2. General Setup
+#############################################
+##### 1. Variables #####
+manifestFile = os.environ.get('D2T_MANIFEST_FILE', 'pipeline-manifest.json')
+
+#######################################################
+#######################################################
+########## S1. Hashing
+#######################################################
+#######################################################
+
+#############################################
+########## 1. Files
+#############################################
+
+def fileHash(filename, blockSize=1<<20):
+
+	# Hash in blocks
+	sha = hashlib.sha1()
+	with open(filename, 'rb') as openfile:
+		for block in iter(lambda: openfile.read(blockSize), b''):
+			sha.update(block)
+	return sha.hexdigest()
+
+def inputHashes(infiles):
+
+	# Flatten ruffus inputs, skipping anything that is not a file
+	if isinstance(infiles, basestring):
+		return {infiles: fileHash(infiles)} if os.path.isfile(infiles) else {}
+	elif isinstance(infiles, (list, tuple)):
+		return {x: y for infile in infiles for x, y in inputHashes(infile).iteritems()}
+	return {}
+
+#############################################
+########## 2. Code
+#############################################
+
+def codeHash(code):
+
+	# Hash bytecode with its names and constants, recursing into nested functions, which co_code alone leaves out
+	sha = hashlib.sha1(code.co_code)
+	sha.update(repr(code.co_names))
+	for const in code.co_consts:
+		sha.update(codeHash(const) if isinstance(const, types.CodeType) else repr(const))
+	return sha.hexdigest()
+
+#############################################
+########## 3. Target State
+#############################################
+
+def targetState(connectionFile, hostLabels, database, tableNames):
+
+	# Count the rows of the tables a task loads on each target, so an emptied or recreated database is loaded again
+	import db
+	stateDict = {}
+	for hostLabel in hostLabels:
+		engine = db.connect(connectionFile, hostLabel, database)
+		try:
+			stateDict[hostLabel] = {x: engine.execute('SELECT COUNT(*) FROM `{}`'.format(x)).scalar() if engine.has_table(x) else None for x in tableNames}
+		except Exception:
+			stateDict[hostLabel] = None
+	return stateDict
+
+#############################################
+########## 4. Fingerprint
+#############################################
+
+def fingerprint(entryDict):
+	return hashlib.sha1(json.dumps({x: entryDict[x] for x in ['inputs', 'params', 'target', 'code']}, sort_keys=True)).hexdigest()
+
+#######################################################
+#######################################################
+########## S2. Manifest
+#######################################################
+#######################################################
+
+#############################################
+########## 1. Read and Write
+#############################################
+
+@contextmanager
+def lockedManifest():
+
+	# Hold an exclusive lock while reading and rewriting, since ruffus jobs run in parallel
+	with open(manifestFile + '.lock', 'w') as lockfile:
+		fcntl.flock(lockfile, fcntl.LOCK_EX)
+		manifestDict = json.load(open(manifestFile)) if os.path.exists(manifestFile) else {}
+		yield manifestDict
+		with open(manifestFile + '.tmp', 'w') as openfile:
+			json.dump(manifestDict, openfile, indent=4, sort_keys=True)
+		os.rename(manifestFile + '.tmp', manifestFile)
+
+#############################################
+########## 2. Task Decorator
+#############################################
+
+def checksum(connectionFile=None, hostLabel='phpmyadmin', database=None, params=None, tables=None):
+	'''
+	Skips a ruffus task when the hashes of its inputs, its parameters (a function returning a
+	JSON-serializable dict), its code and its target databases all match the manifest entry
+	of its last successful run, its output exists, and the row counts of tables (a list, or a
+	function of outfile) on every target are still those the run left.  hostLabel may be a
+	list of targets.  The entry is removed before the task runs and written back, with the
+	rows it loaded and the row counts, only once it succeeds.
+	'''
+	def decorator(function):
+		@functools.wraps(function)
+		def wrapper(infiles, outfile, *args, **kwargs):
+
+			# Get entry, importing db only once a task runs
+			import db
+			hostLabels = hostLabel if isinstance(hostLabel, (list, tuple)) else [hostLabel]
+			tableNames = (tables(outfile) if callable(tables) else tables) or []
+			entryDict = {'inputs': inputHashes(infiles),
+						 'params': params() if params else {},
+						 'target': ['{}/{}'.format(db.connect(connectionFile, x, returnData=True)[0], database) for x in hostLabels] if connectionFile else None,
+						 'code': codeHash(function.__code__)}
+			entryDict['fingerprint'] = fingerprint(entryDict)
+			key = '{}:{}'.format(function.__name__, outfile)
+			getState = lambda: targetState(connectionFile, hostLabels, database, tableNames) if connectionFile and tableNames else {}
+
+			# Skip if unchanged, refreshing the output so ruffus sees it as up to date
+			with lockedManifest() as manifestDict:
+				if manifestDict.get(key, {}).get('fingerprint') == entryDict['fingerprint'] and os.path.exists(outfile) and manifestDict[key].get('state') == getState():
+					print('{} is unchanged since {}, skipping.'.format(key, time.ctime(manifestDict[key]['completed'])))
+					os.utime(outfile, None)
+					return
+				manifestDict.pop(key, None)
+
+			# Run
+			result = function(infiles, outfile, *args, **kwargs)
+
+			# Record
+			recordDict = metrics.recordStack[0][0] if metrics.recordStack else {}
+			entryDict.update({'completed': time.time(), 'rows_in': recordDict.get('rows_in'), 'rows_loaded': recordDict.get('rows_out'), 'state': getState()})
+			with lockedManifest() as manifestDict:
+				manifestDict[key] = entryDict
+			return result
+		return wrapper
+	return decorator
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+#################################################################
+#################################################################
+############### Datasets2Tools Pipeline Metrics #################
+#################################################################
+#################################################################
+##### Author: Denis Torre
+##### Affiliation: Ma'ayan Laboratory,
+##### Icahn School of Medicine at Mount Sinai
+
+#############################################
+########## 1. Load libraries
+#############################################
+##### 1. Python modules #####
+import os, sys, json, time, resource, functools
+from contextlib import contextmanager
+
+#############################################
+########## 2. General Setup
+#############################################
+##### 1. Variables #####
+# JSON lines file the records are appended to
+metricsFile = os.environ.get('D2T_METRICS_FILE', 'pipeline-metrics.jsonl')
+
+# Process-wide counters
+counters = {'sql_statements': 0, 'http_calls': 0}
+
+# Records of the running task and phases with their starting counters, innermost last
+recordStack = []
+
+##### 2. Statement counter #####
+# Registered on every SQLAlchemy engine by db, so importing metrics does not load SQLAlchemy
+def countStatement(conn, cursor, statement, parameters, context, executemany):
+	counters['sql_statements'] += 1
+
+#######################################################
+#######################################################
+########## S1. Counting
+#######################################################
+#######################################################
+
+#############################################
+########## 1. Counters
+#############################################
+
+def countHttpCall(n=1):
+	counters['http_calls'] += n
+
+def addRows(rowsIn=0, rowsOut=0):
+
+	# Add to the innermost record
+	if recordStack:
+		recordStack[-1][0]['rows_in'] += rowsIn
+		recordStack[-1][0]['rows_out'] += rowsOut
+
+#############################################
+########## 2. Connection Pools
+#############################################
+
+def poolStatistics():
+
+	# Get the pool status of every engine, if a task has imported db
+	return sys.modules['db'].poolStatistics() if 'db' in sys.modules else []
+
+#############################################
+########## 3. Bytes Read
+#############################################
+
+def bytesRead(infiles):
+
+	# Sum the sizes of input files
+	if isinstance(infiles, basestring):
+		return os.path.getsize(infiles) if os.path.isfile(infiles) else 0
+	elif isinstance(infiles, (list, tuple)):
+		return sum([bytesRead(x) for x in infiles])
+	return 0
+
+#######################################################
+#######################################################
+########## S2. Records
+#######################################################
+#######################################################
+
+#############################################
+########## 1. Record
+#############################################
+
+@contextmanager
+def record(task, phase=None, infiles=None):
+	'''
+	Times a task or a phase of one and appends a JSON line to metricsFile with its wall time,
+	rows in and out, bytes read from infiles, SQL statements and HTTP calls issued, and the
+	peak resident memory of the process so far.  Task records also get the status of every
+	connection pool, with the most connections each has had checked out at once.
+	'''
+	# Start record
+	recordDict = {'task': task, 'phase': phase, 'pid': os.getpid(), 'start': time.time(), 'rows_in': 0, 'rows_out': 0, 'bytes_read': bytesRead(infiles)}
+	startCounters = counters.copy()
+	recordStack.append((recordDict, startCounters))
+
+	# Run, recording failures too
+	try:
+		yield recordDict
+		recordDict['status'] = 'ok'
+	except Exception as e:
+		recordDict['status'] = 'failed: ' + repr(e)
+		raise
+	finally:
+		recordStack.pop()
+		recordDict['seconds'] = round(time.time()-recordDict['start'], 3)
+		recordDict['max_rss_mb'] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024., 1)
+		recordDict.update({x: counters[x]-startCounters[x] for x in counters})
+		if phase is None:
+			recordDict['pools'] = poolStatistics()
+		with open(metricsFile, 'a') as openfile:
+			openfile.write(json.dumps(recordDict) + '\n')
+
+@contextmanager
+def phase(phaseName):
+
+	# Nest under the running task
+	with record(recordStack[0][0]['task'] if recordStack else None, phaseName) as recordDict:
+		yield recordDict
+
+#############################################
+########## 2. Task Decorator
+#############################################
+
+def instrument(function):
+
+	# Record every call of a ruffus task, taking its input files from the first argument
+	@functools.wraps(function)
+	def wrapper(*args, **kwargs):
+		with record(function.__name__, infiles=args[0] if args else None):
+			return function(*args, **kwargs)
+	return wrapper
+
+#############################################
+########## 3. Sentinel
+#############################################
+
+def writeSentinel(outfile, **fields):
+
+	# Summarize the running task so far in place of an empty touch file, with any extra fields
+	summaryDict = {}
+	if recordStack:
+		recordDict, startCounters = recordStack[0]
+		summaryDict = dict(recordDict, seconds=round(time.time()-recordDict['start'], 3), pools=poolStatistics(), **{x: counters[x]-startCounters[x] for x in counters})
+	summaryDict.update(fields)
+	with open(outfile, 'w') as openfile:
+		openfile.write(json.dumps(summaryDict) + '\n')
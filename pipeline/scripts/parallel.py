@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+#################################################################
+#################################################################
+############### Datasets2Tools Parallel Analysis Loader #########
+#################################################################
+#################################################################
+##### Author: Denis Torre
+##### Affiliation: Ma'ayan Laboratory,
+##### Icahn School of Medicine at Mount Sinai
+
+#############################################
+########## 1. Load libraries
+#############################################
+##### 1. Python modules #####
+import os, json, itertools, traceback, multiprocessing
+import pandas as pd
+
+##### 2. Custom modules #####
+import db, metrics, manifest
+from CannedAnalysisTable import CannedAnalysisTable
+from dedup import fingerprints
+
+#######################################################
+#######################################################
+########## S1. Input
+#######################################################
+#######################################################
+
+#############################################
+########## 1. Chunks
+#############################################
+
+def readChunks(infiles, chunkSize):
+
+	# Yield each chunk with a key that changes if its file does
+	for infile in infiles:
+		fileHash = manifest.fileHash(infile)
+		for chunkIndex, chunkDataframe in enumerate(pd.read_table(infile, chunksize=chunkSize)):
+			yield '{}:{}:{}'.format(infile, fileHash, chunkIndex), chunkDataframe.dropna()
+
+def readMetadata(chunkDataframe):
+	return json.loads('[' + ','.join(chunkDataframe['metadata']) + ']')
+
+#############################################
+########## 2. Missing Datasets and Terms
+#############################################
+
+def addMissingKeys(infiles, engine, chunkSize, lookupMode, verbose, dedup=True):
+	'''
+	Inserts and commits every dataset and metadata term of infiles that is not in the database
+	yet, once, before any worker starts, so workers never insert the same one twice.  Uses the
+	same CannedAnalysisTable checks the workers run, which then find nothing missing.  With
+	dedup, it also brings the fingerprint index up to date before the workers consult it.
+	'''
+	# Collect accessions and terms, encoded as CannedAnalysisTable encodes them
+	datasetAccessions, termNames = set(), set()
+	for chunkKey, chunkDataframe in readChunks(infiles, chunkSize):
+		datasetAccessions.update(chunkDataframe['dataset_accession'])
+		termNames.update([x.encode('ascii', 'ignore') for metadataDict in readMetadata(chunkDataframe) for x in metadataDict])
+
+	# Add missing datasets
+	keyDataframe = pd.DataFrame({'dataset_accession': sorted(datasetAccessions), 'tool_name': '', 'canned_analysis_url': '', 'metadata': '{}'}, columns=['dataset_accession', 'tool_name', 'canned_analysis_url', 'metadata'])
+	table = CannedAnalysisTable(keyDataframe, engine, verbose=verbose, lookup_mode=lookupMode, dedup=dedup)
+	table.fetch_tables()
+	table.check_datasets()
+
+	# Add missing terms
+	table.metadata_df = pd.DataFrame({'term_name': sorted(termNames)}, columns=['term_name'])
+	table.metadata_df.insert(0, 'term_fk', table.map_values(table.metadata_df['term_name'], table.term_df.drop_duplicates('term_name').set_index('term_name')['term_fk'], key=table.term_key))
+	table.check_terms()
+
+	# Commit
+	table.transaction.commit()
+	table.connection.close()
+	return len(table.new_dataset_df.index), len(table.new_term_df.index)
+
+#######################################################
+#######################################################
+########## S2. Workers
+#######################################################
+#######################################################
+
+#############################################
+########## 1. Load Chunk
+#############################################
+
+def loadChunk(chunkDataframe, connectionArgs, lookupMode, idBlocks, pipe, compact=False, dedup=True):
+
+	# Load in an open transaction, then wait for the coordinator's decision.  The coordinator
+	# brought the fingerprint index up to date, which workers of a wave doing at once would deadlock on.
+	try:
+		engine = db.connect(*connectionArgs)
+		table = CannedAnalysisTable(chunkDataframe, engine, verbose=0, lookup_mode=lookupMode, id_blocks=idBlocks, compact=compact, report_memory=compact, dedup=dedup, ensure_index=False)
+		table.load_data()
+		if len(table.new_dataset_df.index) or len(table.new_term_df.index):
+			raise RuntimeError('Chunk needed datasets or terms the coordinator did not add.')
+		table.write_metadata()
+		pipe.send(('ready', {'analyses': len(table.analysis_df.index), 'metadata': len(table.metadata_df.index), 'skipped': table.skipped_count}))
+		commit = pipe.recv()
+		table.commit_transaction([], commit=commit)
+		pipe.send(('committed' if commit else 'rolled back', None))
+	except Exception:
+		pipe.send(('failed', traceback.format_exc()))
+	finally:
+		pipe.close()
+
+#######################################################
+#######################################################
+########## S3. Coordinator
+#######################################################
+#######################################################
+
+#############################################
+########## 1. Wave
+#############################################
+
+def runWave(wave, engine, connectionArgs, lookupMode, compact=False, dedup=True):
+	'''
+	Loads a wave of chunks in one worker process each, under ID blocks reserved for the wave,
+	and commits all of them once every worker is ready, or rolls all of them back.  Returns
+	each chunk's key, status ('committed', 'rolled back' or 'failed') and counts or error.
+	'''
+	# Reserve IDs for the wave and split them between chunks
+	nAnalyses = [len(chunkDataframe.index) for chunkKey, chunkDataframe in wave]
+	nMetadata = [sum([len(x) for x in readMetadata(chunkDataframe)]) for chunkKey, chunkDataframe in wave]
+	firstAnalysisId = db.reserveIds(engine, 'canned_analysis', sum(nAnalyses))
+	firstMetadataId = db.reserveIds(engine, 'canned_analysis_metadata', sum(nMetadata))
+
+	# Start workers
+	workerList = []
+	for i, (chunkKey, chunkDataframe) in enumerate(wave):
+		idBlocks = {'canned_analysis': firstAnalysisId+sum(nAnalyses[:i]), 'canned_analysis_metadata': firstMetadataId+sum(nMetadata[:i])}
+		parentPipe, childPipe = multiprocessing.Pipe()
+		process = multiprocessing.Process(target=loadChunk, args=(chunkDataframe, connectionArgs, lookupMode, idBlocks, childPipe, compact, dedup))
+		process.start()
+		childPipe.close()
+		workerList.append((chunkKey, process, parentPipe))
+
+	# Wait for every worker
+	statusList = []
+	for chunkKey, process, pipe in workerList:
+		try:
+			statusList.append(pipe.recv())
+		except EOFError:
+			statusList.append(('failed', 'Worker exited with code {}.'.format(process.exitcode)))
+
+	# Decide, then collect outcomes, keeping the counts of ready workers
+	commit = all([status == 'ready' for status, result in statusList])
+	outcomeList = []
+	for (chunkKey, process, pipe), (status, result) in zip(workerList, statusList):
+		if status == 'ready':
+			pipe.send(commit)
+			try:
+				status, detail = pipe.recv()
+			except EOFError:
+				status, detail = 'failed', 'Worker exited with code {}.'.format(process.exitcode)
+			result = detail if status == 'failed' else result
+		outcomeList.append((chunkKey, status, result))
+		process.join()
+		pipe.close()
+	return outcomeList
+
+#############################################
+########## 2. Load Files
+#############################################
+
+def loadFiles(infiles, outfile, connectionFile, hostLabel, database, workers=4, chunkSize=5000, lookupMode='index', compact=False, dedup=True, verbose=1):
+	'''
+	Loads canned-analysis files in parallel, one chunk per worker process, in waves of workers
+	chunks.  Missing datasets and terms are added once up front.  Each wave is committed by
+	the coordinator only when all of its chunks are ready, and committed chunks are journaled
+	next to outfile, so a rerun after a failed wave skips them.  With compact, workers hold their
+	frames in CannedAnalysisTable's compact representation and record its memory per phase.
+	With dedup, analyses already in the fingerprint index, or in an earlier chunk of infiles,
+	are skipped and counted, so no two workers insert the same fingerprint.  Writes and returns
+	a report.
+	'''
+	# Set up
+	connectionArgs = (connectionFile, hostLabel, database)
+	engine = db.connect(*connectionArgs)
+	journalFile = outfile + '.chunks'
+	committedChunks = set(open(journalFile).read().splitlines()) if os.path.exists(journalFile) else set()
+	reportDict = {'datasets_added': 0, 'terms_added': 0, 'chunks': 0, 'chunks_skipped': 0, 'analyses': 0, 'analyses_skipped': 0, 'metadata': 0, 'waves': 0}
+
+	# Add missing datasets and terms
+	if infiles:
+		with metrics.phase('add_missing_keys'):
+			reportDict['datasets_added'], reportDict['terms_added'] = addMissingKeys(infiles, engine, chunkSize, lookupMode, verbose, dedup)
+
+	# Get chunks not committed by an earlier run.  With dedup, analyses an earlier chunk already has
+	# are left out, since two workers of a wave inserting one fingerprint would wait on each other.
+	seenFingerprints = set()
+	def pendingChunks():
+		for chunkKey, chunkDataframe in readChunks(infiles, chunkSize):
+			if dedup:
+				fingerprintSeries = pd.Series(fingerprints(chunkDataframe), index=chunkDataframe.index)
+				repeated = fingerprintSeries.isin(seenFingerprints)
+				seenFingerprints.update(fingerprintSeries)
+			if chunkKey in committedChunks:
+				reportDict['chunks_skipped'] += 1
+			elif dedup and repeated.any():
+				reportDict['analyses_skipped'] += int(repeated.sum())
+				if not repeated.all():
+					yield chunkKey, chunkDataframe[~repeated]
+			else:
+				yield chunkKey, chunkDataframe
+	chunks = pendingChunks()
+
+	# Load waves
+	for wave in iter(lambda: list(itertools.islice(chunks, workers)), []):
+		with metrics.phase('load_wave'):
+			outcomeList = runWave(wave, engine, connectionArgs, lookupMode, compact, dedup)
+
+		# Journal committed chunks
+		committedList = [(x, z) for x, y, z in outcomeList if y == 'committed']
+		with open(journalFile, 'a') as openfile:
+			openfile.write(''.join([x + '\n' for x, z in committedList]))
+		for chunkKey, countDict in committedList:
+			reportDict['chunks'] += 1
+			reportDict['analyses'] += countDict['analyses']
+			reportDict['metadata'] += countDict['metadata']
+			reportDict['analyses_skipped'] += countDict['skipped']
+		metrics.addRows(rowsIn=sum([len(y.index) for x, y in wave]), rowsOut=sum([z['analyses']+z['metadata'] for x, z in committedList]))
+
+		# Stop at a failed wave
+		if len(committedList) < len(wave):
+			raise RuntimeError('Wave of {} chunks not fully committed:\n'.format(len(wave)) + '\n'.join(['{} {}: {}'.format(x, y, z) for x, y, z in outcomeList if y != 'committed']))
+		reportDict['waves'] += 1
+		if verbose == 1:
+			print('Committed wave {} ({} analyses so far, {} skipped).'.format(reportDict['waves'], reportDict['analyses'], reportDict['analyses_skipped']))
+
+	# Write report
+	with open(outfile, 'w') as openfile:
+		json.dump(reportDict, openfile, indent=4)
+	if os.path.exists(journalFile):
+		os.remove(journalFile)
+	return reportDict
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+#################################################################
+#################################################################
+############### Datasets2Tools Serving Table ####################
+#################################################################
+#################################################################
+##### Author: Denis Torre
+##### Affiliation: Ma'ayan Laboratory,
+##### Icahn School of Medicine at Mount Sinai
+
+#############################################
+########## 1. General Setup
+#############################################
+##### 1. Variables #####
+# Serving table, read by the web app instead of joining the normalized tables
+tableName = 'canned_analysis_search'
+
+# Version of the definition below, stored as the table comment.  Changing the definition
+# without raising it would copy rows of the old layout into the new one.
+tableVersion = 'canned_analysis_search v1'
+
+# Share of rows changed or deleted above which the table is rebuilt and swapped in, rather
+# than updated in place
+rebuildFraction = 0.2
+
+# One row per canned analysis
+tableColumns = '''canned_analysis_fk INT NOT NULL PRIMARY KEY,
+				  canned_analysis_url VARCHAR(767),
+				  canned_analysis_title TEXT,
+				  canned_analysis_description TEXT,
+				  canned_analysis_preview_url TEXT,
+				  dataset_fk INT,
+				  dataset_accession VARCHAR(255),
+				  dataset_title TEXT,
+				  dataset_landing_url TEXT,
+				  repository_fk INT,
+				  repository_name VARCHAR(255),
+				  tool_fk INT,
+				  tool_name VARCHAR(255),
+				  tool_icon_url TEXT,
+				  metadata MEDIUMTEXT,
+				  source_hash CHAR(32) NOT NULL,
+				  INDEX (dataset_accession),
+				  INDEX (dataset_fk),
+				  INDEX (tool_fk),
+				  INDEX (repository_fk)'''
+
+# Full-text index, added once the rows are in
+fullTextColumns = ['canned_analysis_title', 'canned_analysis_description', 'dataset_accession', 'dataset_title', 'tool_name', 'repository_name', 'metadata']
+
+# Columns filled from the normalized tables, in table order
+rowColumns = ['canned_analysis_fk', 'canned_analysis_url', 'canned_analysis_title', 'canned_analysis_description', 'canned_analysis_preview_url', 'dataset_fk', 'dataset_accession', 'dataset_title', 'dataset_landing_url', 'repository_fk', 'repository_name', 'tool_fk', 'tool_name', 'tool_icon_url', 'metadata', 'source_hash']
+
+# Hash of everything a row is built from, with NULLs told apart from empty text.  Metadata enters
+# as the MD5 of its rows' sorted MD5s, which does not depend on their order and is much cheaper
+# to compute than the flattened text.
+hashQuery = '''SELECT ca.id AS canned_analysis_fk,
+					  MD5(CONCAT_WS('|', COALESCE(ca.canned_analysis_url, '\\0'), COALESCE(ca.canned_analysis_title, '\\0'), COALESCE(ca.canned_analysis_description, '\\0'), COALESCE(ca.canned_analysis_preview_url, '\\0'),
+									COALESCE(d.id, '\\0'), COALESCE(d.dataset_accession, '\\0'), COALESCE(d.dataset_title, '\\0'), COALESCE(d.dataset_landing_url, '\\0'), COALESCE(r.id, '\\0'), COALESCE(r.repository_name, '\\0'),
+									COALESCE(t.id, '\\0'), COALESCE(t.tool_name, '\\0'), COALESCE(t.tool_icon_url, '\\0'), COALESCE(m.checksum, '\\0'))) AS source_hash
+			   FROM canned_analysis ca
+			   LEFT JOIN dataset d ON d.id = ca.dataset_fk
+			   LEFT JOIN repository r ON r.id = d.repository_fk
+			   LEFT JOIN tool t ON t.id = ca.tool_fk
+			   LEFT JOIN (SELECT canned_analysis_fk, MD5(GROUP_CONCAT(row_hash ORDER BY row_hash SEPARATOR '')) AS checksum
+						  FROM (SELECT cam.canned_analysis_fk, MD5(CONCAT_WS('|', COALESCE(te.term_name, '\\0'), COALESCE(cam.value, '\\0'))) AS row_hash
+								FROM canned_analysis_metadata cam LEFT JOIN term te ON te.id = cam.term_fk) cam
+						  GROUP BY canned_analysis_fk) m ON m.canned_analysis_fk = ca.id'''
+
+# Rows of the analyses marked as changed in the hash table, with metadata flattened to "term: value" lines
+rowQuery = '''SELECT ca.id, ca.canned_analysis_url, ca.canned_analysis_title, ca.canned_analysis_description, ca.canned_analysis_preview_url,
+					 d.id, d.dataset_accession, d.dataset_title, d.dataset_landing_url, r.id, r.repository_name, t.id, t.tool_name, t.tool_icon_url,
+					 m.metadata, h.source_hash
+			  FROM {hashTable} h
+			  JOIN canned_analysis ca ON ca.id = h.canned_analysis_fk
+			  LEFT JOIN dataset d ON d.id = ca.dataset_fk
+			  LEFT JOIN repository r ON r.id = d.repository_fk
+			  LEFT JOIN tool t ON t.id = ca.tool_fk
+			  LEFT JOIN (SELECT cam.canned_analysis_fk, GROUP_CONCAT(CONCAT(COALESCE(te.term_name, ''), ': ', COALESCE(cam.value, '')) ORDER BY te.term_name, cam.id SEPARATOR '\\n') AS metadata
+						 FROM canned_analysis_metadata cam LEFT JOIN term te ON te.id = cam.term_fk
+						 WHERE cam.canned_analysis_fk IN (SELECT canned_analysis_fk FROM {hashTable} WHERE changed = 1)
+						 GROUP BY cam.canned_analysis_fk) m ON m.canned_analysis_fk = ca.id
+			  WHERE h.changed = 1'''
+
+#######################################################
+#######################################################
+########## S1. Build
+#######################################################
+#######################################################
+
+#############################################
+########## 1. Live Table
+#############################################
+
+def liveVersion(connection, tableName=tableName):
+
+	# Get the comment of the live table, or None if there is none
+	row = connection.execute('SELECT TABLE_COMMENT FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s', tableName).fetchone()
+	return row[0] if row else None
+
+#############################################
+########## 2. Build Table
+#############################################
+
+def buildTable(engine, tableName=tableName, force=False, rebuildFraction=rebuildFraction):
+	'''
+	Brings the denormalized serving table up to date with the normalized tables.  A hash of
+	each analysis' sources is compared with the one stored in its row, and only new or
+	changed analyses are joined and flattened again.  While at most rebuildFraction of the
+	rows changed or were deleted, those rows are replaced and deleted in place in one
+	transaction.  Otherwise, or when forced or the layout is outdated, unchanged rows are
+	copied from the live table into a new one, which is indexed and then swapped in with a
+	single RENAME TABLE.  Either way readers see the old rows or all of the new ones.
+	Returns counts of unchanged, changed and deleted rows, and whether the table was
+	updated or swapped.
+	'''
+	# Name work tables
+	newTable, oldTable, hashTable = tableName+'_new', tableName+'_old', tableName+'_hashes'
+	reportDict = {'unchanged': 0, 'changed': 0, 'deleted': 0, 'updated': False, 'swapped': False}
+
+	# Work on one connection, so the session settings apply throughout
+	with engine.connect() as connection:
+		connection.execute('SET SESSION group_concat_max_len = 16777216')
+		for x in [newTable, oldTable, hashTable]:
+			connection.execute('DROP TABLE IF EXISTS `{}`'.format(x))
+
+		# Compare source hashes with the live table, unless its layout is outdated
+		try:
+			reuse = not force and liveVersion(connection, tableName) == tableVersion
+			connection.execute('CREATE TABLE `{}` (canned_analysis_fk INT NOT NULL PRIMARY KEY, source_hash CHAR(32) NOT NULL, changed TINYINT NOT NULL) ENGINE=InnoDB'.format(hashTable))
+			if reuse:
+				connection.execute('INSERT INTO `{}` SELECT h.canned_analysis_fk, h.source_hash, s.source_hash IS NULL OR s.source_hash != h.source_hash FROM ({}) h LEFT JOIN `{}` s ON s.canned_analysis_fk = h.canned_analysis_fk'.format(hashTable, hashQuery, tableName))
+			else:
+				connection.execute('INSERT INTO `{}` SELECT canned_analysis_fk, source_hash, 1 FROM ({}) h'.format(hashTable, hashQuery))
+
+			# Count changes
+			nRows, nChanged = connection.execute('SELECT COUNT(*), COALESCE(SUM(changed), 0) FROM `{}`'.format(hashTable)).fetchone()
+			nDeleted = connection.execute('SELECT COUNT(*) FROM `{}` s LEFT JOIN `{}` h ON h.canned_analysis_fk = s.canned_analysis_fk WHERE h.canned_analysis_fk IS NULL'.format(tableName, hashTable)).scalar() if reuse else 0
+			reportDict.update({'unchanged': int(nRows-nChanged), 'changed': int(nChanged), 'deleted': int(nDeleted)})
+
+			# Nothing to do
+			if reuse and not reportDict['changed'] and not reportDict['deleted']:
+				return reportDict
+
+			# Update few changes in place, keeping the full-text index
+			if reuse and reportDict['changed']+reportDict['deleted'] <= rebuildFraction*max(nRows, 1):
+				with connection.begin():
+					connection.execute('DELETE s FROM `{}` s LEFT JOIN `{}` h ON h.canned_analysis_fk = s.canned_analysis_fk WHERE h.canned_analysis_fk IS NULL'.format(tableName, hashTable))
+					connection.execute('REPLACE INTO `{}` ({}) {}'.format(tableName, ', '.join(rowColumns), rowQuery.format(hashTable=hashTable)))
+				reportDict['updated'] = True
+				return reportDict
+
+			# Fill the new table, copying unchanged rows and rebuilding changed ones
+			connection.execute("CREATE TABLE `{}` ({}) ENGINE=InnoDB DEFAULT CHARSET=utf8 COMMENT='{}'".format(newTable, tableColumns, tableVersion))
+			if reuse:
+				connection.execute('INSERT INTO `{}` SELECT s.* FROM `{}` s JOIN `{}` h ON h.canned_analysis_fk = s.canned_analysis_fk AND h.changed = 0'.format(newTable, tableName, hashTable))
+			connection.execute('INSERT INTO `{}` ({}) {}'.format(newTable, ', '.join(rowColumns), rowQuery.format(hashTable=hashTable)))
+			connection.execute('ALTER TABLE `{}` ADD FULLTEXT INDEX search ({})'.format(newTable, ', '.join(fullTextColumns)))
+
+			# Swap
+			if liveVersion(connection, tableName) is None:
+				connection.execute('RENAME TABLE `{}` TO `{}`'.format(newTable, tableName))
+			else:
+				connection.execute('RENAME TABLE `{}` TO `{}`, `{}` TO `{}`'.format(tableName, oldTable, newTable, tableName))
+				connection.execute('DROP TABLE `{}`'.format(oldTable))
+			reportDict['swapped'] = True
+			return reportDict
+
+		# Clean up
+		finally:
+			connection.execute('DROP TABLE IF EXISTS `{}`'.format(hashTable))
+			connection.execute('DROP TABLE IF EXISTS `{}`'.format(newTable))
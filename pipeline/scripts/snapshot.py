@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+#################################################################
+#################################################################
+############### Datasets2Tools SQLite Snapshot ##################
+#################################################################
+#################################################################
+##### Author: Denis Torre
+##### Affiliation: Ma'ayan Laboratory,
+##### Icahn School of Medicine at Mount Sinai
+
+#############################################
+########## 1. Load libraries
+#############################################
+##### 1. Python modules #####
+import os, stat, json, sqlite3, hashlib, datetime, decimal
+
+##### 2. Custom modules #####
+import manifest
+
+#############################################
+########## 2. General Setup
+#############################################
+##### 1. Variables #####
+# Tables to export, by database
+snapshotTables = [('datasets2tools', ['tool', 'repository', 'dataset', 'term', 'canned_analysis', 'canned_analysis_metadata', 'featured_analysis', 'featured_dataset', 'featured_tool', 'canned_analysis_search']),
+				  ('datasets2tools_dev', ['processed_dataset', 'script'])]
+
+# SQLite affinity of MySQL column types; anything else is stored as text
+sqliteTypes = {'tinyint': 'INTEGER', 'smallint': 'INTEGER', 'mediumint': 'INTEGER', 'int': 'INTEGER', 'bigint': 'INTEGER', 'bit': 'INTEGER',
+			   'float': 'REAL', 'double': 'REAL', 'decimal': 'REAL',
+			   'binary': 'BLOB', 'varbinary': 'BLOB', 'tinyblob': 'BLOB', 'blob': 'BLOB', 'mediumblob': 'BLOB', 'longblob': 'BLOB'}
+
+# Memory map readers use, in bytes
+mmapSize = 1<<30
+
+#######################################################
+#######################################################
+########## S1. Definitions
+#######################################################
+#######################################################
+
+#############################################
+########## 1. Columns
+#############################################
+
+def tableColumns(engine, tableName):
+
+	# Get names and types in table order
+	return engine.execute('SELECT COLUMN_NAME, DATA_TYPE FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s ORDER BY ORDINAL_POSITION', tableName).fetchall()
+
+def primaryKey(engine, tableName):
+	return [x for x, in engine.execute("SELECT COLUMN_NAME FROM information_schema.STATISTICS WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = 'PRIMARY' ORDER BY SEQ_IN_INDEX", tableName).fetchall()]
+
+#############################################
+########## 2. Indexes
+#############################################
+
+def tableIndexes(engine, tableName):
+
+	# Get secondary indexes, leaving out full-text ones, which SQLite has no plain equivalent of
+	indexDict = {}
+	for indexName, nonUnique, columnName in engine.execute("SELECT INDEX_NAME, NON_UNIQUE, COLUMN_NAME FROM information_schema.STATISTICS WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME != 'PRIMARY' AND INDEX_TYPE != 'FULLTEXT' ORDER BY INDEX_NAME, SEQ_IN_INDEX", tableName).fetchall():
+		indexDict.setdefault(indexName, {'unique': not nonUnique, 'columns': []})['columns'].append(columnName)
+	return indexDict
+
+#######################################################
+#######################################################
+########## S2. Export
+#######################################################
+#######################################################
+
+#############################################
+########## 1. Values
+#############################################
+
+def sqliteValue(value):
+
+	# Convert the values the MySQL driver returns to ones SQLite stores
+	if isinstance(value, str):
+		return value.decode('utf-8', 'replace')
+	elif isinstance(value, (datetime.date, datetime.datetime, datetime.timedelta)):
+		return str(value) if isinstance(value, datetime.timedelta) else value.isoformat()
+	elif isinstance(value, decimal.Decimal):
+		return float(value)
+	elif isinstance(value, bytearray):
+		return buffer(value)
+	return value
+
+def hashRow(sha, row):
+
+	# Hash a converted row, telling NULL apart from empty text
+	sha.update('\x1e'.join(['\x00' if x is None else (str(x) if isinstance(x, buffer) else unicode(x).encode('utf-8')) for x in row]) + '\x1d')
+
+#############################################
+########## 2. Table
+#############################################
+
+def exportTable(engine, connection, tableName, chunkSize=10000):
+	'''
+	Copies one MySQL table into the open SQLite connection, streamed through a server-side
+	cursor chunkSize rows at a time in primary key order, so memory stays bounded.  Returns
+	the number of rows and a SHA-1 of their contents.
+	'''
+	# Create table, keeping a single integer primary key as the SQLite rowid
+	columns, keyColumns = tableColumns(engine, tableName), primaryKey(engine, tableName)
+	columnDefinitions = ['"{}" {}'.format(x, sqliteTypes.get(y, 'TEXT')) for x, y in columns]
+	if len(keyColumns) == 1 and sqliteTypes.get(dict(columns)[keyColumns[0]]) == 'INTEGER':
+		columnDefinitions[[x for x, y in columns].index(keyColumns[0])] += ' PRIMARY KEY'
+	elif keyColumns:
+		columnDefinitions.append('PRIMARY KEY ({})'.format(', '.join(['"{}"'.format(x) for x in keyColumns])))
+	connection.execute('CREATE TABLE "{}" ({})'.format(tableName, ', '.join(columnDefinitions)))
+
+	# Stream rows, ordered so the checksum does not depend on the server's read order
+	nRows, sha = 0, hashlib.sha1()
+	insert = 'INSERT INTO "{}" VALUES ({})'.format(tableName, ', '.join(['?']*len(columns)))
+	orderBy = ', '.join(['`{}`'.format(x) for x in keyColumns or [x for x, y in columns]])
+	with engine.connect() as mysqlConnection:
+		result = mysqlConnection.execution_options(stream_results=True).execute('SELECT {} FROM `{}` ORDER BY {}'.format(', '.join(['`{}`'.format(x) for x, y in columns]), tableName, orderBy))
+		for rows in iter(lambda: result.fetchmany(chunkSize), []):
+			rows = [[sqliteValue(x) for x in row] for row in rows]
+			connection.executemany(insert, rows)
+			for row in rows:
+				hashRow(sha, row)
+			nRows += len(rows)
+		result.close()
+
+	# Index
+	for indexName, indexDict in sorted(tableIndexes(engine, tableName).items()):
+		connection.execute('CREATE {}INDEX "{}_{}" ON "{}" ({})'.format('UNIQUE ' if indexDict['unique'] else '', tableName, indexName, tableName, ', '.join(['"{}"'.format(x) for x in indexDict['columns']])))
+	return nRows, sha.hexdigest()
+
+#############################################
+########## 3. Snapshot
+#############################################
+
+def exportSnapshot(engines, outfile, tables=snapshotTables, chunkSize=10000):
+	'''
+	Writes every table of tables that exists in its database, given engines by database name,
+	to a new SQLite file that is then compacted, made read-only and moved over outfile, so
+	readers never open a partial snapshot.  Row counts and content checksums of each table,
+	and one over all of them, are stored in its snapshot_info table and in outfile.json, with
+	the SHA-1 of the file itself.  Returns that report.
+	'''
+	# Start from an empty file, without a journal while it is private
+	tmpFile = outfile + '.tmp'
+	if os.path.exists(tmpFile):
+		os.remove(tmpFile)
+	connection = sqlite3.connect(tmpFile)
+	connection.execute('PRAGMA journal_mode = OFF')
+	connection.execute('PRAGMA synchronous = OFF')
+
+	# Export tables
+	reportDict = {'tables': {}, 'exported': datetime.datetime.utcnow().isoformat()}
+	try:
+		for database, tableNames in tables:
+			for tableName in tableNames:
+				if engines[database].has_table(tableName):
+					nRows, checksum = exportTable(engines[database], connection, tableName, chunkSize)
+					connection.commit()
+					reportDict['tables'][tableName] = {'database': database, 'rows': nRows, 'checksum': checksum}
+
+		# Store checksums
+		reportDict['checksum'] = hashlib.sha1(json.dumps(sorted([(x, y['checksum']) for x, y in reportDict['tables'].items()]))).hexdigest()
+		connection.execute('CREATE TABLE snapshot_info (table_name TEXT PRIMARY KEY, database_name TEXT, rows INTEGER, checksum TEXT)')
+		connection.executemany('INSERT INTO snapshot_info VALUES (?, ?, ?, ?)', [(x, y['database'], y['rows'], y['checksum']) for x, y in sorted(reportDict['tables'].items())])
+		connection.execute('INSERT INTO snapshot_info VALUES (?, NULL, ?, ?)', ('*', sum([x['rows'] for x in reportDict['tables'].values()]), reportDict['checksum']))
+		connection.commit()
+
+		# Compact, leaving a rollback journal mode that needs no writable side files to read
+		connection.execute('ANALYZE')
+		connection.execute('PRAGMA journal_mode = DELETE')
+		connection.execute('VACUUM')
+	finally:
+		connection.close()
+
+	# Make read-only and swap in
+	os.chmod(tmpFile, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+	os.rename(tmpFile, outfile)
+	reportDict['sha1'] = manifest.fileHash(outfile)
+	with open(outfile + '.json', 'w') as openfile:
+		json.dump(reportDict, openfile, indent=4)
+	return reportDict
+
+#######################################################
+#######################################################
+########## S3. Read
+#######################################################
+#######################################################
+
+#############################################
+########## 1. Open Snapshot
+#############################################
+
+def openSnapshot(snapshotFile, mmapSize=mmapSize):
+	'''
+	Opens a snapshot for reading, memory-mapped and with writes refused, which any number of
+	processes can do at once.  Each process should open its own connection.
+	'''
+	connection = sqlite3.connect(snapshotFile, check_same_thread=False)
+	connection.execute('PRAGMA query_only = ON')
+	connection.execute('PRAGMA mmap_size = {}'.format(int(mmapSize)))
+	return connection
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+#################################################################
+#################################################################
+############### Datasets2Tools Staging Files ####################
+#################################################################
+#################################################################
+##### Author: Denis Torre
+##### Affiliation: Ma'ayan Laboratory,
+##### Icahn School of Medicine at Mount Sinai
+
+#############################################
+########## 1. Load libraries
+#############################################
+##### 1. Python modules #####
+import os
+
+#############################################
+########## 2. General Setup
+#############################################
+##### 1. Variables #####
+# Format of intermediate files: 'tsv' (TSV, and Excel where the pipeline always used it), 'parquet' or 'arrow'
+stagingFormat = os.environ.get('D2T_STAGING_FORMAT', 'tsv')
+
+# Column types of each intermediate
+schemas = {'datasets': [('dataset_accession', 'string'), ('dataset_title', 'string'), ('dataset_description', 'string'), ('dataset_landing_url', 'string'), ('repository_fk', 'int64')],
+		   'repositories': [('id', 'int64'), ('repository_name', 'string'), ('repository_icon_url', 'string'), ('repository_description', 'string'), ('repository_homepage_url', 'string')],
+		   'featured-analysis': [('canned_analysis_fk', 'int64'), ('day', 'date')],
+		   'featured-dataset': [('dataset_fk', 'int64'), ('day', 'date')],
+		   'featured-tool': [('tool_fk', 'int64'), ('start_day', 'date'), ('end_day', 'date')]}
+
+# Intermediates kept in Excel in the TSV format
+excelStages = ['repositories']
+
+#######################################################
+#######################################################
+########## S1. Schemas
+#######################################################
+#######################################################
+
+#############################################
+########## 1. File Names
+#############################################
+
+def extension(schemaName=None):
+	if stagingFormat == 'tsv':
+		return '.xlsx' if schemaName in excelStages else '.txt'
+	return {'parquet': '.parquet', 'arrow': '.arrow'}[stagingFormat]
+
+#############################################
+########## 2. Columns and Types
+#############################################
+
+def columns(schemaName):
+	return [x for x, y in schemas[schemaName]]
+
+def sqlTypes(schemaName):
+	import sqlalchemy
+	typeDict = {'int64': sqlalchemy.types.Integer, 'date': sqlalchemy.types.Date, 'string': sqlalchemy.types.Text, 'float64': sqlalchemy.types.Float}
+	return {x: typeDict[y] for x, y in schemas[schemaName]}
+
+def arrowSchema(schemaName):
+	import pyarrow as pa
+	typeDict = {'int64': pa.int64(), 'date': pa.date32(), 'string': pa.string(), 'float64': pa.float64()}
+	return pa.schema([pa.field(x, typeDict[y]) for x, y in schemas[schemaName]])
+
+def applySchema(dataframe, schemaName):
+
+	# Order columns and convert types
+	import pandas as pd
+	dataframe = dataframe[columns(schemaName)].copy()
+	for column, columnType in schemas[schemaName]:
+		if columnType == 'date':
+			dataframe[column] = pd.to_datetime(dataframe[column]).dt.date
+		elif columnType == 'string':
+			dataframe[column] = [None if pd.isnull(x) else x.decode('utf-8', 'replace') if isinstance(x, str) else unicode(x) for x in dataframe[column]]
+		else:
+			dataframe[column] = dataframe[column].astype(columnType)
+	return dataframe
+
+#######################################################
+#######################################################
+########## S2. Read and Write
+#######################################################
+#######################################################
+
+#############################################
+########## 1. Write
+#############################################
+
+def writeStage(dataframe, outfile, schemaName):
+
+	# TSV and Excel, as the pipeline always wrote them
+	if outfile.endswith('.txt'):
+		dataframe.to_csv(outfile, sep='\t', index=False)
+	elif outfile.endswith('.xlsx'):
+		dataframe.to_excel(outfile, index=False)
+
+	# Columnar, with the explicit schema
+	else:
+		try:
+			import pyarrow as pa
+			import pyarrow.parquet as pq
+		except ImportError:
+			raise ImportError('Columnar staging needs pyarrow.  Install it or set D2T_STAGING_FORMAT=tsv.')
+		table = pa.Table.from_pandas(applySchema(dataframe, schemaName), schema=arrowSchema(schemaName), preserve_index=False)
+		if outfile.endswith('.parquet'):
+			pq.write_table(table, outfile)
+		else:
+			writer = pa.RecordBatchFileWriter(outfile, table.schema)
+			writer.write_table(table)
+			writer.close()
+
+class StageWriter:
+	'''
+	Appends dataframes to an intermediate as they are produced.  The file is written with
+	just its columns if nothing was appended by close.
+	'''
+	def __init__(self, outfile, schemaName):
+		self.outfile = outfile
+		self.schemaName = schemaName
+		self.writer = None
+		self.nRows = 0
+
+	def write(self, dataframe):
+
+		# TSV, with the header on the first write
+		dataframe = dataframe[columns(self.schemaName)]
+		if self.outfile.endswith('.txt'):
+			dataframe.to_csv(self.outfile, sep='\t', index=False, mode='a' if self.nRows else 'w', header=not self.nRows)
+
+		# Columnar, as one row group or record batch per write
+		else:
+			import pyarrow as pa
+			import pyarrow.parquet as pq
+			table = pa.Table.from_pandas(applySchema(dataframe, self.schemaName), schema=arrowSchema(self.schemaName), preserve_index=False)
+			if not self.writer:
+				self.writer = pq.ParquetWriter(self.outfile, table.schema) if self.outfile.endswith('.parquet') else pa.RecordBatchFileWriter(self.outfile, table.schema)
+			self.writer.write_table(table)
+		self.nRows += len(dataframe.index)
+
+	def close(self):
+		if self.writer:
+			self.writer.close()
+		elif not self.nRows:
+			import pandas as pd
+			writeStage(pd.DataFrame(columns=columns(self.schemaName)), self.outfile, self.schemaName)
+
+#############################################
+########## 2. Read
+#############################################
+
+def readStage(infile, columns=None):
+	'''
+	Reads an intermediate, only loading the given columns.  Parquet and Arrow files are
+	memory-mapped, so unselected columns are never read.
+	'''
+	# TSV and Excel
+	import pandas as pd
+	if infile.endswith('.txt'):
+		return pd.read_table(infile, usecols=columns)
+	elif infile.endswith('.xlsx'):
+		dataframe = pd.read_excel(infile)
+		return dataframe[columns] if columns else dataframe
+
+	# Columnar
+	import pyarrow as pa
+	import pyarrow.parquet as pq
+	if infile.endswith('.parquet'):
+		table = pq.read_table(infile, columns=columns, memory_map=True)
+	else:
+		table = pa.RecordBatchFileReader(pa.memory_map(infile, 'r')).read_all()
+		if columns:
+			table = pa.Table.from_arrays([table.column(x) for x in columns], names=columns)
+	return table.to_pandas()
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+#################################################################
+#################################################################
+############### Datasets2Tools Analysis Upload ##################
+#################################################################
+#################################################################
+##### Author: Denis Torre
+##### Affiliation: Ma'ayan Laboratory,
+##### Icahn School of Medicine at Mount Sinai
+
+#############################################
+########## 1. Load libraries
+#############################################
+##### 1. Python modules #####
+import os, json, gzip, time, hashlib, requests
+import pandas as pd
+from StringIO import StringIO
+from multiprocessing.pool import ThreadPool
+
+##### 2. Custom modules #####
+import metrics, manifest
+
+#######################################################
+#######################################################
+########## S1. Chunks
+#######################################################
+#######################################################
+
+#############################################
+########## 1. Keys
+#############################################
+
+def uploadId(infile, url, chunkSize):
+	return hashlib.sha1('{}:{}:{}'.format(manifest.fileHash(infile), url, chunkSize)).hexdigest()
+
+def chunkKey(uploadId, chunkIndex):
+	return hashlib.sha1('{}:{}'.format(uploadId, chunkIndex)).hexdigest()
+
+#############################################
+########## 2. Body
+#############################################
+
+def compressChunk(dataframe):
+
+	# One JSON record per line, gzipped
+	buffer = StringIO()
+	with gzip.GzipFile(fileobj=buffer, mode='wb') as gzipfile:
+		gzipfile.write(dataframe.to_json(orient='records', lines=True))
+	return buffer.getvalue()
+
+#######################################################
+#######################################################
+########## S2. Acknowledgements
+#######################################################
+#######################################################
+
+#############################################
+########## 1. Journal
+#############################################
+
+def readAcks(journalFile, uploadId):
+
+	# Get acknowledged chunks of this upload, ignoring those of other inputs
+	ackDict = {}
+	if os.path.exists(journalFile):
+		with open(journalFile) as openfile:
+			for line in openfile:
+				try:
+					ack = json.loads(line)
+				except ValueError:
+					continue
+				if ack['upload_id'] == uploadId:
+					ackDict[ack['chunk']] = ack['response']
+	return ackDict
+
+def writeAck(journalFile, uploadId, chunkIndex, response):
+	with open(journalFile, 'a') as openfile:
+		openfile.write(json.dumps({'upload_id': uploadId, 'chunk': chunkIndex, 'response': response}) + '\n')
+
+#######################################################
+#######################################################
+########## S3. Upload
+#######################################################
+#######################################################
+
+#############################################
+########## 1. Send Chunk
+#############################################
+
+def sendChunk(session, url, uploadId, chunkIndex, body, retries=3, timeout=300):
+
+	# Headers
+	key = chunkKey(uploadId, chunkIndex)
+	headers = {'Content-Type': 'application/x-ndjson', 'Content-Encoding': 'gzip', 'Idempotency-Key': key, 'X-Upload-Id': uploadId, 'X-Chunk-Index': str(chunkIndex)}
+
+	# Try, backing off on failure.  The key makes a resend of a chunk the server already has harmless.
+	for attempt in range(retries):
+		metrics.countHttpCall()
+		try:
+			response = session.post(url, data=body, headers=headers, timeout=timeout)
+			response.raise_for_status()
+			ack = response.json()
+			if ack.get('idempotency_key') != key:
+				raise ValueError('Chunk {} was not acknowledged: {}'.format(chunkIndex, response.text[:200]))
+			return ack
+		except Exception:
+			if attempt == retries-1:
+				raise
+			time.sleep(2**attempt)
+
+#############################################
+########## 2. Upload File
+#############################################
+
+def uploadFile(infile, outfile, url, chunkSize=5000, inFlight=3, filterChunk=None, **kwargs):
+	'''
+	Streams a canned-analysis file to url as gzipped NDJSON chunks of chunkSize rows, with up to
+	inFlight chunks sent at once over one keep-alive session.  Each chunk carries an
+	idempotency key derived from the file contents and its position, and counts as done only
+	once the server echoes the key back.  Acknowledgements are journaled next to outfile, so
+	a rerun after a failure skips the chunks already acknowledged.  Once every chunk is
+	acknowledged the acknowledgements are written to outfile in order and the journal removed.
+	filterChunk, if given, is applied to each chunk before it is sent, and chunks it leaves
+	empty are acknowledged locally instead of being sent.
+	'''
+	# Set up
+	journalFile = outfile + '.acks'
+	upload = uploadId(infile, url, chunkSize)
+	ackDict = readAcks(journalFile, upload)
+	session = requests.Session()
+	session.mount(url, requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=inFlight))
+	pool = ThreadPool(inFlight)
+	if ackDict:
+		print('Resuming upload of {} after {} acknowledged chunks.'.format(infile, len(ackDict)))
+
+	# Send a window of chunks, journaling each acknowledgement
+	def send(window):
+		def sendOne(chunk):
+			try:
+				return chunk[0], sendChunk(session, url, upload, chunk[0], chunk[1], **kwargs)
+			except Exception as e:
+				return chunk[0], e
+		errors = []
+		for chunkIndex, result in pool.map(sendOne, window):
+			if isinstance(result, Exception):
+				errors.append(result)
+			else:
+				writeAck(journalFile, upload, chunkIndex, result)
+				ackDict[chunkIndex] = result
+		if errors:
+			raise errors[0]
+
+	# Read one chunk at a time
+	try:
+		window, nChunks = [], 0
+		for chunkIndex, cannedAnalysisDataframe in enumerate(pd.read_table(infile, chunksize=chunkSize)):
+			nChunks += 1
+			metrics.addRows(rowsIn=len(cannedAnalysisDataframe.index))
+			if chunkIndex not in ackDict:
+				cannedAnalysisDataframe = filterChunk(cannedAnalysisDataframe) if filterChunk else cannedAnalysisDataframe
+
+				# Journal an empty chunk as skipped, so it keeps its place in outfile
+				if not len(cannedAnalysisDataframe.index):
+					ackDict[chunkIndex] = {'chunk': str(chunkIndex), 'records': 0, 'skipped': True}
+					writeAck(journalFile, upload, chunkIndex, ackDict[chunkIndex])
+				else:
+					window.append((chunkIndex, compressChunk(cannedAnalysisDataframe)))
+			if len(window) == inFlight:
+				send(window)
+				window = []
+		if window:
+			send(window)
+	finally:
+		pool.close()
+		session.close()
+
+	# Write outfile
+	with open(outfile, 'w') as openfile:
+		for chunkIndex in range(nChunks):
+			openfile.write(json.dumps(ackDict[chunkIndex]) + '\n')
+	if os.path.exists(journalFile):
+		os.remove(journalFile)
+	return nChunks